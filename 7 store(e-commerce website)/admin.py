@@ -1,5 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response
 from models import db, User, Product, Order
+from catalog import product_changed
+from identity import forget_user
+from metrics import render_prometheus, metrics_dir
+from analytics import COUNTED_STATUSES, record_sales, store_summary
+from inventory import release_reservations
+from orders import mark_orders_paid
+from sqlalchemy import func, case, or_
+from sqlalchemy.orm import joinedload
 from flask_login import login_required, current_user
 from functools import wraps
 
@@ -14,14 +22,111 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
+ORDER_STATUSES = ("pending", "paid", "shipped", "cancelled", "expired")
+
+
+def _keyset_page(query, id_col):
+    """
+    One page of `query`, newest id first, continuing below the `before` id.
+    Returns (rows, next_before).
+    """
+    per_page = current_app.config.get("ADMIN_PER_PAGE", 50)
+    before = request.args.get("before", type=int)
+    if before:
+        query = query.filter(id_col < before)
+    rows = query.order_by(id_col.desc()).limit(per_page + 1).all()
+    next_before = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_before = rows[-1].id
+    return rows, next_before
+
+
+def _back(default_endpoint):
+    return redirect(request.referrer or url_for(default_endpoint))
+
+
 @admin_bp.route("/dashboard")
 @login_required
 @admin_required
 def dashboard():
-    users = User.query.all()
-    products = Product.query.all()
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template("admin_dashboard.html", users=users, products=products, orders=orders)
+    # headline numbers come straight from SQL aggregates, never from loading rows
+    user_count, seller_count, admin_count = db.session.query(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.is_seller == True, 1), else_=0)), 0),  # noqa: E712
+        func.coalesce(func.sum(case((User.is_admin == True, 1), else_=0)), 0),  # noqa: E712
+    ).one()
+    product_count = db.session.query(func.count(Product.id)).scalar()
+    by_status = dict(
+        db.session.query(Order.status, func.count(Order.id)).group_by(Order.status).order_by(Order.status).all()
+    )
+    sales = store_summary()
+    stats = {
+        "users": user_count,
+        "sellers": seller_count,
+        "admins": admin_count,
+        "products": product_count,
+        "orders": sum(by_status.values()),
+        "orders_by_status": by_status,
+        "gmv": sales["all_time"]["revenue"],
+    }
+    return render_template("admin_dashboard.html", stats=stats, sales=sales)
+
+
+@admin_bp.route("/users")
+@login_required
+@admin_required
+def users():
+    q = request.args.get("q", "").strip()
+    role = request.args.get("role", "")
+    query = User.query
+    if q:
+        query = query.filter(or_(User.username.ilike(f"{q}%"), User.email.ilike(f"{q}%")))
+    if role == "seller":
+        query = query.filter(User.is_seller == True)  # noqa: E712
+    elif role == "admin":
+        query = query.filter(User.is_admin == True)  # noqa: E712
+    rows, next_before = _keyset_page(query, User.id)
+    return render_template("admin_users.html", users=rows, next_before=next_before, q=q, role=role)
+
+
+@admin_bp.route("/products")
+@login_required
+@admin_required
+def products():
+    q = request.args.get("q", "").strip()
+    seller_id = request.args.get("seller_id", type=int)
+    query = Product.query.options(joinedload(Product.seller))
+    if q:
+        query = query.filter(Product.name.ilike(f"{q}%"))
+    if seller_id:
+        query = query.filter(Product.seller_id == seller_id)
+    rows, next_before = _keyset_page(query, Product.id)
+    return render_template("admin_products.html", products=rows, next_before=next_before, q=q, seller_id=seller_id)
+
+
+@admin_bp.route("/orders")
+@login_required
+@admin_required
+def orders():
+    status = request.args.get("status", "")
+    user_id = request.args.get("user_id", type=int)
+    query = Order.query
+    if status:
+        query = query.filter(Order.status == status)
+    if user_id:
+        query = query.filter(Order.user_id == user_id)
+    rows, next_before = _keyset_page(query, Order.id)
+    return render_template("admin_orders.html", orders=rows, next_before=next_before,
+                           status=status, user_id=user_id, statuses=ORDER_STATUSES)
+
+@admin_bp.route("/metrics")
+@login_required
+@admin_required
+def metrics():
+    # Prometheus text format, summed over every worker process
+    return Response(render_prometheus(metrics_dir()), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 
 @admin_bp.route("/user/<int:uid>/toggle_seller", methods=["POST"])
 @login_required
@@ -30,8 +135,9 @@ def toggle_seller(uid):
     u = User.query.get_or_404(uid)
     u.is_seller = not u.is_seller
     db.session.commit()
+    forget_user(u.id)
     flash("Seller flag toggled.", "info")
-    return redirect(url_for("admin.dashboard"))
+    return _back("admin.users")
 
 @admin_bp.route("/user/<int:uid>/toggle_admin", methods=["POST"])
 @login_required
@@ -40,8 +146,9 @@ def toggle_admin(uid):
     u = User.query.get_or_404(uid)
     u.is_admin = not u.is_admin
     db.session.commit()
+    forget_user(u.id)
     flash("Admin flag toggled.", "info")
-    return redirect(url_for("admin.dashboard"))
+    return _back("admin.users")
 
 @admin_bp.route("/product/<int:pid>/delete", methods=["POST"])
 @login_required
@@ -50,8 +157,9 @@ def product_delete(pid):
     p = Product.query.get_or_404(pid)
     db.session.delete(p)
     db.session.commit()
+    product_changed(p.slug)
     flash("Product removed.", "info")
-    return redirect(url_for("admin.dashboard"))
+    return _back("admin.products")
 
 @admin_bp.route("/order/<int:oid>/set_status", methods=["POST"])
 @login_required
@@ -59,8 +167,17 @@ def product_delete(pid):
 def set_order_status(oid):
     o = Order.query.get_or_404(oid)
     status = request.form.get("status")
-    if status:
+    if status and status != o.status:
+        if o.status == "pending" and status in COUNTED_STATUSES:
+            # as if Stripe had confirmed it: the held stock becomes a sale and the rollups count it
+            mark_orders_paid({o.id: o.payment_intent})
+        else:
+            if o.status == "pending":
+                release_reservations([o.id])  # cancelled or expired by hand: the stock goes back on sale
+            counted = o.status in COUNTED_STATUSES
+            if counted != (status in COUNTED_STATUSES):
+                record_sales([o.id], -1 if counted else 1)
         o.status = status
         db.session.commit()
         flash("Order status updated.", "info")
-    return redirect(url_for("admin.dashboard"))
+    return _back("admin.orders")
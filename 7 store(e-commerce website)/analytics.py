@@ -0,0 +1,189 @@
+"""
+Sales rollups for the seller and admin dashboards.
+
+Two tables hold daily aggregates of paid (and later shipped) orders:
+product_sales_daily per product and seller_sales_daily per seller, each
+with units, revenue and the number of orders. A sale is counted on the
+day the order was placed, so an incremental update and a rebuild from
+history always agree.
+
+The rollups are updated in the same transaction that moves orders to
+'paid' (mark_orders_paid, used by the webhook worker and the success
+redirect). That is one INSERT ... SELECT ... ON CONFLICT DO UPDATE per
+table over the newly paid orders' items. An admin status change in or out
+of paid/shipped applies the same delta with the opposite sign.
+`flask rebuild-rollups` recomputes them from the order history.
+
+Sales are credited to the seller recorded on the order item at checkout
+(OrderItem.seller_id), not the product's current seller, so a reversal
+after a product changes hands takes the sale back from the seller who got
+it. Items from before that column existed fall back to the product's
+seller until `flask init-db` backfills them.
+
+Dashboards only read the rollup rows for the days they show, so their
+cost depends on the window and catalog size, not on how many orders exist.
+"""
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Order, OrderItem, Product, User, ProductSalesDaily, SellerSalesDaily
+
+# orders in these states count as sales
+COUNTED_STATUSES = ("paid", "shipped")
+
+MEASURES = ("units", "revenue", "orders")
+
+
+def _measures(sign):
+    return (
+        (func.sum(OrderItem.quantity) * sign).label("units"),
+        (func.sum(OrderItem.quantity * OrderItem.unit_price) * sign).label("revenue"),
+        (func.count(func.distinct(OrderItem.order_id)) * sign).label("orders"),
+    )
+
+
+def _upsert(model, keys, extra, rows):
+    stmt = sqlite_insert(model).from_select(keys + extra + list(MEASURES), rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={m: getattr(model, m) + getattr(stmt.excluded, m) for m in MEASURES},
+    ))
+
+
+def _apply(condition, sign):
+    day = func.date(Order.created_at)
+    seller = func.coalesce(OrderItem.seller_id, Product.seller_id, 0)
+    items = (select()
+             .select_from(OrderItem)
+             .join(Order, Order.id == OrderItem.order_id)
+             .outerjoin(Product, Product.id == OrderItem.product_id)
+             .where(condition))
+    _upsert(ProductSalesDaily, ["product_id", "day"], ["seller_id"],
+            items.add_columns(OrderItem.product_id, day, seller, *_measures(sign))
+            .group_by(OrderItem.product_id, day))
+    _upsert(SellerSalesDaily, ["seller_id", "day"], [],
+            items.add_columns(seller, day, *_measures(sign))
+            .group_by(seller, day))
+
+
+def record_sales(order_ids, sign=1):
+    """Add (sign=1) or remove (sign=-1) these orders' items in the rollups. The caller commits."""
+    if order_ids:
+        _apply(Order.id.in_(list(order_ids)), sign)
+
+
+def backfill_item_sellers(batch_size=5000):
+    """Record the seller on order items placed before OrderItem.seller_id existed. Returns the count."""
+    current = (select(func.coalesce(Product.seller_id, 0))
+               .where(Product.id == OrderItem.product_id)
+               .scalar_subquery())
+    done = 0
+    while True:
+        batch = select(OrderItem.id).where(OrderItem.seller_id.is_(None)).limit(batch_size).scalar_subquery()
+        n = db.session.execute(
+            update(OrderItem)
+            .where(OrderItem.id.in_(batch))
+            .values(seller_id=func.coalesce(current, 0))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if not n:
+            return done
+        done += n
+
+
+def rebuild_rollups(since=None):
+    """Recompute the rollups from orders placed on or after `since` (a date; default: all). Commits."""
+    condition = Order.status.in_(COUNTED_STATUSES)
+    product_rows = delete(ProductSalesDaily)
+    seller_rows = delete(SellerSalesDaily)
+    if since:
+        condition &= Order.created_at >= datetime.combine(since, datetime.min.time())
+        product_rows = product_rows.where(ProductSalesDaily.day >= since)
+        seller_rows = seller_rows.where(SellerSalesDaily.day >= since)
+    # one transaction: dashboards never see a half-built table, and concurrent
+    # payments wait for the write lock instead of being counted twice
+    db.session.execute(product_rows)
+    db.session.execute(seller_rows)
+    _apply(condition, 1)
+    db.session.commit()
+
+
+def window_start(days=None):
+    days = days or current_app.config.get("ANALYTICS_DAYS", 30)
+    return datetime.utcnow().date() - timedelta(days=days - 1)
+
+
+def _totals(model, *conditions, measures=MEASURES):
+    row = db.session.query(
+        *(func.coalesce(func.sum(getattr(model, m)), 0) for m in measures)
+    ).filter(*conditions).one()
+    return dict(zip(measures, row))
+
+
+def _top_products(*conditions, limit=10):
+    units = func.sum(ProductSalesDaily.units)
+    revenue = func.sum(ProductSalesDaily.revenue)
+    return (db.session.query(ProductSalesDaily.product_id, Product.name, units.label("units"), revenue.label("revenue"))
+            .outerjoin(Product, Product.id == ProductSalesDaily.product_id)
+            .filter(*conditions)
+            .group_by(ProductSalesDaily.product_id)
+            .having(units > 0)
+            .order_by(revenue.desc())
+            .limit(limit)
+            .all())
+
+
+def seller_summary(seller_id, days=None):
+    """Totals, a per-day series and the best sellers for one seller over the last `days` days."""
+    start = window_start(days)
+    in_window = (SellerSalesDaily.seller_id == seller_id, SellerSalesDaily.day >= start)
+    daily = (db.session.query(SellerSalesDaily.day, *(getattr(SellerSalesDaily, m) for m in MEASURES))
+             .filter(*in_window)
+             .order_by(SellerSalesDaily.day.desc())
+             .all())
+    return {
+        "since": start,
+        "totals": _totals(SellerSalesDaily, *in_window),
+        "daily": daily,
+        "top_products": _top_products(ProductSalesDaily.seller_id == seller_id, ProductSalesDaily.day >= start),
+    }
+
+
+def store_summary(days=None):
+    """Store-wide totals, best sellers and best products over the last `days` days."""
+    start = window_start(days)
+    revenue = func.sum(SellerSalesDaily.revenue)
+    top_sellers = (db.session.query(SellerSalesDaily.seller_id, User.username,
+                                    func.sum(SellerSalesDaily.units).label("units"), revenue.label("revenue"))
+                   .outerjoin(User, User.id == SellerSalesDaily.seller_id)
+                   .filter(SellerSalesDaily.day >= start)
+                   .group_by(SellerSalesDaily.seller_id)
+                   .having(revenue > 0)
+                   .order_by(revenue.desc())
+                   .limit(10)
+                   .all())
+    # an order with several sellers' products counts once per seller, so the
+    # per-seller order counts are not summed into a store-wide figure
+    store = ("units", "revenue")
+    return {
+        "since": start,
+        "totals": _totals(SellerSalesDaily, SellerSalesDaily.day >= start, measures=store),
+        # one row per seller per day with sales, however many orders there are
+        "all_time": _totals(SellerSalesDaily, measures=store),
+        "top_sellers": top_sellers,
+        "top_products": _top_products(ProductSalesDaily.day >= start),
+    }
+
+
+def init_analytics(app):
+    @app.cli.command("rebuild-rollups")
+    @click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+                  help="Only rebuild days from this date (YYYY-MM-DD). Default: everything.")
+    def rebuild_rollups_command(since):
+        """Recompute the daily sales rollups from the order history."""
+        rebuild_rollups(since.date() if since else None)
+        days = db.session.query(func.count()).select_from(SellerSalesDaily).scalar()
+        click.echo(f"rebuilt sales rollups ({days} seller-day row(s))")
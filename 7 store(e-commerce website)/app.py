@@ -1,11 +1,9 @@
-import os
 from datetime import datetime
-from flask import Flask, render_template, redirect, url_for, flash, session, request, send_from_directory
+from flask import Flask, render_template, redirect, url_for, flash, request
 from config import Config
 from werkzeug.utils import secure_filename
 from flask_login import LoginManager
 from flask_wtf import CSRFProtect
-import stripe
 
 # import models inside create_app to avoid circular import issues
 def create_app(config_class=Config):
@@ -13,13 +11,34 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # init extensions
-    from models import db, User  # models must exist
-    db.init_app(app)
+    from models import db  # models must exist
+    from database import init_database
+    init_database(app, db)  # engine profile (WAL, pragmas, pools) and the read-only engine
+
+    # per-request timings (first, so its after_request hook runs last)
+    from metrics import init_metrics
+    init_metrics(app)
 
     # CSRF
     csrf = CSRFProtect()
     csrf.init_app(app)
 
+    # shared fragment cache for catalog pages
+    from cache import init_cache
+    init_cache(app)
+
+    # catalog version counter, ETags for catalog pages, fingerprinted static URLs
+    from catalog import init_catalog
+    from conditional import init_conditional
+    from assets import init_assets
+    init_catalog(app)
+    init_conditional(app)
+    init_assets(app)
+
+    # password hashing pool (login/register)
+    from passwords import init_passwords
+    init_passwords(app)
+
     # login manager
     login_manager = LoginManager()
     login_manager.login_view = "auth.login"
@@ -30,12 +49,45 @@ def create_app(config_class=Config):
     def inject_now():
         return {"now": datetime.utcnow}
 
-    # inject cart quantity
+    # server-side carts; the header badge reads a cached per-cart counter
+    from cart import init_cart, cart_quantity
+    init_cart(app)
+
     @app.context_processor
     def inject_cart_quantity():
-        cart = session.get("cart", {}) or {}
-        qty = sum(int(v) for v in cart.values())
-        return {"cart_quantity": qty}
+        return {"cart_quantity": cart_quantity()}
+
+    # image derivative helpers (srcset) and their backfill command
+    from images import init_images
+    init_images(app)
+
+    # content-addressed uploads (served by /uploads below)
+    from storage import init_storage, send_upload
+    init_storage(app)
+
+    from webhooks import enqueue_event, init_webhooks
+
+    # bulk catalog import/export commands
+    from catalog_io import init_catalog_io
+    init_catalog_io(app)
+
+    # stock reservations and their expiry sweeper command
+    from inventory import init_inventory
+    init_inventory(app)
+
+    # search-as-you-type index (/search/suggest) and its snapshot rebuild command
+    from autocomplete import init_autocomplete
+    init_autocomplete(app)
+
+    # order summary backfill command, and the reaper for abandoned checkouts
+    from orders import init_orders
+    from reaper import init_reaper
+    init_orders(app)
+    init_reaper(app)
+
+    # daily sales rollups for the dashboards and their rebuild command
+    from analytics import init_analytics
+    init_analytics(app)
 
     # template filter for INR
     @app.template_filter("inr")
@@ -45,8 +97,9 @@ def create_app(config_class=Config):
         except Exception:
             return value
 
-    # stripe
-    stripe.api_key = app.config.get("STRIPE_SECRET_KEY")
+    # Stripe client (pooled, timeout-bounded; built lazily per worker process)
+    from payments import init_payments
+    init_payments(app)
 
     # register blueprints (import here to avoid circular)
     from auth import auth_bp
@@ -59,20 +112,24 @@ def create_app(config_class=Config):
     app.register_blueprint(seller_bp)
     app.register_blueprint(admin_bp)
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # signed-in user cache; role changes call identity.forget_user
+    from identity import init_identity, load_user
+    init_identity(app)
+    login_manager.user_loader(load_user)
+
     # Serve uploaded images from static/images via a friendly endpoint
     @app.route("/uploads/<path:filename>")
     def uploaded_file(filename):
-        # static/images is the folder we use for uploaded product images
-        images_dir = os.path.join(app.root_path, "static", "images")
-        return send_from_directory(images_dir, filename)
+        # UPLOAD_FOLDER (static/images by default) holds uploads and their derivatives
+        return send_upload(filename)
     
-        # Stripe webhook endpoint (CSRF exempt)
+    # Stripe webhook endpoint (CSRF exempt): verify, queue, acknowledge.
+    # The queue is drained by `flask process-webhooks` (see webhooks.py).
     @app.route("/stripe/webhook", methods=["POST"])
     @csrf.exempt
     def stripe_webhook():
+        import stripe  # heavy; imported on first use (gunicorn.conf.py preloads it in the master)
+
         payload = request.get_data()
         sig_header = request.headers.get("Stripe-Signature", None)
         webhook_secret = app.config.get("STRIPE_WEBHOOK_SECRET")
@@ -81,41 +138,28 @@ def create_app(config_class=Config):
             event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
         except ValueError as e:
             # Invalid payload
-            current_app.logger.error("Invalid webhook payload: %s", e)
+            app.logger.error("Invalid webhook payload: %s", e)
             return ("Bad payload", 400)
         except stripe.error.SignatureVerificationError as e:
-            current_app.logger.error("Invalid signature: %s", e)
+            app.logger.error("Invalid signature: %s", e)
             return ("Bad signature", 400)
 
-        # Handle the checkout.session.completed event
-        if event["type"] == "checkout.session.completed":
-            session_obj = event["data"]["object"]
-            order_id = session_obj.get("metadata", {}).get("order_id")
-            # mark order as paid
-            if order_id:
-                try:
-                    from models import db, Order
-                    o = Order.query.get(int(order_id))
-                    if o:
-                        o.status = "paid"
-                        o.payment_intent = session_obj.get("payment_intent")
-                        db.session.commit()
-                        current_app.logger.info("Order %s marked as paid", order_id)
-                        # optionally clear cart for this user (if stored server-side)
-                except Exception as e:
-                    current_app.logger.error("Webhook DB update failed: %s", e)
-
+        if not enqueue_event(event["id"], event["type"], payload.decode("utf-8")):
+            app.logger.info("Duplicate webhook event %s ignored", event["id"])
         return ("", 200)
 
+    init_webhooks(app)
 
-    # create tables on first request if they don't exist (safe for dev)
-    @app.before_first_request
-    def create_tables():
-        db.create_all()
+    # schema setup runs once per deploy (`flask init-db`), not in the workers
+    from schema import init_schema_commands
+    init_schema_commands(app)
 
     return app
 
 # run
 if __name__ == "__main__":
     app = create_app()
+    with app.app_context():
+        from schema import init_schema
+        init_schema()  # the dev server sets up its own database
     app.run(host="0.0.0.0", debug=True)
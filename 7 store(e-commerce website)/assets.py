@@ -0,0 +1,70 @@
+"""
+Fingerprinted static assets.
+
+url_for("static", filename=...) adds ?v=<content hash> to every static URL,
+so the URL changes whenever the file does. A request whose v matches the
+file's current hash is served with a year of "Cache-Control: immutable",
+and browsers stop revalidating it. Requests without v, or with the hash of
+an older version, get the usual conditional handling.
+
+Hashes are computed once per file and process. In debug mode the file's
+mtime is checked on every call, so edits show up without a restart.
+"""
+import hashlib
+import os
+import threading
+from flask import current_app, request
+from storage import IMMUTABLE_MAX_AGE
+
+
+class Fingerprints:
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}  # filename -> (mtime, hash)
+        self._lock = threading.Lock()
+
+    def get(self, filename, check_mtime=False):
+        cached = self._hashes.get(filename)
+        if cached and not check_mtime:
+            return cached[1]
+        path = os.path.join(self.folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if cached and cached[0] == mtime:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(64 * 1024), b""):
+                digest.update(chunk)
+        value = digest.hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (mtime, value)
+        return value
+
+
+def _fingerprint_url(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = current_app.extensions["static_fingerprints"].get(values["filename"], current_app.debug)
+        if version:
+            values["v"] = version
+
+
+def _cache_static(response):
+    if request.endpoint == "static" and response.status_code in (200, 206, 304):
+        version = request.args.get("v")
+        filename = (request.view_args or {}).get("filename")
+        fingerprints = current_app.extensions["static_fingerprints"]
+        if version and filename and version == fingerprints.get(filename, current_app.debug):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+    return response
+
+
+def init_assets(app):
+    app.extensions["static_fingerprints"] = Fingerprints(app.static_folder)
+    app.url_defaults(_fingerprint_url)
+    app.after_request(_cache_static)
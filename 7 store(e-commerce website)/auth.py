@@ -1,11 +1,21 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, make_response
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db, User, SellerProfile
 from forms import RegisterForm, LoginForm
-from werkzeug.security import generate_password_hash
+from cart import merge_guest_cart
+from passwords import HasherBusy, hash_password, verify_password
 
 auth_bp = Blueprint("auth", __name__, template_folder="templates", url_prefix="/auth")
 
+
+def _busy(template, form):
+    # password hashing is saturated (login storm): shed this one instead of queueing
+    flash("We're handling a lot of sign-ins right now. Please try again in a few seconds.", "warning")
+    response = make_response(render_template(template, form=form), 503)
+    response.headers["Retry-After"] = "5"
+    return response
+
+
 @auth_bp.route("/register", methods=["GET", "POST"])
 def register():
     if current_user.is_authenticated:
@@ -18,7 +28,10 @@ def register():
             flash("User with that username/email already exists.", "warning")
             return redirect(url_for("auth.register"))
         u = User(username=form.username.data, email=form.email.data)
-        u.set_password(form.password.data)
+        try:
+            u.password_hash = hash_password(form.password.data)
+        except HasherBusy:
+            return _busy("register.html", form)
         # if they checked a "seller" box, you could set is_seller here. For now basic customer.
         db.session.add(u)
         db.session.commit()
@@ -34,8 +47,19 @@ def login():
     if form.validate_on_submit():
         # Allow login with username or email
         user = User.query.filter((User.username == form.username.data) | (User.email == form.username.data)).first()
-        if user and user.check_password(form.password.data):
+        ok, upgraded = False, None
+        if user:
+            try:
+                ok, upgraded = verify_password(user.password_hash, form.password.data)
+            except HasherBusy:
+                return _busy("login.html", form)
+        if ok:
+            if upgraded:
+                # stored with an older method or cost: replace it while we have the password
+                user.password_hash = upgraded
+                db.session.commit()
             login_user(user)
+            merge_guest_cart(user.id)
             flash("Logged in successfully.", "success")
             next_page = request.args.get("next")
             return redirect(next_page or url_for("shop.home"))
@@ -0,0 +1,559 @@
+"""
+Search-as-you-type suggestions from an in-process prefix index.
+
+GET /search/suggest?q=wireless he answers from memory with up to
+AUTOCOMPLETE_PRODUCTS products and AUTOCOMPLETE_QUERIES popular searches.
+Products match the way the search page matches them (search.py): every
+word must be in the name, and the last one may be a prefix. Only the few
+products shown are read from the database, by primary key.
+
+PrefixIndex keeps every distinct word of the product names in a sorted
+list, so the words starting with a prefix are one bisect range. Each word
+has a posting list: the products using it, in rank order. All the posting
+lists sit back to back in one array of 64-bit keys, and word i owns
+keys[starts[i]:starts[i + 1]]. A key encodes both rank and id: best sellers
+come first (units over the last AUTOCOMPLETE_POPULAR_DAYS days), then the
+newest products. A lookup merges the posting lists of the words matching
+the prefix and stops after the first few hits. A third array holds the
+best key of every range of words as a binary tree, so a one-letter prefix
+matching thousands of words only opens the lists that can still win. The
+other typed words are checked by seeking in their own posting lists, which
+skips whole runs of products at a time.
+
+Popular queries are searches that found products. Each process counts them
+and adds its counts to the search_query table every
+AUTOCOMPLETE_QUERY_FLUSH seconds. The most frequent ones are held in a
+sorted list next to the index.
+
+Building the index reads the whole catalog, which takes seconds for a
+million products. The result is therefore saved as a snapshot
+(AUTOCOMPLETE_INDEX_PATH, default instance/autocomplete.idx) that loads in a
+fraction of that time. With gunicorn's preload the master loads it before
+forking, and every worker shares it. `flask build-autocomplete` rebuilds
+the snapshot, which also re-ranks the products; run it from a scheduler
+(nightly, say). Workers pick up a new snapshot within AUTOCOMPLETE_REFRESH
+seconds, and reload popular queries on the same cadence.
+
+Between rebuilds the index is updated in place. catalog.product_changed
+bumps the catalog version in any worker. The next lookup in each process
+then reads the products updated since its last sync (ix_product_updated_at)
+and indexes their new words. Words a product has lost, and deleted
+products, stay in the posting lists. Every hit is checked against the
+product row before it is shown, and a deleted product is skipped from then
+on.
+"""
+import bisect
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import islice
+import click
+from flask import current_app, url_for
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from catalog import catalog_version
+from database import READER
+from models import db, Product, ProductSalesDaily, SearchQuery
+from search import tokenize
+
+SNAPSHOT_MAGIC = b"7store-autocomplete 1\n"
+MAX_QUERIES = 20000  # popular queries held in memory
+MAX_PHRASE = 100  # SearchQuery.phrase length
+_ID_BITS = 32
+_ID_MASK = (1 << _ID_BITS) - 1
+_NO_KEY = (1 << 63) - 1
+# slack on top of the busy timeout in _sync_overlap()
+_SYNC_MARGIN = timedelta(seconds=5)
+
+
+def rank_key(product_id, units=0):
+    """A product's key in the posting lists: lower sorts first (more units sold, then newer)."""
+    return -((units << _ID_BITS) | product_id)
+
+
+def key_id(key):
+    return -key & _ID_MASK
+
+
+def _successor(prefix):
+    """The smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _seek(postings, key):
+    """Smallest key >= `key` in any of the (sequence, lo, hi) posting slices, or None."""
+    best = None
+    for seq, lo, hi in postings:
+        i = bisect.bisect_left(seq, key, lo, hi)
+        if i < hi and (best is None or seq[i] < best):
+            best = seq[i]
+    return best
+
+
+def _min_tree(heads):
+    """Minima over `heads` as an implicit binary tree: node j has children 2j and 2j + 1, leaves start at len // 2."""
+    level = array("q", heads)
+    size = 1
+    while size < len(level):
+        size *= 2
+    level.extend([_NO_KEY] * (size - len(level)))
+    levels = [level]
+    while len(level) > 1:
+        level = array("q", map(min, level[::2], level[1::2]))
+        levels.append(level)
+    tree = array("q", [_NO_KEY])  # node 0 is unused
+    for level in reversed(levels):
+        tree.extend(level)
+    return tree
+
+
+def _cover(lo, hi):
+    """The tree nodes that between them hold exactly leaves lo..hi - 1 (given as node numbers)."""
+    nodes = []
+    while lo < hi:
+        if lo & 1:
+            nodes.append(lo)
+            lo += 1
+        if hi & 1:
+            hi -= 1
+            nodes.append(hi)
+        lo >>= 1
+        hi >>= 1
+    return nodes
+
+
+class QueryIndex:
+    """Popular searches, sorted by phrase, with how often each was run."""
+
+    def __init__(self, rows=()):
+        rows = sorted(rows)
+        self.phrases = [phrase for phrase, _ in rows]
+        self.hits = [hits for _, hits in rows]
+
+    def top(self, text, limit):
+        """The `limit` most frequent phrases extending `text` (other than `text` itself)."""
+        if not text or limit <= 0:
+            return []
+        lo = bisect.bisect_left(self.phrases, text)
+        hi = bisect.bisect_left(self.phrases, _successor(text), lo)
+        best = heapq.nlargest(limit + 1, range(lo, hi), key=self.hits.__getitem__)
+        return [self.phrases[i] for i in best if self.phrases[i] != text][:limit]
+
+
+class PrefixIndex:
+    """Words of product names -> products using them, in rank order (see the module docstring)."""
+
+    def __init__(self, terms, starts, keys, tree, units, watermark, recent):
+        self.terms = terms  # sorted distinct words
+        self.starts = starts  # array('q'): word i owns keys[starts[i]:starts[i + 1]]
+        self.keys = keys  # array('q'): the posting lists, back to back
+        self.tree = tree  # array('q'): _min_tree of each word's first (best) key
+        self.units = units  # product id -> units sold, for products with sales
+        self.watermark = watermark  # newest product.updated_at indexed
+        self.recent = recent  # id -> updated_at of the rows indexed within _sync_overlap() of it
+        self.extra = {}  # word -> sorted keys added since the build
+        self.extra_terms = []  # sorted words of self.extra
+        self.dead = set()  # ids of products found deleted
+        self.queries = QueryIndex()
+        self.version = None  # catalog version at the last sync
+        self.snapshot = None  # (mtime_ns, size) of the snapshot file it came from
+
+    @classmethod
+    def build(cls, products, units, watermark, recent):
+        """Index (id, name) rows, given in descending id order."""
+        sold, post = [], {}
+        get = post.get
+        for product_id, name in products:
+            if product_id in units:
+                sold.append((rank_key(product_id, units[product_id]), name))
+                continue
+            key = -product_id  # rank_key with no sales
+            for term in tokenize(name):
+                keys = get(term)
+                if keys is None:
+                    post[term] = [key]
+                else:
+                    keys.append(key)
+        # best sellers go in front of every posting list
+        top = {}
+        for key, name in sorted(sold):
+            for term in tokenize(name):
+                top.setdefault(term, []).append(key)
+        terms = sorted(post.keys() | top.keys())
+        starts, keys = array("q", [0]), array("q")
+        for term in terms:
+            keys.extend(top.get(term, ()))
+            keys.extend(post.get(term, ()))
+            starts.append(len(keys))
+        tree = _min_tree(map(keys.__getitem__, starts[:-1]))
+        return cls(terms, starts, keys, tree, units, watermark, recent)
+
+    def _postings(self, term):
+        """Posting slices of one word: its built list and what was added since."""
+        found = []
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            found.append((self.keys, self.starts[i], self.starts[i + 1]))
+        extra = self.extra.get(term)
+        if extra:
+            found.append((extra, 0, len(extra)))
+        return found
+
+    def matches(self, words):
+        """
+        Yield ids of products matching `words` (the last one a prefix), best
+        ranked first.
+
+        A short prefix can match a great many words, so their posting lists
+        are not all opened up front. The heap starts with the few tree nodes
+        covering those words, keyed by the best first key below them, and a
+        node is only split (down to a word's posting list) once that key is
+        the smallest left.
+        """
+        *whole, prefix = words
+        required = [self._postings(word) for word in whole]
+        if not all(required):
+            return
+        keys, starts, tree = self.keys, self.starts, self.tree
+        leaves = len(tree) // 2
+        end = _successor(prefix)
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, end, lo)
+        # (key, n, pos): stream n at position pos; (key, -j, 0): tree node j
+        heap = [(tree[j], -j, 0) for j in _cover(lo + leaves, hi + leaves)]
+        streams = []  # (sequence, end) of each posting list opened
+        lo = bisect.bisect_left(self.extra_terms, prefix)
+        hi = bisect.bisect_left(self.extra_terms, end, lo)
+        for term in self.extra_terms[lo:hi]:
+            extra = self.extra[term]
+            heap.append((extra[0], len(streams), 0))
+            streams.append((extra, len(extra)))
+        heapq.heapify(heap)
+
+        def split(j):
+            # replace node j (at the top of the heap) by its children, or a leaf by its word's postings
+            if j >= leaves:
+                i = j - leaves
+                heapq.heapreplace(heap, (tree[j], len(streams), starts[i]))
+                streams.append((keys, starts[i + 1]))
+            else:
+                heapq.heapreplace(heap, (tree[2 * j], -2 * j, 0))
+                heapq.heappush(heap, (tree[2 * j + 1], -2 * j - 1, 0))
+
+        while heap:
+            key, n, pos = heap[0]
+            if n < 0:
+                split(-n)
+                continue
+            target = key
+            for postings in required:
+                target = _seek(postings, target)
+                if target is None:
+                    return
+            if target == key:
+                if key_id(key) not in self.dead:
+                    yield key_id(key)
+                target = key + 1
+            # move every stream to its first key >= target
+            while heap and heap[0][0] < target:
+                _, n, pos = heap[0]
+                if n < 0:
+                    split(-n)
+                    continue
+                seq, hi = streams[n]
+                pos = bisect.bisect_left(seq, target, pos + 1, hi)
+                if pos < hi:
+                    heapq.heapreplace(heap, (seq[pos], n, pos))
+                else:
+                    heapq.heappop(heap)
+
+    def add(self, product_id, name):
+        """Index the words of a created or renamed product that are not indexed for it yet."""
+        key = rank_key(product_id, self.units.get(product_id, 0))
+        self.dead.discard(product_id)
+        for term in set(tokenize(name)):
+            if _seek(self._postings(term), key) == key:
+                continue
+            extra = self.extra.get(term)
+            if extra is None:
+                self.extra[term] = [key]
+                bisect.insort(self.extra_terms, term)
+            else:
+                bisect.insort(extra, key)
+
+    def save(self, path):
+        """Write the built index to `path` (atomically)."""
+        terms = "\n".join(self.terms).encode()
+        ids, units = array("q", self.units.keys()), array("q", self.units.values())
+        header = {"terms": len(terms), "starts": len(self.starts), "keys": len(self.keys), "tree": len(self.tree),
+                  "units": len(ids), "watermark": self.watermark.isoformat() if self.watermark else None,
+                  "recent": [[pid, ts.isoformat()] for pid, ts in self.recent.items()]}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(SNAPSHOT_MAGIC)
+            fh.write(json.dumps(header).encode() + b"\n")
+            fh.write(terms)
+            for values in (self.starts, self.keys, self.tree, ids, units):
+                values.tofile(fh)
+        os.replace(tmp, path)
+        stat = os.stat(path)
+        self.snapshot = (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as fh:
+            if fh.readline() != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not an autocomplete snapshot")
+            header = json.loads(fh.readline())
+            terms = fh.read(header["terms"]).decode().split("\n") if header["terms"] else []
+            arrays = []
+            for name in ("starts", "keys", "tree", "units", "units"):
+                values = array("q")
+                values.fromfile(fh, header[name])
+                arrays.append(values)
+            stat = os.fstat(fh.fileno())
+        starts, keys, tree, ids, units = arrays
+        watermark = datetime.fromisoformat(header["watermark"]) if header["watermark"] else None
+        recent = {pid: datetime.fromisoformat(ts) for pid, ts in header["recent"]}
+        index = cls(terms, starts, keys, tree, dict(zip(ids, units)), watermark, recent)
+        index.snapshot = (stat.st_mtime_ns, stat.st_size)
+        return index
+
+
+class SearchCounts:
+    """Per-process counts of searches, handed out in batches to be written."""
+
+    def __init__(self, interval=30.0, max_phrases=1000):
+        self.interval = interval
+        self.max_phrases = max_phrases
+        self._counts = Counter()
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, phrase):
+        """Count one search; returns the batch to write when one is due, else None."""
+        with self._lock:
+            self._counts[phrase] += 1
+            now = time.monotonic()
+            if now - self._flushed < self.interval and len(self._counts) < self.max_phrases:
+                return None
+            batch, self._counts, self._flushed = self._counts, Counter(), now
+        return batch
+
+
+def _reader():
+    return db.engines.get(READER, db.engine)
+
+
+def _sync_overlap():
+    """How much of the past every sync re-reads (rows already indexed are skipped).
+
+    A row's updated_at is stamped before its write transaction starts, and
+    the writer can wait up to SQLITE_BUSY_TIMEOUT_MS for the lock, so the
+    row may commit that much later than its timestamp.
+    """
+    busy_ms = current_app.config.get("SQLITE_BUSY_TIMEOUT_MS", 0)
+    return timedelta(milliseconds=busy_ms) + _SYNC_MARGIN
+
+
+def build_index():
+    """Read the whole catalog into a new PrefixIndex."""
+    days = current_app.config.get("AUTOCOMPLETE_POPULAR_DAYS", 30)
+    sold = func.sum(ProductSalesDaily.units)
+    with _reader().connect() as conn:
+        watermark = conn.execute(select(func.max(Product.updated_at))).scalar()
+        recent = {}
+        if watermark is not None:
+            recent = dict(conn.execute(select(Product.id, Product.updated_at)
+                                       .where(Product.updated_at >= watermark - _sync_overlap())).all())
+        units = dict(conn.execute(
+            select(ProductSalesDaily.product_id, sold)
+            .where(ProductSalesDaily.day >= date.today() - timedelta(days=days))
+            .group_by(ProductSalesDaily.product_id)
+            .having(sold > 0)
+        ).all())
+        rows = conn.execution_options(yield_per=10000).execute(
+            select(Product.id, Product.name).order_by(Product.id.desc()))
+        return PrefixIndex.build(rows, units, watermark, recent)
+
+
+def load_queries():
+    min_hits = current_app.config.get("AUTOCOMPLETE_QUERY_MIN_HITS", 3)
+    with _reader().connect() as conn:
+        rows = conn.execute(
+            select(SearchQuery.phrase, SearchQuery.hits)
+            .where(SearchQuery.hits >= min_hits)
+            .order_by(SearchQuery.hits.desc())
+            .limit(MAX_QUERIES)
+        ).all()
+    return QueryIndex(rows)
+
+
+def sync_index(index):
+    """Index the products created or changed since the index last caught up with the catalog."""
+    version = catalog_version()
+    overlap = _sync_overlap()
+    query = select(Product.id, Product.name, Product.updated_at)
+    if index.watermark is not None:
+        query = query.where(Product.updated_at >= index.watermark - overlap)
+    with _reader().connect() as conn:
+        rows = conn.execute(query).all()
+    for product_id, name, updated_at in rows:
+        if index.recent.get(product_id) != updated_at:
+            index.add(product_id, name)
+        if updated_at is not None and (index.watermark is None or updated_at > index.watermark):
+            index.watermark = updated_at
+    if index.watermark is not None:
+        floor = index.watermark - overlap
+        index.recent = {pid: ts for pid, _, ts in rows if ts is not None and ts >= floor}
+    index.version = version
+
+
+def load_index(path):
+    """Load the snapshot at `path` (building it if missing or unreadable), then catch up with the catalog."""
+    index = None
+    try:
+        index = PrefixIndex.load(path)
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, EOFError, OSError) as e:
+        current_app.logger.warning("Rebuilding unreadable autocomplete snapshot %s: %s", path, e)
+    if index is None:
+        index = build_index()
+        index.save(path)
+    index.queries = load_queries()
+    sync_index(index)
+    return index
+
+
+def _snapshot_changed(path, index):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return (stat.st_mtime_ns, stat.st_size) != index.snapshot
+
+
+def get_index():
+    """
+    This process's index, loaded on first use and kept in step with the
+    catalog. None while another thread is loading it.
+    """
+    state = current_app.extensions["autocomplete"]
+    refresh = current_app.config.get("AUTOCOMPLETE_REFRESH", 60)
+    index = state["index"]
+    if index is not None and time.monotonic() - state["checked"] < refresh and index.version == catalog_version():
+        return index
+    if not state["lock"].acquire(blocking=False):
+        return index  # another thread is on it; answer from what there is
+    try:
+        index = state["index"]
+        if index is None or time.monotonic() - state["checked"] >= refresh:
+            if index is None or _snapshot_changed(state["path"], index):
+                index = state["index"] = load_index(state["path"])
+            else:
+                index.queries = load_queries()
+            state["checked"] = time.monotonic()
+        if index.version != catalog_version():
+            sync_index(index)
+    except (SQLAlchemyError, OSError):
+        current_app.logger.exception("Could not refresh the autocomplete index")
+    finally:
+        state["lock"].release()
+    return index
+
+
+def warm_index(app):
+    """Load the index now (the gunicorn master does this before forking, so the workers share it)."""
+    with app.app_context():
+        state = app.extensions["autocomplete"]
+        with state["lock"]:
+            state["index"] = load_index(state["path"])
+            state["checked"] = time.monotonic()
+
+
+def _name_matches(name, words):
+    names = tokenize(name)
+    *whole, prefix = words
+    return all(word in names for word in whole) and any(n.startswith(prefix) for n in names)
+
+
+def suggest(text):
+    """{"queries": [phrase, ...], "products": [{"name", "url", "price"}, ...]} for the text typed so far."""
+    result = {"queries": [], "products": []}
+    words = tokenize(text)
+    index = get_index() if words else None
+    if index is None:
+        return result
+    cfg = current_app.config
+    result["queries"] = index.queries.top(" ".join(words), cfg.get("AUTOCOMPLETE_QUERIES", 3))
+
+    limit = cfg.get("AUTOCOMPLETE_PRODUCTS", 8)
+    hits = index.matches(words)
+    for _ in range(4):  # stale hits are rare; bound the lookups if they are not
+        batch = list(islice(hits, limit - len(result["products"])))
+        if not batch:
+            break
+        rows = {row.id: row for row in db.session.execute(
+            select(Product.id, Product.name, Product.slug, Product.price).where(Product.id.in_(batch)))}
+        for product_id in batch:
+            row = rows.get(product_id)
+            if row is None:
+                index.dead.add(product_id)
+            elif _name_matches(row.name, words):  # else renamed since it was indexed
+                result["products"].append({"name": row.name, "price": row.price,
+                                           "url": url_for("shop.product_detail", slug=row.slug)})
+        if len(result["products"]) >= limit:
+            break
+    return result
+
+
+def _write_searches(batch):
+    stmt = sqlite_insert(SearchQuery)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SearchQuery.phrase],
+        set_={"hits": SearchQuery.hits + stmt.excluded.hits, "last_searched": stmt.excluded.last_searched},
+    )
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(stmt, [{"phrase": phrase, "hits": hits, "last_searched": now}
+                                for phrase, hits in batch.items()])
+    except SQLAlchemyError as e:
+        current_app.logger.warning("Could not record %d search queries: %s", len(batch), e)
+
+
+def record_search(text):
+    """Count a search that found products (written to search_query in batches)."""
+    phrase = " ".join(tokenize(text))[:MAX_PHRASE].rstrip()
+    if phrase:
+        batch = current_app.extensions["autocomplete"]["searches"].add(phrase)
+        if batch:
+            _write_searches(batch)
+
+
+def init_autocomplete(app):
+    path = app.config.get("AUTOCOMPLETE_INDEX_PATH") or os.path.join(app.instance_path, "autocomplete.idx")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    app.extensions["autocomplete"] = {
+        "path": path,
+        "index": None,
+        "checked": 0.0,
+        "lock": threading.Lock(),
+        "searches": SearchCounts(interval=app.config.get("AUTOCOMPLETE_QUERY_FLUSH", 30)),
+    }
+
+    @app.cli.command("build-autocomplete")
+    def build_autocomplete_command():
+        """Rebuild the search-as-you-type index snapshot from the catalog."""
+        started = time.perf_counter()
+        index = build_index()
+        index.save(path)
+        click.echo(f"indexed {len(index.terms)} words, {len(index.keys)} postings "
+                   f"in {time.perf_counter() - started:.1f}s: {path}")
@@ -0,0 +1,181 @@
+"""
+Search-as-you-type index: build and boot time, lookup latency, correctness.
+
+Fills a scratch catalog with --products products, or reuses the one at
+--db. It records sales for --sold products and a set of popular searches,
+then reports:
+- the time of a full build from the database (`flask build-autocomplete`);
+- boot time, i.e. loading the snapshot and catching up with the catalog,
+  as each gunicorn master does (median of 3);
+- the index's size;
+- p50/p99 over --lookups typed prefixes of product names (one word, two
+  words, mid-name words, and misses) for:
+  - the index lookup alone;
+  - GET /search/suggest end to end;
+  - the FTS5 prefix query the search page runs.
+
+It checks:
+- that the index's top hits for a sample of prefixes equal the best-ranked
+  FTS5 matches (best sellers first, then newest);
+- that products created, renamed and deleted after the build show up (or
+  stop showing up) on the next lookup.
+
+Run: python benchmarks/bench_autocomplete.py --products 1000000
+"""
+import argparse
+import random
+import statistics
+import string
+import sys
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from support import make_app, percentile, populate_catalog
+
+
+def timed(fn, samples):
+    out = []
+    for arg in samples:
+        t0 = time.perf_counter()
+        fn(arg)
+        out.append((time.perf_counter() - t0) * 1000)
+    return sorted(out)
+
+
+def typed_prefixes(names, n, rnd):
+    """What shoppers type: starts of names and of their later words, plus misses."""
+    out = []
+    for name in rnd.sample(names, n):
+        words = name.lower().split()
+        roll = rnd.random()
+        if roll < 0.4:
+            out.append(words[0][:rnd.randint(1, len(words[0]))])
+        elif roll < 0.7:
+            out.append(f"{words[0]} {words[1][:rnd.randint(1, len(words[1]))]}")
+        elif roll < 0.9:
+            word = rnd.choice(words[1:])
+            out.append(word[:rnd.randint(1, len(word))])
+        else:
+            out.append("".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 5))))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--db", help="reuse this database (filled with --products products if empty)")
+    parser.add_argument("--sold", type=int, default=2000, help="products given sales")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--checks", type=int, default=40)
+    args = parser.parse_args()
+
+    app = make_app(db_path=args.db, METRICS_ENABLED=False)
+    from models import db, Product, ProductSalesDaily, SearchQuery
+    with app.app_context():
+        count = db.session.query(Product).count()
+    if not count:
+        populate_catalog(app, args.products)
+    rnd = random.Random(5)
+    from autocomplete import PrefixIndex, build_index, load_index, rank_key, suggest
+    from catalog import product_changed
+    from search import build_match_query, search_products, tokenize
+
+    with app.app_context():
+        ids = [pid for (pid,) in db.session.query(Product.id)]
+        names = [name for (name,) in db.session.query(Product.name).filter(Product.id.in_(rnd.sample(ids, 5000)))]
+        db.session.query(ProductSalesDaily).delete()
+        db.session.query(SearchQuery).delete()
+        today = date.today()
+        sold = {pid: rnd.randint(1, 500) for pid in rnd.sample(ids, min(args.sold, len(ids)))}
+        db.session.execute(db.insert(ProductSalesDaily), [
+            {"product_id": pid, "day": today - timedelta(days=rnd.randint(0, 20)), "seller_id": 0,
+             "units": units, "revenue": units * 100.0, "orders": units} for pid, units in sold.items()])
+        phrases = {" ".join(tokenize(name)[:rnd.randint(1, 2)]) for name in names[:500]}
+        db.session.execute(db.insert(SearchQuery), [{"phrase": p, "hits": rnd.randint(1, 1000)} for p in phrases])
+        db.session.commit()
+        count = len(ids)
+
+        path = app.extensions["autocomplete"]["path"]
+        t0 = time.perf_counter()
+        built = build_index()
+        built.save(path)
+        build_s = time.perf_counter() - t0
+        boots = []
+        for _ in range(3):
+            t0 = time.perf_counter()
+            index = load_index(path)
+            boots.append(time.perf_counter() - t0)
+        app.extensions["autocomplete"].update(index=index, checked=time.monotonic())
+        arrays = (index.starts, index.keys, index.tree)
+        size_mb = (sum(len(a) * a.itemsize for a in arrays) + sum(map(sys.getsizeof, index.terms))
+                   + sys.getsizeof(index.terms)) / 2 ** 20
+
+    print(f"{count} products, {len(index.terms)} distinct words, {len(index.keys)} postings, "
+          f"{len(index.units)} with sales, {len(index.queries.phrases)} popular queries")
+    print(f"full build from the database  {build_s:7.2f}s")
+    print(f"boot (load snapshot + sync)   {statistics.median(boots):7.2f}s  (median of 3)")
+    print(f"index size                    {size_mb:7.1f}MB  (word list and arrays)")
+
+    prefixes = typed_prefixes(names, args.lookups, rnd)
+    client = app.test_client()
+    with app.test_request_context():
+        lookup = timed(lambda q: list(islice(index.matches(tokenize(q)), 8)), prefixes)
+        fts = timed(lambda q: search_products(q, per_page=8), prefixes)
+    endpoint = timed(lambda q: client.get("/search/suggest", query_string={"q": q}), prefixes)
+    print(f"\n{'per keystroke':<24}{'p50':>11}{'p99':>11}{'max':>11}")
+    for label, s in (("index lookup", lookup), ("GET /search/suggest", endpoint), ("FTS5 prefix query", fts)):
+        print(f"{label:<24}{percentile(s, 50):>9.2f}ms{percentile(s, 99):>9.2f}ms{s[-1]:>9.2f}ms")
+
+    failures = []
+    with app.app_context():
+        units = index.units
+        for q in prefixes[:args.checks]:
+            match = f"name : ({build_match_query(q)})"
+            rows = db.session.execute(db.text("SELECT rowid FROM product_fts WHERE product_fts MATCH :m"),
+                                      {"m": match}).scalars().all()
+            expected = sorted(rows, key=lambda pid: rank_key(pid, units.get(pid, 0)))[:8]
+            got = list(islice(index.matches(tokenize(q)), 8))
+            if got != expected:
+                failures.append(f"{q!r}: index {got}, FTS5 {expected}")
+
+        p = Product(name="Zyzzyva Kettle", slug="zyzzyva-kettle-bench", price=999.0, stock=5)
+        db.session.add(p)
+        db.session.commit()
+        product_changed(p.slug)
+    with app.test_request_context():
+        t0 = time.perf_counter()
+        created = [r["name"] for r in suggest("zyzz")["products"]]
+        sync_ms = (time.perf_counter() - t0) * 1000
+    with app.app_context():
+        p = Product.query.filter_by(slug="zyzzyva-kettle-bench").one()
+        p.name = "Quokka Kettle"
+        db.session.commit()
+        product_changed(p.slug)
+    with app.test_request_context():
+        renamed = [r["name"] for r in suggest("zyzz")["products"]], [r["name"] for r in suggest("quokka k")["products"]]
+    with app.app_context():
+        db.session.delete(Product.query.filter_by(slug="zyzzyva-kettle-bench").one())
+        db.session.commit()
+        product_changed("zyzzyva-kettle-bench")
+    with app.test_request_context():
+        deleted = [r["name"] for r in suggest("quokka")["products"]]
+    print(f"\nfirst lookup after a product is created: {sync_ms:.1f}ms (includes the catalog sync)")
+    if created != ["Zyzzyva Kettle"]:
+        failures.append(f"created product not suggested: {created}")
+    if renamed != ([], ["Quokka Kettle"]):
+        failures.append(f"renamed product suggested as {renamed}")
+    if deleted:
+        failures.append(f"deleted product still suggested: {deleted}")
+    if not isinstance(built, PrefixIndex) or len(built.keys) != len(index.keys):
+        failures.append("the loaded snapshot differs from the build")
+
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Worker boot cost: import time, app construction, and gunicorn workers
+with and without --preload.
+
+Part 1 times a fresh interpreter doing `import app`, then create_app(),
+then the first request (test client), over --runs runs. It also times the
+schema check each worker's first request used to run, and lists which
+lazily imported heavy modules are still unloaded after the first request.
+
+Part 2 starts gunicorn (sync profile, --workers) on a scratch database,
+once with preload off and once with it on. For each it reports:
+- each worker's boot time (fork to ready, from the "ready in" log line);
+- time from launch to the first response;
+- the boot time of a worker respawned after it is killed, as happens when
+  a worker dies or the pool scales up;
+- each worker's private memory (what it does not share copy-on-write with
+  the master), from /proc/<pid>/smaps_rollup.
+
+Needs gunicorn. Run: python benchmarks/bench_boot.py --workers 4 --runs 5
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from support import ROOT, make_app, populate_catalog
+
+READY_RE = re.compile(r"worker (\d+) ready in ([\d.]+)ms")
+LAZY_MODULES = ("stripe", "PIL.Image")
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+from config import Config
+class C(Config):
+    SQLALCHEMY_DATABASE_URI = sys.argv[1]
+    FRAGMENT_CACHE_PATH = sys.argv[2] + ".cache"
+    CATALOG_VERSION_PATH = sys.argv[2] + ".version"
+    IDENTITY_EPOCH_PATH = sys.argv[2] + ".identity"
+    CART_EPOCH_PATH = sys.argv[2] + ".cart"
+    AUTOCOMPLETE_INDEX_PATH = sys.argv[2] + ".autocomplete"
+    METRICS_ENABLED = False
+    DEBUG = False
+a = app.create_app(C)
+t2 = time.perf_counter()
+r = a.test_client().get("/")
+t3 = time.perf_counter()
+with a.app_context():
+    from schema import init_schema
+    init_schema()
+t4 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_ms": (t2 - t1) * 1000, "first_ms": (t3 - t2) * 1000,
+                  "schema_ms": (t4 - t3) * 1000, "status": r.status_code,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def probe(db_path, runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE, f"sqlite:///{db_path}", db_path],
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def private_mb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fh:
+            fields = dict(line.split(":", 1) for line in fh if ":" in line)
+    except OSError:
+        return None
+    kib = sum(int(fields[k].split()[0]) for k in ("Private_Clean", "Private_Dirty") if k in fields)
+    return kib / 1024
+
+
+class Gunicorn:
+    def __init__(self, db_path, workers, preload):
+        self.port = free_port()
+        env = dict(os.environ, WORKER_PROFILE="sync", GUNICORN_WORKERS=str(workers),
+                   GUNICORN_BIND=f"127.0.0.1:{self.port}", GUNICORN_PRELOAD="1" if preload else "0",
+                   DATABASE_URL=f"sqlite:///{db_path}", FLASK_DEBUG="0", METRICS_ENABLED="0",
+                   FRAGMENT_CACHE_PATH=f"{db_path}.cache", CATALOG_VERSION_PATH=f"{db_path}.version",
+                   IDENTITY_EPOCH_PATH=f"{db_path}.identity", CART_EPOCH_PATH=f"{db_path}.cart",
+                   AUTOCOMPLETE_INDEX_PATH=f"{db_path}.autocomplete")
+        self.ready = []  # (pid, boot ms)
+        self.cond = threading.Condition()
+        self.started = time.perf_counter()
+        self.proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:create_app()"],
+                                     cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        threading.Thread(target=self._read_log, daemon=True).start()
+
+    def _read_log(self):
+        for line in self.proc.stderr:
+            m = READY_RE.search(line)
+            if m:
+                with self.cond:
+                    self.ready.append((int(m.group(1)), float(m.group(2))))
+                    self.cond.notify_all()
+
+    def wait_ready(self, count, timeout=60):
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.ready) >= count, timeout):
+                raise RuntimeError(f"only {len(self.ready)} of {count} workers became ready")
+            return list(self.ready)
+
+    def first_response_ms(self):
+        url = f"http://127.0.0.1:{self.port}/"
+        while True:
+            try:
+                if requests.get(url, timeout=5).status_code == 200:
+                    return (time.perf_counter() - self.started) * 1000
+            except requests.ConnectionError:
+                if self.proc.poll() is not None:
+                    raise RuntimeError("gunicorn exited")
+                time.sleep(0.01)
+
+    def stop(self):
+        self.proc.send_signal(signal.SIGTERM)
+        self.proc.wait(timeout=30)
+
+
+def run_gunicorn(db_path, workers, preload):
+    server = Gunicorn(db_path, workers, preload)
+    try:
+        first = server.first_response_ms()
+        ready = server.wait_ready(workers)
+        for _ in range(20):
+            requests.get(f"http://127.0.0.1:{server.port}/", timeout=5)
+        memory = [private_mb(pid) for pid, _ in ready]
+        os.kill(ready[0][0], signal.SIGKILL)
+        respawned = server.wait_ready(workers + 1)[-1][1]
+    finally:
+        server.stop()
+    return {
+        "preload": preload,
+        "boot_ms": [ms for _, ms in ready],
+        "first_response_ms": first,
+        "respawn_ms": respawned,
+        "private_mb": [m for m in memory if m is not None],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--products", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = make_app(METRICS_ENABLED=False)
+    populate_catalog(app, args.products)
+    db_path = app.config["BENCH_DB_PATH"]
+
+    results = probe(db_path, args.runs)
+    med = {key: statistics.median(r[key] for r in results) for key in ("import_ms", "create_ms", "first_ms", "schema_ms")}
+    print(f"fresh interpreter (median of {args.runs}):")
+    print(f"  import app        {med['import_ms']:7.1f}ms")
+    print(f"  create_app()      {med['create_ms']:7.1f}ms")
+    print(f"  first request     {med['first_ms']:7.1f}ms")
+    print(f"  schema check      {med['schema_ms']:7.1f}ms  (was paid by every worker's first request; now `flask init-db`)")
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    print(f"  lazy modules loaded by then: {', '.join(loaded) or 'none'}")
+
+    print(f"\ngunicorn, sync profile, {args.workers} workers")
+    print(f"{'preload':<9}{'worker boot ms (each)':<34}{'first response':>15}{'respawn':>10}{'private MB/worker':>19}")
+    for preload in (False, True):
+        r = run_gunicorn(db_path, args.workers, preload)
+        boots = " ".join(f"{ms:.0f}" for ms in r["boot_ms"])
+        mem = statistics.mean(r["private_mb"]) if r["private_mb"] else float("nan")
+        print(f"{'on' if preload else 'off':<9}{boots:<34}{r['first_response_ms']:>13.0f}ms{r['respawn_ms']:>8.0f}ms"
+              f"{mem:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+SQL statements per request for a large cart: the regression check for the
+single-query cart hydration (get_cart).
+
+A signed-in shopper with --lines cart lines fetches /cart and /checkout
+and posts to /create-checkout-session (Stripe is the local fake). Each
+request's SQL statements are counted, and the script fails if any page
+goes over its fixed budget. The budgets do not depend on the number of
+lines, so a per-line query (an N+1) trips them.
+
+Run: python benchmarks/bench_cart_queries.py --lines 30
+"""
+import argparse
+import sys
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from fake_stripe import start_fake_stripe
+from support import make_app, populate_catalog
+
+# statements per request, whatever the number of cart lines
+BUDGETS = {
+    "GET /cart": 4,
+    "GET /checkout": 4,
+    "POST /create-checkout-session": 10,
+}
+
+statements = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _record(conn, cursor, statement, *args):
+    statements.append(statement)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=30)
+    parser.add_argument("--verbose", action="store_true", help="print the statements of each request")
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe()
+    app = make_app(STRIPE_API_BASE=fake.base_url, METRICS_ENABLED=False)
+    populate_catalog(app, max(args.lines, 100))
+    from models import db, Product, User
+    with app.app_context():
+        db.session.query(Product).update({Product.stock: 1000})
+        user = User(username="shopper", email="shopper@example.com", password_hash="unused")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        product_ids = [pid for (pid,) in db.session.query(Product.id).order_by(Product.id).limit(args.lines)]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    for pid in product_ids:
+        client.post(f"/cart/add/{pid}", data={"qty": 2})
+
+    requests = (
+        ("GET /cart", lambda: client.get("/cart"), 200),
+        ("GET /checkout", lambda: client.get("/checkout"), 200),
+        ("POST /create-checkout-session", lambda: client.post("/create-checkout-session"), 303),
+    )
+    failures = []
+    print(f"{args.lines}-line cart")
+    print(f"{'request':<32}{'statements':>11}{'budget':>8}")
+    for label, send, expected_status in requests:
+        send()  # warm caches, as on a shopper's second visit
+        del statements[:]
+        r = send()
+        count = len(statements)
+        print(f"{label:<32}{count:>11}{BUDGETS[label]:>8}")
+        if args.verbose:
+            for statement in statements:
+                print(f"    {' '.join(statement.split())[:150]}")
+        if r.status_code != expected_status:
+            failures.append(f"{label} answered {r.status_code}")
+        if count > BUDGETS[label]:
+            failures.append(f"{label} sent {count} SQL statements (budget {BUDGETS[label]})")
+    server.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
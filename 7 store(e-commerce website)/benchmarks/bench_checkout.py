@@ -0,0 +1,103 @@
+"""
+Concurrent checkout benchmark against the local fake Stripe.
+
+Each simulated shopper logs in, fills a cart, posts to
+/create-checkout-session, "pays" on the fake Stripe page and lands on
+/stripe/success. Latency and failures can be injected into the fake
+Stripe to watch timeouts, retries and the circuit breaker at work.
+
+Run: python benchmarks/bench_checkout.py --shoppers 200 --concurrency 16 --latency-ms 200
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from fake_stripe import start_fake_stripe
+from support import make_app, populate_catalog, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shoppers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--items", type=int, default=3, help="cart lines per shopper")
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--read-timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                     error_rate=args.error_rate)
+    app = make_app(STRIPE_API_BASE=fake.base_url, STRIPE_READ_TIMEOUT=args.read_timeout,
+                   STRIPE_POOL_SIZE=args.concurrency)
+    populate_catalog(app, 500)
+
+    from models import db, User, Order, Product
+    with app.app_context():
+        # plenty of stock, so reservations never turn shoppers away here
+        db.session.execute(db.update(Product).values(stock=1_000_000))
+        users = []
+        for i in range(args.shoppers):
+            u = User(username=f"shopper{i}", email=f"shopper{i}@example.com")
+            u.password_hash = "unused"
+            users.append(u)
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [u.id for u in users]
+
+    import requests
+    http = requests.Session()
+    timings = {"checkout": [], "success": []}
+    failures = {"checkout": 0, "success": 0}
+    lock = threading.Lock()
+
+    def shopper(i):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_ids[i])
+            sess["_fresh"] = True
+            sess["cart"] = {str(1 + (i * 7 + k) % 500): 1 + k % 2 for k in range(args.items)}
+
+        t0 = time.perf_counter()
+        r = client.post("/create-checkout-session")
+        t_checkout = (time.perf_counter() - t0) * 1000
+        ok = r.status_code == 303 and r.location.startswith(fake.base_url)
+        with lock:
+            timings["checkout"].append(t_checkout)
+            failures["checkout"] += not ok
+        if not ok:
+            return
+
+        paid = http.get(r.location, allow_redirects=False)  # the customer pays on "Stripe"
+        success = urlparse(paid.headers["Location"])
+        t0 = time.perf_counter()
+        r = client.get(f"{success.path}?{success.query}")
+        t_success = (time.perf_counter() - t0) * 1000
+        with lock:
+            timings["success"].append(t_success)
+            failures["success"] += r.status_code != 200
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(shopper, range(args.shoppers)))
+    wall = time.perf_counter() - t0
+
+    with app.app_context():
+        paid_orders = Order.query.filter_by(status="paid").count()
+
+    print(f"{args.shoppers} shoppers, concurrency {args.concurrency}, fake Stripe latency "
+          f"{args.latency_ms:.0f}+{args.jitter_ms:.0f}ms, error rate {args.error_rate:.0%}")
+    for step in ("checkout", "success"):
+        s = sorted(timings[step])
+        print(f"  {step:<9} n={len(s):<5} p50={percentile(s, 50):7.1f}ms p95={percentile(s, 95):7.1f}ms "
+              f"p99={percentile(s, 99):7.1f}ms failures={failures[step]}")
+    print(f"  {args.shoppers / wall:.1f} checkouts/s, {paid_orders} orders paid, "
+          f"{fake.requests} Stripe API calls")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
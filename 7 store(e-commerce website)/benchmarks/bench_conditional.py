@@ -0,0 +1,103 @@
+"""
+Repeat visits with and without conditional GET.
+
+For the home page, a product page and the stylesheet, it fetches the page
+once, then compares plain re-fetches with re-fetches that send the ETag
+back (If-None-Match), the way a browser revisits a page it has cached. It
+reports latency and bytes per request, for an anonymous visitor and for a
+signed-in shopper with items in the cart. It also checks that a catalog
+change, a cart change and a stale asset URL each invalidate as expected.
+
+Run: python benchmarks/bench_conditional.py --products 2000 --repeat 200
+"""
+import argparse
+import sys
+import time
+from urllib.parse import urlsplit
+
+from support import make_app, percentile, populate_catalog
+
+
+def measure(client, url, repeat, headers=None):
+    samples, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        r = client.get(url, headers=headers or {})
+        samples.append((time.perf_counter() - t0) * 1000)
+        size += len(r.data)
+    samples.sort()
+    return percentile(samples, 50), size / repeat, r.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    app = make_app(METRICS_ENABLED=False)
+    populate_catalog(app, args.products)
+    from models import db, Product, User
+    with app.app_context():
+        slug = db.session.get(Product, 1).slug
+        user = User(username="shopper", email="shopper@example.com", password_hash="unused")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    anon = app.test_client()
+    shopper = app.test_client()
+    with shopper.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    shopper.post("/cart/add/2", data={"qty": 2})
+
+    home = anon.get("/")
+    css_url = next(part.split('"')[0] for part in home.get_data(as_text=True).split('href="') if "styles.css" in part)
+
+    print(f"{'visitor':<9}{'page':<26}{'full p50':>10}{'bytes':>9}{'304 p50':>10}{'bytes':>7}{'status':>8}")
+    failures = []
+    for who, client in (("anon", anon), ("shopper", shopper)):
+        for label, url in (("/", "/"), ("/product/<slug>", f"/product/{slug}"), ("styles.css?v=", css_url)):
+            full_ms, full_bytes, _ = measure(client, url, args.repeat)
+            first = client.get(url)  # after any pending flash message has been shown
+            etag = first.headers.get("ETag")
+            cond_ms, cond_bytes, status = measure(client, url, args.repeat, {"If-None-Match": etag} if etag else None)
+            print(f"{who:<9}{label:<26}{full_ms:>9.2f}ms{full_bytes:>9.0f}{cond_ms:>9.2f}ms{cond_bytes:>7.0f}{status:>8}")
+            if label.startswith("styles"):
+                if "immutable" not in first.headers.get("Cache-Control", ""):
+                    failures.append(f"{url} is not served immutable: {first.headers.get('Cache-Control')}")
+            elif status != 304:
+                failures.append(f"{who} {url}: revalidation returned {status}")
+
+    # invalidation: catalog change (home), product change (its page), cart change, stale asset
+    etag_home = shopper.get("/").headers["ETag"]
+    etag_product = shopper.get(f"/product/{slug}").headers["ETag"]
+    from catalog import product_changed
+    with app.app_context():
+        p = db.session.get(Product, 1)
+        p.price = p.price + 1
+        db.session.commit()
+        product_changed(p.slug)
+    if shopper.get("/", headers={"If-None-Match": etag_home}).status_code != 200:
+        failures.append("home was not re-rendered after a catalog change")
+    if shopper.get(f"/product/{slug}", headers={"If-None-Match": etag_product}).status_code != 200:
+        failures.append("product page was not re-rendered after the product changed")
+    etag_home = shopper.get("/").headers["ETag"]
+    shopper.post("/cart/add/3", data={"qty": 1})
+    shopper.get("/")  # shows the "added to cart" flash
+    if shopper.get("/").headers["ETag"] == etag_home:
+        failures.append("home kept its ETag after the cart changed")
+    stale = anon.get(urlsplit(css_url).path + "?v=000000000000")
+    if "immutable" in stale.headers.get("Cache-Control", ""):
+        failures.append("a stale asset version was served immutable")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
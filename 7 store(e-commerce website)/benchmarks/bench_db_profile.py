@@ -0,0 +1,150 @@
+"""
+Mixed read/write throughput: stock SQLite settings vs the production engine profile.
+
+Several worker processes (like gunicorn workers), each with several
+threads, share one SQLite file. For a fixed time they mix reads (search,
+order history, cart) with writes (add-to-cart upserts and signed Stripe
+webhook deliveries). The run is repeated on an identical copy of the
+database for each DB_PROFILE. It reports throughput, latency and errors,
+most of which are "database is locked".
+
+Run: python benchmarks/bench_db_profile.py --processes 4 --threads 4 --seconds 10 --write-ratio 0.2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from loadtest import build_dataset
+from replay_webhooks import SECRET, checkout_completed, sign
+from support import NOUNS, make_app, percentile
+
+PROFILES = ("stock", "production")
+
+
+def worker(db_path, profile, args, user_ids, product_count, seed, out):
+    app = make_app(db_path=db_path, run_init=False, DB_PROFILE=profile, METRICS_ENABLED=False)
+    deadline = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    stats = {"read": [], "write": [], "errors": 0, "locked": 0}
+
+    def run(thread_no):
+        rnd = random.Random(seed * 1000 + thread_no)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(rnd.choice(user_ids))
+            sess["_fresh"] = True
+        while time.monotonic() < deadline:
+            write = rnd.random() < args.write_ratio
+            t0 = time.perf_counter()
+            try:
+                if not write:
+                    kind = rnd.random()
+                    if kind < 0.5:
+                        r = client.get("/search", query_string={"q": rnd.choice(NOUNS)})
+                    elif kind < 0.8:
+                        r = client.get("/orders")
+                    else:
+                        r = client.get("/cart")
+                elif rnd.random() < 0.5:
+                    r = client.post(f"/cart/add/{rnd.randint(1, product_count)}", data={"qty": 1})
+                else:
+                    event_id = f"evt_{profile}_{seed}_{thread_no}_{rnd.getrandbits(48)}"
+                    payload = json.dumps(checkout_completed(event_id, rnd.randint(1, 10**6))).encode()
+                    r = client.post("/stripe/webhook", data=payload,
+                                    headers={"Stripe-Signature": sign(payload, SECRET)})
+                ok = r.status_code < 500
+            except Exception as e:  # TESTING propagates errors such as "database is locked"
+                ok = False
+                if "locked" in str(e):
+                    with lock:
+                        stats["locked"] += 1
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                if ok:
+                    stats["write" if write else "read"].append(ms)
+                else:
+                    stats["errors"] += 1
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out.put(stats)
+
+
+def run_profile(base_path, profile, args, user_ids):
+    path = os.path.join(os.path.dirname(base_path), f"{profile}.db")
+    shutil.copy(base_path, path)
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, profile, args, user_ids, args.products, i, out))
+             for i in range(args.processes)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = time.perf_counter() - t0
+
+    reads = sorted(ms for r in results for ms in r["read"])
+    writes = sorted(ms for r in results for ms in r["write"])
+    return {
+        "profile": profile,
+        "reads_per_s": round(len(reads) / wall, 1),
+        "writes_per_s": round(len(writes) / wall, 1),
+        "read_p50_ms": round(percentile(reads, 50), 1),
+        "read_p95_ms": round(percentile(reads, 95), 1),
+        "write_p50_ms": round(percentile(writes, 50), 1),
+        "write_p95_ms": round(percentile(writes, 95), 1),
+        "errors": sum(r["errors"] for r in results),
+        "locked_errors": sum(r["locked"] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--orders-per-user", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--profiles", nargs="*", default=list(PROFILES), choices=PROFILES)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    base = os.path.join(tempfile.mkdtemp(prefix="7store-dbprofile-"), "base.db")
+    app = make_app(db_path=base, DB_PROFILE="stock", METRICS_ENABLED=False)
+    _, user_ids, _ = build_dataset(app, args.products, args.users, args.orders_per_user)
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+    rows = []
+    for profile in args.profiles:
+        rows.append(run_profile(base, profile, args, user_ids))
+
+    print(f"{args.processes} processes x {args.threads} threads, {args.seconds:.0f}s, "
+          f"{args.write_ratio:.0%} writes, {args.products} products")
+    print(f"{'profile':<12}{'reads/s':>9}{'writes/s':>10}{'r p50':>8}{'r p95':>8}{'w p50':>8}{'w p95':>8}"
+          f"{'errors':>8}{'locked':>8}")
+    for r in rows:
+        print(f"{r['profile']:<12}{r['reads_per_s']:>9}{r['writes_per_s']:>10}{r['read_p50_ms']:>8}"
+              f"{r['read_p95_ms']:>8}{r['write_p50_ms']:>8}{r['write_p95_ms']:>8}{r['errors']:>8}{r['locked_errors']:>8}")
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump({"args": vars(args), "results": rows}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Database round trips per request for signed-in traffic, with and without
+the identity cache.
+
+A signed-in shopper with a few items in the cart fetches the home page,
+product pages, /browse, /cart and /orders. Each mode counts the SQL
+statements the request sends and its p50 latency: IDENTITY_CACHE_TTL=0
+loads the user from the database on every request, and the default TTL
+uses the cache.
+
+It then checks that invalidation crosses workers. A second app instance on
+the same database and epoch file stands in for another worker. After an
+admin on the first one revokes the shopper's seller flag, the second must
+deny the seller dashboard on its very next request.
+
+Run: python benchmarks/bench_identity.py --products 2000 --repeat 200
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from support import make_app, percentile, populate_catalog
+
+statements = 0
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count(*args):
+    global statements
+    statements += 1
+
+
+def sign_in(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    return client
+
+
+def run_mode(args, ttl, db_path=None):
+    global statements
+    app = make_app(db_path, run_init=db_path is None, METRICS_ENABLED=False, IDENTITY_CACHE_TTL=ttl)
+    if db_path is None:
+        populate_catalog(app, args.products)
+    from models import db, Product, User
+    with app.app_context():
+        slugs = [s for (s,) in db.session.query(Product.slug).limit(50)]
+        user = db.session.query(User).filter_by(username="shopper").first()
+        if user is None:
+            user = User(username="shopper", email="shopper@example.com", password_hash="unused", is_seller=True)
+            db.session.add(user)
+            db.session.commit()
+        user_id = user.id
+    client = sign_in(app, user_id)
+    client.post("/cart/add/1", data={"qty": 1})
+    client.post("/cart/add/2", data={"qty": 2})
+    client.get("/")  # shows the flash
+
+    urls = ["/", "/browse", "/cart", "/orders"] + [f"/product/{s}" for s in slugs[:6]]
+    results = {}
+    for url in urls:
+        client.get(url)  # warm the fragment and identity caches
+        samples = []
+        before = statements
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            r = client.get(url)
+            samples.append((time.perf_counter() - t0) * 1000)
+        if r.status_code != 200:
+            print(f"FAIL: {url} returned {r.status_code}")
+            sys.exit(1)
+        samples.sort()
+        label = "/product/<slug>" if url.startswith("/product/") else url
+        queries, times = results.setdefault(label, ([], []))
+        queries.append((statements - before) / args.repeat)
+        times.append(percentile(samples, 50))
+    return app, user_id, {label: (sum(q) / len(q), sum(t) / len(t)) for label, (q, t) in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    uncached_app, _, uncached = run_mode(args, 0)
+    db_path = uncached_app.config["BENCH_DB_PATH"]
+    app, user_id, cached = run_mode(args, 60, db_path)
+
+    print(f"{'page':<18}{'queries/req':>12}{'cached':>8}{'p50 ms':>9}{'cached':>8}")
+    for label, (q, ms) in uncached.items():
+        cq, cms = cached[label]
+        print(f"{label:<18}{q:>12.2f}{cq:>8.2f}{ms:>9.2f}{cms:>8.2f}")
+    total, total_cached = sum(q for q, _ in uncached.values()), sum(q for q, _ in cached.values())
+    print(f"{'all pages':<18}{total:>12.2f}{total_cached:>8.2f}")
+
+    failures = []
+    if total_cached >= total:
+        failures.append("the cache did not reduce queries per request")
+
+    # cross-worker invalidation: "worker" b has the shopper cached as a seller
+    from models import db, User
+    worker_b = make_app(db_path, run_init=False, METRICS_ENABLED=False, IDENTITY_CACHE_TTL=60)
+    shopper_b = sign_in(worker_b, user_id)
+    if shopper_b.get("/seller/").status_code != 200:
+        failures.append("seller dashboard was not served to a seller")
+    with app.app_context():
+        admin = User(username="boss", email="boss@example.com", password_hash="unused", is_admin=True)
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    r = sign_in(app, admin_id).post(f"/admin/user/{user_id}/toggle_seller")
+    if r.status_code != 302:
+        failures.append(f"toggle_seller returned {r.status_code}")
+    if shopper_b.get("/seller/").status_code == 200:
+        failures.append("another worker still served the seller dashboard after the flag was revoked")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
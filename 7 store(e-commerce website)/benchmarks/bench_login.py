@@ -0,0 +1,148 @@
+"""
+Login storm next to catalog browsing: inline hashing vs the password pool.
+
+One app process with a fixed number of request threads (like a gunicorn
+gthread worker) serves two kinds of clients at once. Login clients
+repeatedly sign in with the right password. Browse clients fetch product,
+search and browse pages. Latency is measured from the moment a request is
+queued for a thread, so time spent waiting behind busy threads counts.
+
+The run is repeated with PASSWORD_WORKERS=0 (hash on the request thread)
+and with the pool. It reports successful logins/s, shed logins (503),
+login latency and browse latency and throughput.
+
+Run: python benchmarks/bench_login.py --threads 8 --login-clients 16 --browse-clients 8 --seconds 10
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from support import NOUNS, make_app, percentile, populate_catalog
+
+PASSWORD = "correct horse battery"
+
+
+def run_mode(args, workers):
+    app = make_app(METRICS_ENABLED=False, PASSWORD_WORKERS=workers, PASSWORD_MAX_PENDING=args.max_pending,
+                   PASSWORD_QUEUE_TIMEOUT=args.queue_timeout)
+    populate_catalog(app, args.products)
+    from models import db, Product, User
+    from werkzeug.security import generate_password_hash
+    # legacy cost when --upgrade is set, so the first login of each user re-hashes
+    method = "pbkdf2:sha256:260000" if args.upgrade else app.config["PASSWORD_HASH_METHOD"]
+    pwhash = generate_password_hash(PASSWORD, method=method)
+    with app.app_context():
+        db.session.execute(db.insert(User), [
+            {"username": f"member{i}", "email": f"member{i}@example.com", "password_hash": pwhash}
+            for i in range(args.users)
+        ])
+        db.session.commit()
+        slugs = [s for (s,) in db.session.query(Product.slug).limit(500)]
+
+    server_threads = ThreadPoolExecutor(max_workers=args.threads)
+    deadline = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    stats = {"login": [], "login_503": 0, "login_failed": 0, "browse": [], "browse_errors": 0}
+
+    def login(client, rnd):
+        r = client.post("/auth/login", data={"username": f"member{rnd.randrange(args.users)}", "password": PASSWORD})
+        return "ok" if r.status_code == 302 else ("busy" if r.status_code == 503 else "failed")
+
+    def browse(client, rnd):
+        kind = rnd.random()
+        if kind < 0.4:
+            r = client.get(f"/product/{rnd.choice(slugs)}")
+        elif kind < 0.7:
+            r = client.get("/search", query_string={"q": rnd.choice(NOUNS)})
+        else:
+            r = client.get("/browse", query_string={"sort": rnd.choice(["newest", "price_asc"])})
+        return "ok" if r.status_code == 200 else "failed"
+
+    def client_loop(kind, seed):
+        rnd = random.Random(seed)
+        while time.monotonic() < deadline:
+            client = app.test_client()  # a fresh visitor each time
+            t0 = time.perf_counter()
+            outcome = server_threads.submit(login if kind == "login" else browse, client, rnd).result()
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                if kind == "browse" and outcome == "ok":
+                    stats["browse"].append(ms)
+                elif kind == "browse":
+                    stats["browse_errors"] += 1
+                elif outcome == "ok":
+                    stats["login"].append(ms)
+                elif outcome == "busy":
+                    stats["login_503"] += 1
+                else:
+                    stats["login_failed"] += 1
+
+    clients = [threading.Thread(target=client_loop, args=("login", i)) for i in range(args.login_clients)]
+    clients += [threading.Thread(target=client_loop, args=("browse", 1000 + i)) for i in range(args.browse_clients)]
+    t0 = time.perf_counter()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    wall = time.perf_counter() - t0
+    server_threads.shutdown()
+
+    with app.app_context():
+        upgraded = db.session.query(User).filter(User.password_hash.like(app.config["PASSWORD_HASH_METHOD"] + "$%")).count()
+        hasher = app.extensions["passwords"]["hasher"]
+        if hasher:
+            hasher.shutdown()
+
+    logins, pages = sorted(stats["login"]), sorted(stats["browse"])
+    return {
+        "password_workers": workers,
+        "logins_per_s": round(len(logins) / wall, 1),
+        "login_503": stats["login_503"],
+        "login_failed": stats["login_failed"],
+        "login_p50_ms": round(percentile(logins, 50), 1),
+        "login_p95_ms": round(percentile(logins, 95), 1),
+        "browse_per_s": round(len(pages) / wall, 1),
+        "browse_p50_ms": round(percentile(pages, 50), 1),
+        "browse_p95_ms": round(percentile(pages, 95), 1),
+        "browse_errors": stats["browse_errors"],
+        "hashes_upgraded": upgraded if args.upgrade else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8, help="request threads in the app process")
+    parser.add_argument("--login-clients", type=int, default=16)
+    parser.add_argument("--browse-clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--pool-workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=4)
+    parser.add_argument("--queue-timeout", type=float, default=0.2)
+    parser.add_argument("--upgrade", action="store_true", help="start from legacy-cost hashes")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    rows = [run_mode(args, 0), run_mode(args, args.pool_workers)]
+    print(f"{args.threads} request threads, {args.login_clients} login + {args.browse_clients} browse clients, "
+          f"{args.seconds:.0f}s")
+    print(f"{'hashing':<10}{'logins/s':>9}{'503':>6}{'login p50':>11}{'p95':>8}"
+          f"{'pages/s':>9}{'page p50':>10}{'p95':>8}{'errors':>8}")
+    for r in rows:
+        label = "inline" if not r["password_workers"] else f"pool x{r['password_workers']}"
+        print(f"{label:<10}{r['logins_per_s']:>9}{r['login_503']:>6}{r['login_p50_ms']:>11}{r['login_p95_ms']:>8}"
+              f"{r['browse_per_s']:>9}{r['browse_p50_ms']:>10}{r['browse_p95_ms']:>8}"
+              f"{r['browse_errors'] + r['login_failed']:>8}")
+        if r["hashes_upgraded"] is not None:
+            print(f"{'':<10}{r['hashes_upgraded']} of {args.users} stored hashes upgraded")
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump({"args": vars(args), "results": rows}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Order history and order detail rendering from the summary snapshot.
+
+Seeds a shopper with --orders orders of --lines lines each, written the
+way orders were before Order.summary existed (order_item rows only). It
+measures /orders and /order/<id>, then runs `flask
+backfill-order-summaries` and measures them again. For each page it reports
+SQL statements per request and p50 latency. It also checks that every
+backfilled snapshot matches the order's item rows, and that /orders loads
+the items of not-yet-backfilled orders in one query rather than one per order.
+
+Run: python benchmarks/bench_orders.py --orders 200 --lines 5 --repeat 100
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from support import make_app, percentile, populate_catalog
+
+statements = 0
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count(*args):
+    global statements
+    statements += 1
+
+
+def measure(client, url, repeat):
+    global statements
+    client.get(url)
+    before, samples = statements, []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        r = client.get(url)
+        samples.append((time.perf_counter() - t0) * 1000)
+    assert r.status_code == 200, (url, r.status_code)
+    samples.sort()
+    return (statements - before) / repeat, percentile(samples, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    app = make_app(METRICS_ENABLED=False)
+    populate_catalog(app, 1000)
+    from models import db, Order, OrderItem, Product, User
+    rnd = random.Random(7)
+    with app.app_context():
+        user = User(username="shopper", email="shopper@example.com", password_hash="unused")
+        db.session.add(user)
+        db.session.flush()
+        products = db.session.query(Product.id, Product.name, Product.price).all()
+        start = datetime.utcnow() - timedelta(days=args.orders)
+        for i in range(args.orders):
+            order = Order(user_id=user.id, status="paid", total_amount=0.0, created_at=start + timedelta(days=i))
+            db.session.add(order)
+            db.session.flush()
+            total = 0.0
+            for pid, name, price in rnd.sample(products, args.lines):
+                qty = rnd.randint(1, 3)
+                db.session.add(OrderItem(order_id=order.id, product_id=pid, product_name=name,
+                                         quantity=qty, unit_price=price))
+                total += qty * price
+            order.total_amount = total
+        db.session.commit()
+        user_id, last_order = user.id, order.id
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    pages = (("/orders", "/orders"), ("/order/<id>", f"/order/{last_order}"))
+
+    before = {label: measure(client, url, args.repeat) for label, url in pages}
+    result = app.test_cli_runner().invoke(args=["backfill-order-summaries", "--batch-size", "50"])
+    print(result.output.strip())
+    after = {label: measure(client, url, args.repeat) for label, url in pages}
+
+    print(f"{'page':<14}{'queries/req':>12}{'snapshot':>10}{'p50 ms':>9}{'snapshot':>10}")
+    for label, _ in pages:
+        (q, ms), (q2, ms2) = before[label], after[label]
+        print(f"{label:<14}{q:>12.1f}{q2:>10.1f}{ms:>9.2f}{ms2:>10.2f}")
+
+    failures = []
+    if before["/orders"][0] > after["/orders"][0] + 1:
+        failures.append(f"/orders runs {before['/orders'][0]:.0f} queries before the backfill (N+1 on order items)")
+    with app.app_context():
+        for order in Order.query.all():
+            rows = sorted((it.product_id, it.product_name, it.quantity, it.unit_price) for it in order.items)
+            if order.summary is None or sorted(map(tuple, order.summary["items"])) != rows:
+                failures.append(f"order {order.id}: summary does not match its items")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Order reaper throughput, and what it does to live writes.
+
+Seeds --orders stale pending orders, older than ORDER_REAP_AGE, against
+the fake Stripe (with --latency-ms per call). The mix is:
+- 70% with an open Checkout session;
+- 10% whose session was paid (a missed webhook);
+- 10% with no session at all;
+- 10% whose session Stripe does not know.
+Every stale order holds a stock reservation. Young pending orders and paid
+orders are added as well, and must be left alone.
+
+It runs `reap-orders --once` while a writer thread keeps adding to a cart,
+and reports:
+- reaper rows/s and outcome counts;
+- the writer's p50/p95/max latency, with and without the reaper running;
+- the query plan of the stale-order scan.
+
+It then checks the end state:
+- no stale pending orders are left;
+- missed payments are marked paid;
+- the held stock is back;
+- young orders are untouched.
+
+Run: python benchmarks/bench_reaper.py --orders 5000 --latency-ms 30
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fake_stripe import start_fake_stripe
+from support import make_app, percentile, populate_catalog
+
+
+def writer_latencies(app, user_id, stop):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    samples = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        client.post(f"/cart/add/{random.randint(1, 200)}", data={"qty": 1})
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def timed_writes(app, user_id, seconds):
+    stop = threading.Event()
+    result = []
+    t = threading.Thread(target=lambda: result.extend(writer_latencies(app, user_id, stop)))
+    t.start()
+    time.sleep(seconds)
+    stop.set()
+    t.join()
+    return sorted(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8, help="REAPER_STRIPE_CONCURRENCY")
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe(latency_ms=args.latency_ms)
+    app = make_app(STRIPE_API_BASE=fake.base_url, METRICS_ENABLED=True, REAPER_STRIPE_CONCURRENCY=args.concurrency)
+    populate_catalog(app, 500)
+    from models import db, Order, Product, StockReservation, User
+    rnd = random.Random(11)
+    age = app.config["ORDER_REAP_AGE"]
+    now = datetime.utcnow()
+
+    with app.app_context():
+        db.session.execute(db.update(Product).values(stock=1000))
+        user = User(username="shopper", email="shopper@example.com", password_hash="unused")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        rows, kinds = [], []
+        for i in range(args.orders):
+            roll = rnd.random()
+            sid = None
+            if roll < 0.8:
+                session = fake.new_session({"line_items": [], "metadata": {}})
+                sid = session["id"]
+                if roll >= 0.7:
+                    fake.pay(sid)
+            elif roll < 0.9:
+                sid = f"cs_test_gone{i:08d}"
+            kinds.append("paid" if 0.7 <= roll < 0.8 else "expired")
+            rows.append({"user_id": user_id, "status": "pending", "total_amount": 100.0, "stripe_session_id": sid,
+                         "created_at": now - timedelta(seconds=age + 60 + i)})
+        db.session.execute(db.insert(Order), rows)
+        stale_ids = [oid for (oid,) in db.session.query(Order.id).order_by(Order.id)]
+        # one held line of 2 units per stale order; take that stock
+        reservations = [{"order_id": oid, "product_id": 1 + oid % 200, "quantity": 2, "status": "held",
+                         "expires_at": now - timedelta(seconds=age), "created_at": now - timedelta(seconds=age)}
+                        for oid in stale_ids]
+        db.session.execute(db.insert(StockReservation), reservations)
+        taken = {}
+        for r in reservations:
+            taken[r["product_id"]] = taken.get(r["product_id"], 0) + r["quantity"]
+        for pid, qty in taken.items():
+            db.session.execute(db.update(Product).where(Product.id == pid).values(stock=Product.stock - qty))
+        young = [{"user_id": user_id, "status": "pending", "total_amount": 5.0, "created_at": now - timedelta(seconds=60)}
+                 for _ in range(100)]
+        db.session.execute(db.insert(Order), young)
+        db.session.commit()
+
+        from sqlalchemy import select, tuple_
+        scan = (select(Order.id, Order.created_at, Order.stripe_session_id)
+                .where(Order.status == "pending", Order.created_at < now,
+                       tuple_(Order.created_at, Order.id) > (now - timedelta(days=365), 0))
+                .order_by(Order.created_at, Order.id).limit(args.batch_size))
+        sql = str(scan.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+        plan = [row[-1] for row in db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql))]
+        db.session.rollback()
+
+    idle = timed_writes(app, user_id, 2.0)
+
+    stop = threading.Event()
+    busy = []
+    writer = threading.Thread(target=lambda: busy.extend(writer_latencies(app, user_id, stop)))
+    writer.start()
+    t0 = time.perf_counter()
+    result = app.test_cli_runner().invoke(args=["reap-orders", "--once", "--batch-size", str(args.batch_size)])
+    wall = time.perf_counter() - t0
+    stop.set()
+    writer.join()
+    busy.sort()
+    server.shutdown()
+
+    print(result.output.strip())
+    print(f"{args.orders} stale orders, fake Stripe {args.latency_ms:.0f}ms/call, batch {args.batch_size}, "
+          f"{args.concurrency} Stripe calls in flight: {args.orders / wall:.0f} rows/s")
+    print(f"scan plan: {' / '.join(plan)}")
+    print(f"{'cart writes':<22}{'n':>6}{'p50':>9}{'p95':>9}{'max':>9}")
+    for label, s in (("alone", idle), ("while reaping", busy)):
+        print(f"{label:<22}{len(s):>6}{percentile(s, 50):>7.1f}ms{percentile(s, 95):>7.1f}ms{s[-1]:>7.1f}ms")
+
+    failures = []
+    if result.exit_code != 0:
+        failures.append(f"reap-orders failed: {result.output}")
+    if not any("ix_order_status_created" in step for step in plan):
+        failures.append("the stale-order scan does not use ix_order_status_created")
+    with app.app_context():
+        statuses = dict(db.session.query(Order.id, Order.status).filter(Order.id.in_(stale_ids)).all())
+        for oid, kind in zip(stale_ids, kinds):
+            if statuses[oid] != kind:
+                failures.append(f"order {oid}: {statuses[oid]}, expected {kind}")
+        held = db.session.query(StockReservation).filter_by(status="held").count()
+        if held:
+            failures.append(f"{held} reservation(s) still held")
+        paid = [oid for oid, kind in zip(stale_ids, kinds) if kind == "paid"]
+        returned = sum(2 for oid in stale_ids if oid not in set(paid))
+        stock = db.session.query(db.func.sum(Product.stock)).filter(Product.id <= 200).scalar()
+        expected = 200 * 1000 - 2 * len(paid)
+        if stock != expected:
+            failures.append(f"stock is {stock}, expected {expected} ({returned} units released)")
+        young_left = db.session.query(Order).filter(Order.status == "pending", Order.total_amount == 5.0).count()
+        if young_left != 100:
+            failures.append(f"{100 - young_left} young pending order(s) were reaped")
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
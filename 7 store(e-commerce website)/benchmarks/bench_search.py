@@ -0,0 +1,60 @@
+"""
+Compare the old ILIKE scan with the FTS5 search on a generated catalog.
+
+Run: python benchmarks/bench_search.py --products 200000
+"""
+import argparse
+import time
+
+from support import make_app, populate_catalog, percentile
+
+QUERIES = ["watch", "wireless head", "leather wal", "eco bottle", "premium", "chair office", "zzz"]
+
+
+def ilike_search(query):
+    from models import Product
+    from sqlalchemy import or_
+    return Product.query.filter(
+        or_(Product.name.ilike(f"%{query}%"), Product.description.ilike(f"%{query}%"))
+    ).all()
+
+
+def fts_search(query, per_page):
+    from search import search_products
+    return search_products(query, per_page=per_page)[0]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return samples, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--per-page", type=int, default=24)
+    args = parser.parse_args()
+
+    app = make_app()
+    t0 = time.perf_counter()
+    populate_catalog(app, args.products)
+    print(f"loaded {args.products} products (FTS kept in sync by triggers) in {time.perf_counter() - t0:.1f}s")
+
+    print(f"{'query':<16}{'ilike p50 ms':>14}{'rows':>8}{'fts p50 ms':>14}{'rows':>6}{'speedup':>10}")
+    with app.app_context():
+        for q in QUERIES:
+            ilike, n_ilike = timed(lambda: ilike_search(q), args.repeat)
+            fts, n_fts = timed(lambda: fts_search(q, args.per_page), args.repeat)
+            p_ilike, p_fts = percentile(ilike, 50), percentile(fts, 50)
+            speedup = p_ilike / p_fts if p_fts else float("inf")
+            print(f"{q:<16}{p_ilike:>14.2f}{n_ilike:>8}{p_fts:>14.2f}{n_fts:>6}{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
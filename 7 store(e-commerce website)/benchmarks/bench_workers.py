@@ -0,0 +1,182 @@
+"""
+Concurrent checkouts per gunicorn worker, for each WORKER_PROFILE.
+
+Starts the fake Stripe with injected latency, then for each profile runs a
+single gunicorn worker (gunicorn.conf.py) on a copy of the same scratch
+database. Shoppers drive it over real HTTP, with --concurrency of them in
+flight at once. Each one:
+- opens /checkout (which carries the CSRF token);
+- posts /create-checkout-session, which makes one Stripe call;
+- "pays" on the fake Stripe;
+- lands on /stripe/success, which makes another Stripe call.
+
+Reported per profile: completed checkouts/s, p50/p95 latency of the two
+Stripe-bound steps, and failures. With a sync worker, checkouts queue
+behind each other's Stripe calls. With gevent they overlap.
+
+Needs gunicorn (and gevent for that profile).
+Run: python benchmarks/bench_workers.py --shoppers 200 --concurrency 32 --latency-ms 200
+"""
+import argparse
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from fake_stripe import start_fake_stripe
+from support import ROOT, make_app, percentile, populate_catalog
+
+CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare(args):
+    """Scratch database with a catalog and one user per shopper, each with a filled cart."""
+    app = make_app(METRICS_ENABLED=False)
+    populate_catalog(app, 500)
+    from models import db, Product, User
+    with app.app_context():
+        db.session.execute(db.update(Product).values(stock=1_000_000))
+        db.session.execute(db.insert(User), [
+            {"username": f"shopper{i}", "email": f"shopper{i}@example.com", "password_hash": "unused"}
+            for i in range(args.shoppers)
+        ])
+        db.session.commit()
+        user_ids = [u for (u,) in db.session.query(User.id).order_by(User.id)]
+    cookies = []
+    for i, user_id in enumerate(user_ids):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+            sess["_fresh"] = True
+        client.post("/cart/add/1", data={"qty": 1})
+        client.post(f"/cart/add/{2 + i % 400}", data={"qty": 2})
+        cookies.append(next(c.value for c in client.cookie_jar if c.name == "session"))
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    return app, cookies
+
+
+def start_gunicorn(profile, db_path, fake, app, port):
+    env = dict(os.environ,
+               WORKER_PROFILE=profile, GUNICORN_WORKERS="1", GUNICORN_BIND=f"127.0.0.1:{port}",
+               DATABASE_URL=f"sqlite:///{db_path}", SECRET_KEY=app.config["SECRET_KEY"], FLASK_DEBUG="0",
+               STRIPE_API_BASE=fake.base_url, STRIPE_SECRET_KEY="sk_test_bench",
+               FRAGMENT_CACHE_PATH=f"{db_path}.cache", CATALOG_VERSION_PATH=f"{db_path}.version",
+               IDENTITY_EPOCH_PATH=f"{db_path}.identity", CART_EPOCH_PATH=f"{db_path}.cart",
+               AUTOCOMPLETE_INDEX_PATH=f"{db_path}.autocomplete",
+               METRICS_ENABLED="0")
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:create_app()"],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except requests.ConnectionError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"gunicorn ({profile}) exited:\n{proc.stderr.read().decode()}")
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({profile}) did not start")
+
+
+def run_profile(args, profile, base_db, fake, app, cookies):
+    db_path = f"{base_db}.{profile}"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(base_db + suffix):
+            shutil.copy(base_db + suffix, db_path + suffix)
+    port = free_port()
+    proc = start_gunicorn(profile, db_path, fake, app, port)
+    base = f"http://127.0.0.1:{port}"
+    timings = {"checkout": [], "success": []}
+    failures = 0
+    lock = threading.Lock()
+
+    def shopper(i):
+        nonlocal failures
+        http = requests.Session()
+        http.cookies.set("session", cookies[i], domain="127.0.0.1")
+        try:
+            page = http.get(f"{base}/checkout", timeout=60)
+            token = CSRF_RE.search(page.text).group(1)
+            t0 = time.perf_counter()
+            r = http.post(f"{base}/create-checkout-session", data={"csrf_token": token},
+                          allow_redirects=False, timeout=60)
+            t_checkout = (time.perf_counter() - t0) * 1000
+            if r.status_code != 303 or not r.headers["Location"].startswith(fake.base_url):
+                raise RuntimeError(f"checkout answered {r.status_code}")
+            paid = requests.get(r.headers["Location"], allow_redirects=False, timeout=60)
+            success = urlparse(paid.headers["Location"])
+            t0 = time.perf_counter()
+            r = http.get(f"{base}{success.path}?{success.query}", timeout=60)
+            t_success = (time.perf_counter() - t0) * 1000
+            if r.status_code != 200:
+                raise RuntimeError(f"success page answered {r.status_code}")
+        except Exception:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            timings["checkout"].append(t_checkout)
+            timings["success"].append(t_success)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(shopper, range(args.shoppers)))
+    wall = time.perf_counter() - t0
+    proc.send_signal(signal.SIGTERM)
+    proc.wait(timeout=30)
+
+    checkout, success = sorted(timings["checkout"]), sorted(timings["success"])
+    return {
+        "profile": profile,
+        "checkouts_per_s": len(success) / wall,
+        "checkout_p50": percentile(checkout, 50), "checkout_p95": percentile(checkout, 95),
+        "success_p50": percentile(success, 50), "success_p95": percentile(success, 95),
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shoppers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--profiles", default="sync,gthread,gevent")
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    app, cookies = prepare(args)
+    base_db = app.config["BENCH_DB_PATH"]
+
+    rows = [run_profile(args, profile, base_db, fake, app, cookies) for profile in args.profiles.split(",")]
+    server.shutdown()
+
+    print(f"1 worker per profile, {args.shoppers} shoppers, {args.concurrency} in flight, "
+          f"fake Stripe latency {args.latency_ms:.0f}+{args.jitter_ms:.0f}ms")
+    print(f"{'profile':<9}{'checkouts/s':>12}{'create p50':>12}{'p95':>9}{'success p50':>13}{'p95':>9}{'failed':>8}")
+    for r in rows:
+        print(f"{r['profile']:<9}{r['checkouts_per_s']:>12.1f}{r['checkout_p50']:>10.0f}ms{r['checkout_p95']:>7.0f}ms"
+              f"{r['success_p50']:>11.0f}ms{r['success_p95']:>7.0f}ms{r['failures']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Check the /browse query plans and measure how latency scales with catalog size.
+
+For every sort order and every combination of filters (price range,
+seller, in stock), with and without a cursor, this runs EXPLAIN QUERY
+PLAN on the page query and on the facet count queries. Every page query
+must read one covering index and sort nothing (no TEMP B-TREE). Facet
+queries must read product_facet or a covering index, never the product
+table itself. Price ranges are tried both on facet bucket edges and typed
+(cutting through price bands).
+
+Then it times the first page and a deep page (after --deep-pages pages)
+for each sort on each catalog size, and fails if a deep page is much
+slower than the first one. It also times the facet counts (uncached) for
+a set of filters, and fails if any p50 exceeds --max-facet-ms or if the
+counts differ from a direct count over the product table.
+
+Run: python benchmarks/explain_browse.py --sizes 20000 200000 1000000
+"""
+import argparse
+import itertools
+import re
+import sys
+import time
+from datetime import datetime
+
+from support import make_app, percentile, populate_catalog
+
+SELLERS = 50
+
+
+def build(size):
+    app = make_app(METRICS_ENABLED=False)
+    from models import db, User
+    with app.app_context():
+        db.session.execute(db.insert(User), [
+            {"username": f"seller{i}", "email": f"seller{i}@example.com", "password_hash": "unused", "is_seller": True}
+            for i in range(SELLERS)
+        ])
+        db.session.commit()
+    populate_catalog(app, size, batch_size=20000, seller_ids=list(range(1, SELLERS + 1)) + [None])
+    return app
+
+
+def plan(stmt):
+    from models import db
+    compiled = stmt.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(
+        v.isoformat(" ") if isinstance(v, datetime) else v
+        for v in (compiled.params[name] for name in compiled.positiontup)
+    )
+    with db.engine.connect() as conn:
+        return [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params)]
+
+
+def filter_matrix():
+    from browse import BrowseFilters, SORTS
+    prices = (None, (1000.0, 5000.0), (1234.5, 4321.0))  # none, bucket edges, typed
+    for sort, price, seller, stock in itertools.product(SORTS, prices, (False, True), (False, True)):
+        yield BrowseFilters(
+            min_price=price[0] if price else None,
+            max_price=price[1] if price else None,
+            seller_id=3 if seller else None,
+            in_stock=stock,
+            sort=sort,
+        )
+
+
+def check_plans(app):
+    from browse import SORTS, facet_queries, page_ids_query
+    from pagination import encode_cursor
+
+    failures = []
+    with app.app_context():
+        for filters in filter_matrix():
+            start = datetime(2024, 1, 5) if SORTS[filters.sort][0].key == "created_at" else 2000.0
+            for cursor in (None, encode_cursor(start, 100)):
+                steps = plan(page_ids_query(filters, cursor, 25))
+                label = f"page {filters.to_args()} cursor={'yes' if cursor else 'no'}"
+                if len(steps) != 1 or "USING COVERING INDEX" not in steps[0]:
+                    failures.append(f"{label}: {steps}")
+                elif any("TEMP B-TREE" in s for s in steps):
+                    failures.append(f"{label}: sorts in a temp b-tree: {steps}")
+            for name, statements in facet_queries(filters).items():
+                for stmt in statements:
+                    steps = plan(stmt)
+                    if any(re.search(r"(SCAN|SEARCH) product\b(?!_)", s) and "COVERING INDEX" not in s for s in steps):
+                        failures.append(f"facet {name} {filters.to_args()}: {steps}")
+    return failures
+
+
+FACET_FILTERS = (
+    {},
+    {"min_price": 1000.0, "max_price": 5000.0},
+    {"min_price": 1234.5, "max_price": 4321.0},
+    {"min_price": 20000.0},
+    {"seller_id": 3, "in_stock": True},
+    {"min_price": 1234.5, "max_price": 4321.0, "seller_id": 3},
+)
+
+
+def direct_facet_counts(filters):
+    """The facet counts of browse.facet_counts(), by scanning the product table."""
+    from browse import SELLER_FACET_SIZE, _price_buckets
+    from models import db, Product
+    from sqlalchemy import func, select
+
+    def count(skip, *terms):
+        return db.session.execute(select(func.count()).select_from(Product)
+                                  .where(*filters.conditions(skip=skip), *terms)).scalar()
+
+    prices = [(low, high, count(("price",), Product.price >= low, *([Product.price < high] if high else [])))
+              for low, high in _price_buckets()]
+    rows = db.session.execute(select(Product.seller_id, func.count())
+                              .where(Product.seller_id.isnot(None), *filters.conditions(skip=("seller",)))
+                              .group_by(Product.seller_id)).all()
+    sellers = sorted(rows, key=lambda row: (-row[1], row[0]))[:SELLER_FACET_SIZE]
+    return prices, [tuple(row) for row in sellers], count(("stock",), Product.stock > 0)
+
+
+def time_facets(app, repeat):
+    """({filters: facet_counts p50 ms}, failures)."""
+    from browse import BrowseFilters, facet_counts
+    results, failures = {}, []
+    with app.app_context():
+        from models import db
+        for args in FACET_FILTERS:
+            filters = BrowseFilters(**args)
+            samples = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                counts = facet_counts(filters)
+                samples.append((time.perf_counter() - t0) * 1000)
+                db.session.rollback()
+            results[filters] = percentile(sorted(samples), 50)
+            got = (counts["prices"], [(s, n) for s, _, n in counts["sellers"]], counts["in_stock"])
+            if not counts["approximate"] and got != direct_facet_counts(filters):
+                failures.append(f"facet counts for {filters.to_args()} differ from a direct count")
+    return results, failures
+
+
+def time_pages(app, deep_pages, repeat):
+    from browse import BrowseFilters, SORTS, browse_products
+    results = {}
+    with app.app_context():
+        from models import db
+        for sort in SORTS:
+            filters = BrowseFilters(sort=sort)
+            cursor = None
+            for _ in range(deep_pages):
+                _, cursor = browse_products(filters, cursor)
+            for label, cur in (("first", None), ("deep", cursor)):
+                samples = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    browse_products(filters, cur)
+                    samples.append((time.perf_counter() - t0) * 1000)
+                    db.session.rollback()
+                results[(sort, label)] = percentile(sorted(samples), 50)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 200000])
+    parser.add_argument("--deep-pages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--max-deep-ratio", type=float, default=3.0,
+                        help="fail if a deep page's p50 exceeds the first page's by this factor")
+    parser.add_argument("--max-facet-ms", type=float, default=25.0,
+                        help="fail if computing the facet counts for a filter set takes longer (p50)")
+    args = parser.parse_args()
+
+    failures = []
+    for size in args.sizes:
+        t0 = time.perf_counter()
+        app = build(size)
+        print(f"{size} products (built in {time.perf_counter() - t0:.1f}s)")
+        plan_failures = check_plans(app)
+        print(f"  query plans: {'OK' if not plan_failures else f'{len(plan_failures)} problem(s)'}")
+        failures.extend(f"{size}: {f}" for f in plan_failures)
+
+        timings = time_pages(app, args.deep_pages, args.repeat)
+        for (sort, label), ms in sorted(timings.items()):
+            print(f"  {sort:<11} {label:<6} p50 {ms:6.2f}ms")
+        for sort in {s for s, _ in timings}:
+            first, deep = timings[(sort, "first")], timings[(sort, "deep")]
+            if deep > max(first, 0.5) * args.max_deep_ratio:
+                failures.append(f"{size}: {sort} page {args.deep_pages} takes {deep:.2f}ms vs {first:.2f}ms")
+
+        facet_timings, facet_failures = time_facets(app, max(3, args.repeat // 3))
+        failures.extend(f"{size}: {f}" for f in facet_failures)
+        for filters, ms in facet_timings.items():
+            print(f"  facets {str(filters.to_args() or 'no filters'):<58} p50 {ms:6.2f}ms")
+            if ms > args.max_facet_ms:
+                failures.append(f"{size}: facet counts for {filters.to_args()} take {ms:.2f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+A local stand-in for the parts of the Stripe API the store uses, for
+offline tests and load tests. Point the app at it with
+STRIPE_API_BASE=http://127.0.0.1:12111.
+
+  POST /v1/checkout/sessions              create a session (form encoded, like stripe-python)
+  GET  /v1/checkout/sessions/<id>         retrieve it
+  POST /v1/checkout/sessions/<id>/expire  expire an open session
+  GET  /pay/<id>                          "customer pays": marks it paid, optionally
+                                          sends a signed webhook, redirects to success_url
+
+Latency and error injection make timeouts, retries and the circuit breaker
+observable: --latency-ms, --jitter-ms, --error-rate.
+
+Run: python benchmarks/fake_stripe.py --port 12111 --latency-ms 300
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+def _unflatten(pairs):
+    """Decode stripe-python's form encoding: a[b][0][c]=v -> {"a": {"b": [{"c": v}]}}."""
+    root = {}
+    for key, value in pairs:
+        parts = key.replace("]", "").split("[")
+        node = root
+        for part, nxt in zip(parts, parts[1:] + [None]):
+            if isinstance(node, list):
+                part = int(part)
+                while len(node) <= part:
+                    node.append(None)
+                current = node[part]
+            else:
+                current = node.get(part)
+            if nxt is None:
+                node[part] = value
+                break
+            if current is None:
+                current = [] if nxt.isdigit() else {}
+                node[part] = current
+            node = current
+    return root
+
+
+class FakeStripe:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, webhook_url=None, webhook_secret=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.sessions = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.base_url = None
+
+    def new_session(self, params):
+        with self._lock:
+            sid = f"cs_test_fake{next(self._ids):08d}"
+        amount = 0
+        for item in params.get("line_items", []) or []:
+            price = (item or {}).get("price_data", {})
+            amount += int(price.get("unit_amount", 0)) * int(item.get("quantity", 1))
+        session = {
+            "id": sid,
+            "object": "checkout.session",
+            "mode": params.get("mode", "payment"),
+            "status": "open",
+            "payment_status": "unpaid",
+            "payment_intent": None,
+            "amount_total": amount,
+            "currency": "inr",
+            "metadata": params.get("metadata", {}),
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "url": f"{self.base_url}/pay/{sid}",
+            "created": int(time.time()),
+        }
+        with self._lock:
+            self.sessions[sid] = session
+        return session
+
+    def pay(self, sid):
+        with self._lock:
+            session = self.sessions.get(sid)
+            if session is None or session["status"] != "open":
+                return session
+            session.update(status="complete", payment_status="paid",
+                           payment_intent=f"pi_test_{sid[len('cs_test_'):]}")
+        if self.webhook_url:
+            self.send_webhook("checkout.session.completed", session)
+        return session
+
+    def send_webhook(self, event_type, obj):
+        payload = json.dumps({
+            "id": f"evt_{obj['id']}_{event_type}",
+            "object": "event",
+            "type": event_type,
+            "data": {"object": obj},
+        }).encode()
+        ts = int(time.time())
+        sig = hmac.new(self.webhook_secret.encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+        req = urllib.request.Request(self.webhook_url, data=payload, headers={
+            "Content-Type": "application/json", "Stripe-Signature": f"t={ts},v1={sig}"})
+        try:
+            urllib.request.urlopen(req, timeout=5).read()
+        except Exception as e:  # the real Stripe would retry; the stand-in just reports it
+            print(f"webhook delivery failed: {e}")
+
+
+def make_handler(stripe):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def _delay_or_fail(self):
+            with stripe._lock:
+                stripe.requests += 1
+            delay = stripe.latency_ms + (random.uniform(0, stripe.jitter_ms) if stripe.jitter_ms else 0)
+            if delay:
+                time.sleep(delay / 1000.0)
+            if stripe.error_rate and random.random() < stripe.error_rate:
+                self._json(500, {"error": {"type": "api_error", "message": "injected failure"}})
+                return True
+            return False
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Request-Id", f"req_fake_{stripe.requests}")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length).decode() if length else ""
+
+        def _not_found(self):
+            self._json(404, {"error": {"type": "invalid_request_error", "message": "No such checkout session"}})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            params = _unflatten(parse_qsl(self._body(), keep_blank_values=True))
+            if self._delay_or_fail():
+                return
+            if path == "/v1/checkout/sessions":
+                expires_at = params.get("expires_at")
+                if expires_at and not 1800 <= int(expires_at) - time.time() <= 86400:
+                    # like Stripe: a session must expire between 30 minutes and 24 hours from now
+                    return self._json(400, {"error": {"type": "invalid_request_error", "param": "expires_at",
+                                                      "message": "expires_at must be 30 minutes to 24 hours out"}})
+                return self._json(200, stripe.new_session(params))
+            if path.startswith("/v1/checkout/sessions/") and path.endswith("/expire"):
+                sid = path.split("/")[4]
+                with stripe._lock:
+                    session = stripe.sessions.get(sid)
+                    if session and session["status"] == "open":
+                        session["status"] = "expired"
+                if session is None:
+                    return self._not_found()
+                return self._json(200, session)
+            self._not_found()
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            path = parsed.path
+            if path.startswith("/pay/"):
+                session = stripe.pay(path[len("/pay/"):])
+                if session is None:
+                    return self._not_found()
+                target = (session.get("success_url") or "/").replace("{CHECKOUT_SESSION_ID}", session["id"])
+                self.send_response(303)
+                self.send_header("Location", target)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self._delay_or_fail():
+                return
+            if path.startswith("/v1/checkout/sessions/"):
+                session = stripe.sessions.get(path.split("/")[4])
+                if session is None:
+                    return self._not_found()
+                body = dict(session)
+                if "payment_intent" in parsed.query and body.get("payment_intent"):
+                    body["payment_intent"] = {"id": body["payment_intent"], "object": "payment_intent",
+                                              "status": "succeeded"}
+                return self._json(200, body)
+            self._not_found()
+
+    return Handler
+
+
+def start_fake_stripe(host="127.0.0.1", port=0, **options):
+    """Start the stand-in on a background thread. Returns (server, fake)."""
+    fake = FakeStripe(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    fake.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-url", default=None, help="e.g. http://127.0.0.1:5000/stripe/webhook")
+    parser.add_argument("--webhook-secret", default="whsec_bench")
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe(args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                     error_rate=args.error_rate, webhook_url=args.webhook_url,
+                                     webhook_secret=args.webhook_secret)
+    print(f"fake Stripe listening on {fake.base_url} (set STRIPE_API_BASE to this)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+End-to-end load test of the main 7Store journeys.
+
+Builds create_app() on a generated dataset (products, shoppers with order
+history, an admin) with Stripe replaced by the local fake, then replays a
+weighted mix of journeys from concurrent virtual users:
+
+  home, product detail, search, add-to-cart, cart, checkout (+ Stripe
+  session), order history and the admin dashboard.
+
+For every endpoint it reports p50/p95/p99 latency, requests per second and
+SQL queries per request, and writes them as JSON so runs can be diffed.
+
+Run: python benchmarks/loadtest.py --products 100000 --users 500 --concurrency 16 \
+        --requests 5000 --out results/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fake_stripe import start_fake_stripe
+from support import ADJECTIVES, NOUNS, make_app, populate_catalog, percentile
+
+# journey -> relative weight in the default mix
+DEFAULT_MIX = {
+    "home": 25,
+    "product": 25,
+    "search": 15,
+    "add_to_cart": 10,
+    "cart": 8,
+    "checkout": 5,
+    "orders": 8,
+    "admin": 4,
+}
+
+
+def build_dataset(app, products, users, orders_per_user, seed=7):
+    from models import db, User, Order, OrderItem
+
+    populate_catalog(app, products)
+    rnd = random.Random(seed)
+    with app.app_context():
+        admin = User(username="admin", email="admin@example.com", is_admin=True, password_hash="unused")
+        db.session.add(admin)
+        db.session.execute(db.insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "unused"}
+            for i in range(users)
+        ])
+        db.session.commit()
+        user_ids = [uid for (uid,) in db.session.query(User.id).filter(User.is_admin.isnot(True))]
+
+        start = datetime(2024, 1, 1)
+        order_rows = []
+        for uid in user_ids:
+            for k in range(orders_per_user):
+                order_rows.append({"user_id": uid, "total_amount": 0.0,
+                                   "status": rnd.choice(["paid", "paid", "shipped", "pending"]),
+                                   "created_at": start + timedelta(hours=k, minutes=uid % 60)})
+        for i in range(0, len(order_rows), 5000):
+            db.session.execute(db.insert(Order), order_rows[i:i + 5000])
+        db.session.commit()
+
+        item_rows = []
+        for (oid,) in db.session.query(Order.id):
+            for _ in range(rnd.randint(1, 4)):
+                item_rows.append({"order_id": oid, "product_id": rnd.randint(1, products),
+                                  "product_name": "Item", "quantity": rnd.randint(1, 3),
+                                  "unit_price": round(rnd.uniform(99, 4999), 2)})
+            if len(item_rows) >= 5000:
+                db.session.execute(db.insert(OrderItem), item_rows)
+                item_rows = []
+        if item_rows:
+            db.session.execute(db.insert(OrderItem), item_rows)
+        db.session.commit()
+        slugs = [s for (s,) in db.session.query(db.text("slug FROM product ORDER BY random() LIMIT 2000"))]
+        return admin.id, user_ids, slugs
+
+
+class QueryCounter:
+    """Counts SQL statements per thread (each virtual user runs its requests on one thread)."""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self._local = threading.local()
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, "count", 0)
+
+
+class VirtualUser:
+    def __init__(self, app, user_id, admin_id, slugs, product_count, rnd):
+        self.client = app.test_client()
+        self.admin_client = app.test_client()
+        for client, uid in ((self.client, user_id), (self.admin_client, admin_id)):
+            with client.session_transaction() as sess:
+                sess["_user_id"] = str(uid)
+                sess["_fresh"] = True
+        self.slugs = slugs
+        self.product_count = product_count
+        self.rnd = rnd
+
+    def journey(self, name):
+        """Run one journey; returns a list of (endpoint, callable) steps."""
+        c, rnd = self.client, self.rnd
+        if name == "home":
+            return [("GET /", lambda: c.get("/"))]
+        if name == "product":
+            slug = rnd.choice(self.slugs)
+            return [("GET /product/<slug>", lambda: c.get(f"/product/{slug}"))]
+        if name == "search":
+            q = rnd.choice([rnd.choice(NOUNS), f"{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)[:3]}"])
+            return [("GET /search", lambda: c.get("/search", query_string={"q": q}))]
+        if name == "add_to_cart":
+            pid = rnd.randint(1, self.product_count)
+            return [("POST /cart/add/<id>", lambda: c.post(f"/cart/add/{pid}", data={"qty": 1}))]
+        if name == "cart":
+            return [("GET /cart", lambda: c.get("/cart"))]
+        if name == "checkout":
+            return [("GET /checkout", lambda: c.get("/checkout")),
+                    ("POST /create-checkout-session", lambda: c.post("/create-checkout-session"))]
+        if name == "orders":
+            return [("GET /orders", lambda: c.get("/orders"))]
+        if name == "admin":
+            return [("GET /admin/dashboard", lambda: self.admin_client.get("/admin/dashboard")),
+                    ("GET /admin/orders", lambda: self.admin_client.get("/admin/orders"))]
+        raise ValueError(name)
+
+
+def run(args):
+    server, fake = start_fake_stripe(latency_ms=args.stripe_latency_ms)
+    app = make_app(STRIPE_API_BASE=fake.base_url)
+    t0 = time.perf_counter()
+    admin_id, user_ids, slugs = build_dataset(app, args.products, args.users, args.orders_per_user)
+    print(f"dataset: {args.products} products, {args.users} users x {args.orders_per_user} orders "
+          f"built in {time.perf_counter() - t0:.1f}s")
+
+    from models import db
+    with app.app_context():
+        counter = QueryCounter(db.engines.values())  # writer and read-only engine
+
+    mix = dict(DEFAULT_MIX)
+    for spec in args.mix or []:
+        name, weight = spec.split("=")
+        mix[name] = float(weight)
+    names, weights = zip(*[(k, v) for k, v in mix.items() if v > 0])
+
+    samples = defaultdict(list)   # endpoint -> [(ms, queries, status)]
+    lock = threading.Lock()
+    local = threading.local()
+    rnd_master = random.Random(args.seed)
+    seeds = [rnd_master.random() for _ in range(args.requests)]
+
+    def one(i):
+        if not hasattr(local, "vu"):
+            rnd = random.Random(seeds[i])
+            local.vu = VirtualUser(app, rnd.choice(user_ids), admin_id, slugs, args.products, rnd)
+        vu = local.vu
+        journey = vu.rnd.choices(names, weights)[0]
+        for endpoint, step in vu.journey(journey):
+            counter.reset()
+            start = time.perf_counter()
+            resp = step()
+            ms = (time.perf_counter() - start) * 1000
+            with lock:
+                samples[endpoint].append((ms, counter.count, resp.status_code))
+
+    # warm up caches and connection pools so the first requests do not skew p99
+    for i in range(min(args.warmup, args.requests)):
+        one(i)
+    samples.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - start
+    server.shutdown()
+    return summarize(samples, wall, args)
+
+
+def summarize(samples, wall, args):
+    endpoints = {}
+    total = 0
+    for endpoint, rows in sorted(samples.items()):
+        lat = sorted(r[0] for r in rows)
+        queries = [r[1] for r in rows]
+        errors = sum(1 for r in rows if r[2] >= 500)
+        total += len(rows)
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "rps": round(len(rows) / wall, 2),
+            "p50_ms": round(percentile(lat, 50), 2),
+            "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2),
+            "mean_ms": round(sum(lat) / len(lat), 2),
+            "queries_mean": round(sum(queries) / len(queries), 2),
+            "queries_max": max(queries),
+            "errors_5xx": errors,
+        }
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                      stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        rev = None
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "git_rev": rev,
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "totals": {"requests": total, "wall_s": round(wall, 2), "rps": round(total / wall, 2)},
+        "endpoints": endpoints,
+    }
+
+
+def print_table(result):
+    print(f"{'endpoint':<32}{'n':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'sql/req':>9}{'5xx':>6}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:<32}{e['requests']:>7}{e['rps']:>9.1f}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+              f"{e['p99_ms']:>9.1f}{e['queries_mean']:>9.1f}{e['errors_5xx']:>6}")
+    t = result["totals"]
+    print(f"total: {t['requests']} requests in {t['wall_s']}s = {t['rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--orders-per-user", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="journeys to run")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--stripe-latency-ms", type=float, default=0)
+    parser.add_argument("--mix", nargs="*", help="override weights, e.g. search=40 admin=0")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_table(result)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as fh:
+            json.dump(result, fh, indent=2, sort_keys=True)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Replay a burst of signed Stripe webhook events and drain the queue.
+
+Creates pending orders in a scratch database, signs one
+checkout.session.completed event per order (plus Stripe-style retries of a
+share of them) and fires them concurrently at /stripe/webhook. It then runs
+the queue worker and checks that every order was paid exactly once.
+
+Run: python benchmarks/replay_webhooks.py --events 5000 --duplicates 0.3
+     python benchmarks/replay_webhooks.py --url http://127.0.0.1:5000  (live server)
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from support import make_app
+
+SECRET = "whsec_bench"
+
+
+def sign(payload, secret, timestamp=None):
+    """Stripe-Signature header value for `payload` (bytes)."""
+    timestamp = int(timestamp or time.time())
+    signed = f"{timestamp}.".encode() + payload
+    digest = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def checkout_completed(event_id, order_id):
+    return {
+        "id": event_id,
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {
+            "id": f"cs_test_{order_id}",
+            "object": "checkout.session",
+            "payment_status": "paid",
+            "payment_intent": f"pi_test_{order_id}",
+            "metadata": {"order_id": str(order_id)},
+        }},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=5000, help="distinct events (one per order)")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="share of events re-delivered")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--url", default=None, help="post to a running server instead of in-process")
+    args = parser.parse_args()
+
+    app = make_app(STRIPE_WEBHOOK_SECRET=SECRET)
+    from models import db, Order, StripeEvent
+    from webhooks import drain_once
+
+    with app.app_context():
+        db.session.execute(db.insert(Order), [
+            {"user_id": 1, "total_amount": 100.0, "status": "pending"} for _ in range(args.events)
+        ])
+        db.session.commit()
+        order_ids = [oid for (oid,) in db.session.query(Order.id).order_by(Order.id)]
+
+    deliveries = []
+    for i, oid in enumerate(order_ids):
+        payload = json.dumps(checkout_completed(f"evt_bench_{i}", oid)).encode()
+        deliveries.append(payload)
+        if random.random() < args.duplicates:
+            deliveries.append(payload)  # Stripe retry of the same event
+    random.shuffle(deliveries)
+
+    local = threading.local()
+
+    def post(payload):
+        headers = {"Stripe-Signature": sign(payload, SECRET), "Content-Type": "application/json"}
+        if args.url:
+            import requests
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return local.session.post(f"{args.url}/stripe/webhook", data=payload, headers=headers).status_code
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        return local.client.post("/stripe/webhook", data=payload, headers=headers).status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(post, deliveries))
+    ingest = time.perf_counter() - t0
+    bad = sum(1 for s in statuses if s != 200)
+    print(f"ingested {len(deliveries)} deliveries in {ingest:.2f}s "
+          f"({len(deliveries) / ingest:.0f}/s), non-200: {bad}")
+
+    if args.url:
+        print("live server: run `flask process-webhooks --once` there to drain")
+        return
+
+    with app.app_context():
+        t0 = time.perf_counter()
+        batches = 0
+        while drain_once(args.batch_size):
+            batches += 1
+        drain = time.perf_counter() - t0
+        queued = db.session.query(StripeEvent).count()
+        paid = db.session.query(Order).filter_by(status="paid").count()
+        with_intent = db.session.query(Order).filter(Order.payment_intent.isnot(None)).count()
+
+    print(f"drained {queued} queued event(s) in {batches} batch(es), {drain:.2f}s ({queued / drain:.0f}/s)")
+    print(f"orders paid: {paid}/{len(order_ids)}, with payment_intent: {with_intent}")
+    assert queued == len(order_ids), "duplicate deliveries must be dropped at enqueue"
+    assert paid == len(order_ids) == with_intent, "every order must be paid exactly once"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Flash-sale stress test: hundreds of parallel checkouts for one product.
+
+Every shopper has the same SKU in their cart and posts to
+/create-checkout-session at once (Stripe is the local fake). Afterwards
+it checks that exactly `stock` checkouts got through, that stock never
+went below zero, that reservations match and that the product page
+switches to (and back from) "Out of stock". It also checks that nothing
+is swept while its Stripe session can still be paid, that paying converts
+reservations to sales, that the sweeper returns the rest, and that
+throughput met the target. The fake Stripe rejects session expiries
+outside Stripe's 30 min - 24 h window.
+
+Run: python benchmarks/stress_reservations.py --shoppers 500 --stock 100 --concurrency 32 --min-rps 50
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fake_stripe import start_fake_stripe
+from support import make_app, populate_catalog, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shoppers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--qty", type=int, default=1, help="units per checkout")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stripe-latency-ms", type=float, default=0)
+    parser.add_argument("--min-rps", type=float, default=50.0, help="fail below this many checkouts/s")
+    args = parser.parse_args()
+
+    server, fake = start_fake_stripe(latency_ms=args.stripe_latency_ms)
+    app = make_app(STRIPE_API_BASE=fake.base_url, STRIPE_POOL_SIZE=args.concurrency, METRICS_ENABLED=False)
+    populate_catalog(app, 10)
+
+    from models import db, User, Product, Order, StockReservation
+    from inventory import checkout_ttl, sweep_expired
+    from orders import mark_orders_paid
+
+    with app.app_context():
+        sku = db.session.get(Product, 1)
+        sku.stock = args.stock
+        sku_url = f"/product/{sku.slug}"
+        db.session.execute(db.insert(User), [
+            {"username": f"flash{i}", "email": f"flash{i}@example.com", "password_hash": "unused"}
+            for i in range(args.shoppers)
+        ])
+        db.session.commit()
+        user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+
+    def out_of_stock_badge():
+        return b"Out of stock" in app.test_client().get(sku_url).data
+
+    badge_before = out_of_stock_badge()  # also caches the in-stock page fragment
+
+    # fill every cart before the sale opens
+    clients = []
+    for uid in user_ids:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(uid)
+            sess["_fresh"] = True
+        client.post("/cart/add/1", data={"qty": args.qty})
+        clients.append(client)
+
+    timings, outcomes = [], {"won": 0, "sold_out": 0, "error": 0}
+    lock = threading.Lock()
+    start_gate = threading.Event()
+
+    def checkout(client):
+        start_gate.wait()
+        t0 = time.perf_counter()
+        r = client.post("/create-checkout-session")
+        ms = (time.perf_counter() - t0) * 1000
+        if r.status_code == 303 and r.location.startswith(fake.base_url):
+            outcome = "won"
+        elif r.status_code == 302 and r.location.endswith("/cart"):
+            outcome = "sold_out"
+        else:
+            outcome = "error"
+        with lock:
+            timings.append(ms)
+            outcomes[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(checkout, c) for c in clients]
+        t0 = time.perf_counter()
+        start_gate.set()
+        for f in futures:
+            f.result()
+        wall = time.perf_counter() - t0
+    rps = args.shoppers / wall
+    badge_sold_out = out_of_stock_badge()
+
+    expected = min(args.shoppers, args.stock // args.qty)
+    with app.app_context():
+        stock_left = db.session.get(Product, 1).stock
+        held = db.session.query(db.func.coalesce(db.func.sum(StockReservation.quantity), 0)) \
+            .filter_by(product_id=1, status="held").scalar()
+        pending = [oid for (oid,) in db.session.query(Order.id).filter_by(status="pending")]
+        # the sessions close checkout_ttl() from now; the stock must still be held then
+        early = sweep_expired(now=datetime.utcnow() + timedelta(seconds=checkout_ttl()))
+
+        # half the winners pay; the sweeper must hand back the other half once expired
+        paid = pending[: len(pending) // 2]
+        mark_orders_paid({oid: f"pi_stress_{oid}" for oid in paid})
+        db.session.commit()
+        released = 0
+        while True:
+            n = sweep_expired(now=datetime.utcnow() + timedelta(days=1))
+            if not n:
+                break
+            released += n
+        stock_after_sweep = db.session.get(Product, 1).stock
+        sold = db.session.query(db.func.coalesce(db.func.sum(StockReservation.quantity), 0)) \
+            .filter_by(product_id=1, status="sold").scalar()
+    server.shutdown()
+    badge_after = out_of_stock_badge()
+
+    s = sorted(timings)
+    print(f"{args.shoppers} shoppers x {args.qty} unit(s) for {args.stock} in stock, concurrency {args.concurrency}")
+    print(f"  checkouts: won={outcomes['won']} sold_out={outcomes['sold_out']} errors={outcomes['error']}")
+    print(f"  latency p50={percentile(s, 50):.1f}ms p95={percentile(s, 95):.1f}ms p99={percentile(s, 99):.1f}ms, "
+          f"{rps:.1f} checkouts/s")
+    print(f"  stock left={stock_left}, held={held}; after paying {len(paid)} and sweeping {released}: "
+          f"stock={stock_after_sweep}, sold={sold}")
+
+    failures = []
+    if outcomes["won"] != expected:
+        failures.append(f"expected {expected} successful checkouts, got {outcomes['won']}")
+    if stock_left < 0 or stock_left != args.stock - outcomes["won"] * args.qty:
+        failures.append(f"stock is {stock_left} after {outcomes['won']} checkouts")
+    if held != outcomes["won"] * args.qty:
+        failures.append(f"held reservations ({held}) do not match checkouts")
+    if (badge_before, badge_sold_out, badge_after) != (False, stock_left <= 0, stock_after_sweep <= 0):
+        failures.append(f"product page 'Out of stock' badge before/during/after: "
+                        f"{badge_before}/{badge_sold_out}/{badge_after}")
+    if early:
+        failures.append(f"{early} reservation(s) released while their Stripe session was still open")
+    if outcomes["error"]:
+        failures.append(f"{outcomes['error']} checkouts failed unexpectedly")
+    if sold != len(paid) * args.qty or stock_after_sweep != args.stock - sold:
+        failures.append("paid orders were not converted to sales or expired stock was not returned")
+    if rps < args.min_rps:
+        failures.append(f"throughput {rps:.1f}/s is below the {args.min_rps}/s target")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
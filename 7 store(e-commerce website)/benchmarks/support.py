@@ -0,0 +1,101 @@
+"""
+Shared helpers for the benchmark scripts: build the app against a scratch
+database and fill it with a generated catalog.
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# the app modules use flat imports (from models import ...), so run from the project root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+
+ADJECTIVES = ["wireless", "classic", "compact", "premium", "travel", "smart", "organic", "vintage",
+              "ultra", "portable", "leather", "cotton", "steel", "bamboo", "ergonomic", "waterproof"]
+NOUNS = ["headphones", "backpack", "watch", "lamp", "bottle", "keyboard", "jacket", "speaker",
+         "notebook", "wallet", "sneakers", "blender", "camera", "chair", "mug", "charger"]
+WORDS = ["durable", "lightweight", "gift", "everyday", "comfortable", "hd", "sound", "battery",
+         "fitness", "kitchen", "office", "outdoor", "handmade", "eco", "fast", "warranty"]
+
+
+def make_app(db_path=None, run_init=True, **overrides):
+    """
+    Create the app on a throwaway SQLite file with CSRF off and Stripe unset.
+    Pass run_init=False to attach to a database another process already set up.
+    """
+    from app import create_app
+
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(prefix="7store-bench-", suffix=".db")
+        os.close(fd)
+        os.unlink(db_path)
+
+    class BenchConfig(Config):
+        TESTING = True
+        DEBUG = False
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(db_path)}"
+        STRIPE_SECRET_KEY = "sk_test_bench"
+        STRIPE_WEBHOOK_SECRET = "whsec_bench"
+        FRAGMENT_CACHE_PATH = f"{os.path.abspath(db_path)}.cache"
+        CATALOG_VERSION_PATH = f"{os.path.abspath(db_path)}.version"
+        IDENTITY_EPOCH_PATH = f"{os.path.abspath(db_path)}.identity"
+        CART_EPOCH_PATH = f"{os.path.abspath(db_path)}.cart"
+        AUTOCOMPLETE_INDEX_PATH = f"{os.path.abspath(db_path)}.autocomplete"
+
+    for key, value in overrides.items():
+        setattr(BenchConfig, key, value)
+
+    app = create_app(BenchConfig)
+    app.config["BENCH_DB_PATH"] = db_path
+    if run_init:
+        with app.app_context():
+            from schema import init_schema
+            init_schema()
+    return app
+
+
+def generate_products(n, seed=7, seller_ids=(None,)):
+    """Yield n product rows as dicts, ready for a bulk insert."""
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(1, n + 1):
+        name = f"{rnd.choice(ADJECTIVES).title()} {rnd.choice(NOUNS).title()} {i}"
+        yield {
+            "seller_id": rnd.choice(seller_ids),
+            "name": name,
+            "slug": f"{name.lower().replace(' ', '-')}",
+            "description": " ".join(rnd.choice(WORDS) for _ in range(12)),
+            "price": round(rnd.uniform(99, 49999), 2),
+            "stock": rnd.randint(0, 200),
+            "created_at": start + timedelta(minutes=i),
+        }
+
+
+def populate_catalog(app, n, batch_size=5000, **kwargs):
+    """Bulk insert n generated products in batched executemany transactions."""
+    from models import db, Product
+
+    with app.app_context():
+        batch = []
+        for row in generate_products(n, **kwargs):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                db.session.execute(db.insert(Product), batch)
+                db.session.commit()
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Product), batch)
+            db.session.commit()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
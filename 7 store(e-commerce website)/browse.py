@@ -0,0 +1,292 @@
+"""
+Faceted catalog browsing: price range, seller and in-stock filters, three
+sort orders and keyset pagination.
+
+A page is read in two steps. First the ids of one page are picked from
+a composite index whose leading column is the sort key (after the seller
+id, when filtering by seller). The index also holds id, price, stock and
+seller_id, so the filters are checked inside the index and the query
+never touches the table (EXPLAIN QUERY PLAN: "USING COVERING INDEX", see
+benchmarks/explain_browse.py). Then those ids are loaded by primary key.
+Pages continue after the (sort key, id) of the previous page's last row,
+so page 500 costs the same as page 1.
+
+Facet counts (price buckets, top sellers, in stock) count the products
+matching every other active filter. They are read from product_facet, a
+small table of product counts per (seller, price band, in stock) that
+triggers on product keep current, so their cost does not grow with the
+catalog. Price bands are the facet buckets' edges plus a 1-2-5 series
+(price_bands()). A typed price range that cuts through a band has that
+part counted from the price index. If that part holds more than
+BROWSE_FACET_SCAN_LIMIT products, the whole band is counted instead and
+the sidebar marks the seller and in-stock counts as approximate.
+Changing BROWSE_PRICE_BUCKETS takes effect after `flask init-db`, which
+recreates the triggers and recounts the table. The rendered sidebar is
+kept in the shared fragment cache for BROWSE_FACET_TTL seconds, per
+combination of filters.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from urllib.parse import urlencode
+from flask import current_app, render_template
+from sqlalchemy import delete, func, select, text, tuple_
+from models import db, Product, ProductFacet, User
+from pagination import encode_cursor, decode_cursor
+from cache import cached_fragment
+
+# sort name -> (column, descending, cursor value type, label)
+SORTS = {
+    "newest": (Product.created_at, True, datetime.fromisoformat, "Newest"),
+    "price_asc": (Product.price, False, float, "Price: low to high"),
+    "price_desc": (Product.price, True, float, "Price: high to low"),
+}
+DEFAULT_SORT = "newest"
+
+# how many sellers the seller facet lists
+SELLER_FACET_SIZE = 10
+DEFAULT_PRICE_BUCKETS = (0, 500, 1000, 2500, 5000, 10000)
+
+
+def _price(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price >= 0 else None
+
+
+@dataclass(frozen=True)
+class BrowseFilters:
+    min_price: float = None
+    max_price: float = None
+    seller_id: int = None
+    in_stock: bool = False
+    sort: str = DEFAULT_SORT
+
+    @classmethod
+    def from_args(cls, args):
+        """Parse the query string; anything invalid is ignored rather than rejected."""
+        sort = args.get("sort", DEFAULT_SORT)
+        return cls(
+            min_price=_price(args.get("min_price")),
+            max_price=_price(args.get("max_price")),
+            seller_id=args.get("seller", type=int),
+            in_stock=args.get("in_stock") in ("1", "on", "true"),
+            sort=sort if sort in SORTS else DEFAULT_SORT,
+        )
+
+    def to_args(self, **changes):
+        """Query-string arguments for these filters (with `changes` applied), for url_for."""
+        values = {
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+            "seller": self.seller_id,
+            "in_stock": 1 if self.in_stock else None,
+            "sort": self.sort if self.sort != DEFAULT_SORT else None,
+        }
+        values.update(changes)
+        return {k: v for k, v in values.items() if v is not None}
+
+    def conditions(self, skip=(), price=Product.price):
+        """WHERE terms for the active filters, leaving out the facets named in `skip`."""
+        terms = []
+        if "price" not in skip:
+            if self.min_price is not None:
+                terms.append(price >= self.min_price)
+            if self.max_price is not None:
+                # exclusive, like the facet buckets: 500-1000 and 1000-2500 do not overlap
+                terms.append(price < self.max_price)
+        if "seller" not in skip and self.seller_id is not None:
+            terms.append(Product.seller_id == self.seller_id)
+        if "stock" not in skip and self.in_stock:
+            terms.append(Product.stock > 0)
+        return terms
+
+
+def page_ids_query(filters, cursor=None, limit=24):
+    """The covering-index query that picks one page of (id, sort key) rows."""
+    column, descending, cursor_type, _ = SORTS[filters.sort]
+    # SQLite would rather search a price range and sort all of it than walk the
+    # sort order's index; "price + 0" keeps the range from steering the planner
+    # (it is still checked inside the covering index)
+    price = Product.price if column is Product.price else Product.price + 0
+    q = select(Product.id, column.label("sort_key")).where(*filters.conditions(price=price))
+    key = decode_cursor(cursor, cursor_type, int) if cursor else None
+    if key:
+        position = tuple_(column, Product.id)
+        q = q.where(position < key if descending else position > key)
+    if descending:
+        q = q.order_by(column.desc(), Product.id.desc())
+    else:
+        q = q.order_by(column, Product.id)
+    return q.limit(limit)
+
+
+def browse_products(filters, cursor=None, per_page=24):
+    """Return (products, next_cursor) for one page."""
+    rows = db.session.execute(page_ids_query(filters, cursor, per_page + 1)).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].sort_key, rows[-1].id)
+
+    ids = [r.id for r in rows]
+    by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+    return [by_id[i] for i in ids if i in by_id], next_cursor
+
+
+def _price_buckets():
+    bounds = list(current_app.config.get("BROWSE_PRICE_BUCKETS", DEFAULT_PRICE_BUCKETS))
+    return [(low, bounds[i + 1] if i + 1 < len(bounds) else None) for i, low in enumerate(bounds)]
+
+
+def price_bands():
+    """Lower edges of the price bands product_facet counts by, ascending from 0."""
+    edges = {0, *current_app.config.get("BROWSE_PRICE_BUCKETS", DEFAULT_PRICE_BUCKETS)}
+    edges.update(m * 10 ** e for e in range(2, 7) for m in (1, 2, 5))
+    return sorted(edges)
+
+
+def _band_span(filters, edges):
+    """
+    (whole, cut) for the price filter: the bands entirely inside it, and
+    (band, low, high) for the bands it cuts through, with the part inside.
+    """
+    low, high = filters.min_price or 0, filters.max_price
+    whole, cut = [], []
+    for band, edge in enumerate(edges):
+        top = edges[band + 1] if band + 1 < len(edges) else None
+        if (high is not None and edge >= high) or (top is not None and top <= low):
+            continue
+        if edge >= low and (high is None or top is not None and top <= high):
+            whole.append(band)
+        else:
+            part_high = top if high is None else high if top is None else min(top, high)
+            cut.append((band, max(edge, low), part_high))
+    return whole, cut
+
+
+def _facet_conditions(filters, skip):
+    terms = []
+    if "seller" not in skip and filters.seller_id is not None:
+        terms.append(ProductFacet.seller_id == filters.seller_id)
+    if "stock" not in skip and filters.in_stock:
+        terms.append(ProductFacet.in_stock == 1)
+    return terms
+
+
+def facet_queries(filters, scan_cuts=True):
+    """
+    The statements behind facet_counts(), as {facet: [statements]}. Each
+    returns (facet value, products) rows to add up, and ignores the facet's
+    own filter. The first reads product_facet. The others count, from the
+    price index, the parts of bands that a typed price range cuts through
+    (with scan_cuts=False those bands are counted whole instead).
+    """
+    whole, cut = _band_span(filters, price_bands())
+    bands = whole if scan_cuts else whole + [band for band, _, _ in cut]
+
+    def from_aggregate(key, skip, *terms):
+        total = func.sum(ProductFacet.products)
+        return select(key, total).where(*_facet_conditions(filters, (skip,)), *terms).group_by(key)
+
+    def from_index(key, skip, *terms):
+        scans = []
+        for _, low, high in (cut if scan_cuts else ()):
+            price = [Product.price >= low] + ([Product.price < high] if high is not None else [])
+            scans.append(select(key, func.count())
+                         .where(*price, *filters.conditions(skip=(skip, "price")), *terms)
+                         .group_by(key))
+        return scans
+
+    in_stock = (Product.stock > 0).label("in_stock")
+    return {
+        "prices": [from_aggregate(ProductFacet.band, "price")],
+        "sellers": [from_aggregate(ProductFacet.seller_id, "seller", ProductFacet.band.in_(bands),
+                                   ProductFacet.seller_id != 0)]
+                   + from_index(Product.seller_id, "seller", Product.seller_id.isnot(None)),
+        "in_stock": [from_aggregate(ProductFacet.in_stock, "stock", ProductFacet.band.in_(bands),
+                                    ProductFacet.in_stock == 1)]
+                    + from_index(in_stock, "stock", Product.stock > 0),
+    }
+
+
+def facet_counts(filters):
+    """Counts for each facet value, given the other active filters."""
+    edges = price_bands()
+    _, cut = _band_span(filters, edges)
+    approximate = False
+    if cut:
+        in_cut = db.session.execute(
+            select(func.coalesce(func.sum(ProductFacet.products), 0))
+            .where(ProductFacet.band.in_([band for band, _, _ in cut]), *_facet_conditions(filters, ("stock",)))
+        ).scalar()
+        approximate = in_cut > current_app.config.get("BROWSE_FACET_SCAN_LIMIT", 20000)
+
+    totals = {}
+    for facet, statements in facet_queries(filters, scan_cuts=not approximate).items():
+        totals[facet] = defaultdict(int)
+        for stmt in statements:
+            for value, n in db.session.execute(stmt):
+                totals[facet][value] += n or 0
+
+    by_band = totals["prices"]
+    prices = [(low, high, sum(n for band, n in by_band.items() if edges[band] >= low and (high is None or edges[band] < high)))
+              for low, high in _price_buckets()]
+    sellers = sorted(((n, seller_id) for seller_id, n in totals["sellers"].items() if n),
+                     key=lambda item: (-item[0], item[1]))[:SELLER_FACET_SIZE]
+    names = dict(db.session.execute(
+        select(User.id, User.username).where(User.id.in_([seller_id for _, seller_id in sellers]))
+    ).all()) if sellers else {}
+    return {
+        "prices": prices,
+        "sellers": [(seller_id, names.get(seller_id, f"#{seller_id}"), n) for n, seller_id in sellers],
+        "in_stock": totals["in_stock"].get(1, 0),
+        "approximate": approximate,
+    }
+
+
+def facets_html(filters):
+    """The facet sidebar, from the fragment cache when the same filters were rendered recently."""
+    key = "browse-facets:" + urlencode(sorted(filters.to_args().items()))
+
+    def build():
+        return render_template("_browse_facets.html", facets=facet_counts(filters), filters=filters), {}
+
+    html, _ = cached_fragment(key, build, ttl=current_app.config.get("BROWSE_FACET_TTL", 60))
+    return html
+
+
+def _facet_key(row, edges):
+    """SQL for a product row's (seller_id, band, in_stock) in product_facet."""
+    bands = " ".join(f"WHEN {row}.price < {edge!r} THEN {band}" for band, edge in enumerate(edges[1:]))
+    return f"coalesce({row}.seller_id, 0), CASE {bands} ELSE {len(edges) - 1} END, coalesce({row}.stock, 0) > 0"
+
+
+def _facet_triggers(edges):
+    new, old = _facet_key("new", edges), _facet_key("old", edges)
+    add = (f"INSERT INTO product_facet (seller_id, band, in_stock, products) VALUES ({new}, 1) "
+           "ON CONFLICT (seller_id, band, in_stock) DO UPDATE SET products = products + 1;")
+    remove = f"UPDATE product_facet SET products = products - 1 WHERE (seller_id, band, in_stock) = ({old});"
+    return [
+        f"CREATE TRIGGER product_facet_ai AFTER INSERT ON product BEGIN {add} END",
+        f"CREATE TRIGGER product_facet_ad AFTER DELETE ON product BEGIN {remove} END",
+        f"CREATE TRIGGER product_facet_au AFTER UPDATE OF price, stock, seller_id ON product "
+        f"WHEN ({old}) IS NOT ({new}) BEGIN {remove} {add} END",
+    ]
+
+
+def init_browse_facets():
+    """(Re)create the product_facet triggers for the configured price bands and recount the table."""
+    edges = price_bands()
+    for name in ("product_facet_ai", "product_facet_ad", "product_facet_au"):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    for stmt in _facet_triggers(edges):
+        db.session.execute(text(stmt))
+    db.session.execute(delete(ProductFacet))
+    db.session.execute(text(
+        f"INSERT INTO product_facet (seller_id, band, in_stock, products) "
+        f"SELECT {_facet_key('product', edges)}, count(*) FROM product GROUP BY 1, 2, 3"
+    ))
+    db.session.commit()
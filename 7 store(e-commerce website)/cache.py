@@ -0,0 +1,141 @@
+"""
+Rendered-fragment cache shared by every gunicorn worker.
+
+Entries live in a small SQLite file (WAL mode) next to the main database,
+so one worker's render is a hit for all the others and an invalidation
+from any worker is seen everywhere. Entries expire after a TTL and the
+least recently used ones are evicted once the cache is full.
+
+Fragments must not contain per-user data. The one exception is the CSRF
+token in add-to-cart forms: it is rendered as a placeholder and filled in
+per request when the fragment is served.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+CSRF_PLACEHOLDER = "__7STORE_CSRF_TOKEN__"
+
+# refresh last_access at most this often per entry, so hot hits stay read-only
+_TOUCH_INTERVAL = 5.0
+
+
+class FragmentCache:
+    def __init__(self, path, default_ttl=300, max_entries=5000):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fragment (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_fragment_last_access ON fragment (last_access)")
+
+    def _connect(self):
+        # one connection per thread and per process (gunicorn forks after import)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, expires_at, last_access FROM fragment WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, last_access = row
+        now = time.time()
+        if expires_at <= now:
+            conn.execute("DELETE FROM fragment WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+        if now - last_access > _TOUCH_INTERVAL:
+            conn.execute("UPDATE fragment SET last_access = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO fragment (key, value, expires_at, last_access) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+            "expires_at = excluded.expires_at, last_access = excluded.last_access",
+            (key, value, now + ttl, now),
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM fragment WHERE expires_at <= ?", (now,))
+        (count,) = conn.execute("SELECT count(*) FROM fragment").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM fragment WHERE key IN "
+                "(SELECT key FROM fragment ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+
+    def delete(self, *keys):
+        if keys:
+            conn = self._connect()
+            conn.executemany("DELETE FROM fragment WHERE key = ?", [(k,) for k in keys])
+
+    def clear(self):
+        self._connect().execute("DELETE FROM fragment")
+
+
+def init_cache(app):
+    path = app.config.get("FRAGMENT_CACHE_PATH") or os.path.join(app.instance_path, "fragment_cache.db")
+    app.extensions["fragment_cache"] = FragmentCache(
+        path,
+        default_ttl=app.config.get("FRAGMENT_CACHE_TTL", 300),
+        max_entries=app.config.get("FRAGMENT_CACHE_MAX_ENTRIES", 5000),
+    )
+
+
+def get_cache():
+    return current_app.extensions["fragment_cache"]
+
+
+def cached_fragment(key, build, ttl=None):
+    """
+    Return (html, meta) for `key`, calling build() on a miss.
+
+    build() renders with csrf_token=csrf_placeholder and returns (html, meta);
+    meta is a small dict of plain values the page needs (e.g. the title).
+    Raising (e.g. abort(404)) from build() caches nothing.
+    """
+    cache = get_cache()
+    raw = cache.get(key)
+    if raw is not None:
+        entry = json.loads(raw)
+    else:
+        html, meta = build()
+        entry = {"html": str(html), "meta": meta or {}}
+        cache.set(key, json.dumps(entry), ttl)
+    html = entry["html"]
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, generate_csrf())
+    return Markup(html), entry["meta"]
+
+
+def csrf_placeholder():
+    return CSRF_PLACEHOLDER
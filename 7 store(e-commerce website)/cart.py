@@ -0,0 +1,337 @@
+"""
+Cart service: the server-side cart store and its priced view.
+
+Carts live in the shopping_cart / cart_item tables, owned by the logged-in
+user or, before login, by an anonymous token kept in the session. Carts
+therefore follow the user across devices and workers, and the session
+cookie stays small. Adding or changing a line is a single-row upsert.
+Triggers on cart_item keep shopping_cart.item_count current, so the header
+badge reads one number instead of summing lines. That number is also held
+in a small per-process cache, so most pages render the badge with no query.
+Every cart write bumps its owner's epoch, and cached counts from an older
+epoch are ignored. Epochs live in a shared array of EPOCH_SLOTS counters
+(a SharedCounter, see catalog.py, default instance/cart_epoch) indexed by
+a hash of the owner, so a write invalidates that owner's count (and the
+few owners sharing its slot), not every cached badge. A cart changed
+through one worker therefore shows its new count (and a new page ETag) on
+every worker's next request. CART_COUNT_TTL bounds staleness for writes
+made outside the app.
+
+get_cart() loads the cart with its products in one query and memoizes it
+on flask.g, so the cart page, checkout, order creation and the header badge
+share a single lookup per request. Lines whose product no longer exists
+are dropped here, in one place.
+"""
+import os
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from flask import current_app, g, session
+from flask_login import current_user
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from catalog import SharedCounter
+from models import db, Product, ShoppingCart, CartItem
+
+EPOCH_SLOTS = 4096
+
+_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS cart_item_count_ai AFTER INSERT ON cart_item BEGIN
+        UPDATE shopping_cart SET item_count = item_count + new.quantity WHERE id = new.cart_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cart_item_count_au AFTER UPDATE OF quantity ON cart_item BEGIN
+        UPDATE shopping_cart SET item_count = item_count + new.quantity - old.quantity WHERE id = new.cart_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cart_item_count_ad AFTER DELETE ON cart_item BEGIN
+        UPDATE shopping_cart SET item_count = item_count - old.quantity WHERE id = old.cart_id;
+    END
+    """,
+]
+
+
+@dataclass
+class CartLine:
+    product: Product
+    qty: int
+
+    @property
+    def line_total(self) -> float:
+        return self.product.price * self.qty
+
+
+@dataclass
+class Cart:
+    lines: list = field(default_factory=list)
+    total: float = 0.0
+
+    @property
+    def quantity(self) -> int:
+        return sum(line.qty for line in self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+class _CountCache:
+    """Per-process LRU of owner -> (cart_id, item_count), valid for `ttl` seconds within one epoch."""
+
+    def __init__(self, ttl=10.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, owner, epoch):
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic() or entry[3] != epoch:
+                del self._entries[owner]
+                return None
+            self._entries.move_to_end(owner)
+            return entry[0], entry[1]
+
+    def put(self, owner, epoch, cart_id, count):
+        with self._lock:
+            self._entries[owner] = (cart_id, count, time.monotonic() + self.ttl, epoch)
+            self._entries.move_to_end(owner)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, owner):
+        with self._lock:
+            self._entries.pop(owner, None)
+
+
+def _counts():
+    return current_app.extensions["cart_counts"]["cache"]
+
+
+def _slot(owner):
+    # crc32, not hash(): the slot must be the same in every process
+    return zlib.crc32(f"{owner[0]}:{owner[1]}".encode()) % EPOCH_SLOTS
+
+
+def _epoch(owner):
+    return current_app.extensions["cart_counts"]["epoch"].get(_slot(owner))
+
+
+def _owner(create=False):
+    """("user_id", id) for a logged-in user, ("token", token) for a guest, or None."""
+    if current_user and current_user.is_authenticated:
+        return ("user_id", current_user.id)
+    token = session.get("cart_token")
+    if token is None and create:
+        token = session["cart_token"] = secrets.token_urlsafe(24)
+    return ("token", token) if token else None
+
+
+def _owner_filter(owner):
+    return getattr(ShoppingCart, owner[0]) == owner[1]
+
+
+def _ensure_cart(owner):
+    """Id of the owner's cart, creating it if needed (one upsert)."""
+    epoch = _epoch(owner)
+    cached = _counts().get(owner, epoch)
+    if cached is not None and cached[0] is not None:
+        return cached[0]
+    column, value = owner
+    cart_id, count = db.session.execute(
+        sqlite_insert(ShoppingCart)
+        .values({column: value, "item_count": 0, "updated_at": datetime.utcnow()})
+        .on_conflict_do_update(index_elements=[column], set_={"updated_at": datetime.utcnow()})
+        .returning(ShoppingCart.id, ShoppingCart.item_count)
+    ).one()
+    _counts().put(owner, epoch, cart_id, count)
+    return cart_id
+
+
+def _changed(owner):
+    db.session.commit()
+    _counts().discard(owner)
+    current_app.extensions["cart_counts"]["epoch"].bump(_slot(owner))
+    invalidate_cart()
+
+
+def cart_quantity() -> int:
+    """Total quantity in the current cart, for the header badge."""
+    owner = _owner()
+    if owner is None:
+        return 0
+    epoch = _epoch(owner)
+    cached = _counts().get(owner, epoch)
+    if cached is None:
+        row = db.session.execute(
+            select(ShoppingCart.id, ShoppingCart.item_count).where(_owner_filter(owner))
+        ).first()
+        cached = (row.id, row.item_count) if row else (None, 0)
+        _counts().put(owner, epoch, *cached)
+    return cached[1]
+
+
+def add_item(product_id, qty):
+    """Add `qty` of a product to the current cart."""
+    owner = _owner(create=True)
+    cart_id = _ensure_cart(owner)
+    stmt = sqlite_insert(CartItem).values(cart_id=cart_id, product_id=product_id, quantity=qty)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["cart_id", "product_id"],
+        set_={"quantity": CartItem.quantity + stmt.excluded.quantity},
+    ))
+    _changed(owner)
+
+
+def set_quantities(quantities):
+    """
+    Replace the cart contents with {product_id: qty}; lines that are
+    missing or have a quantity below 1 are removed.
+    """
+    owner = _owner(create=True)
+    cart_id = _ensure_cart(owner)
+    keep = {int(pid): int(q) for pid, q in quantities.items() if int(q) > 0}
+    delete = db.delete(CartItem).where(CartItem.cart_id == cart_id)
+    if keep:
+        delete = delete.where(CartItem.product_id.notin_(list(keep)))
+    db.session.execute(delete)
+    if keep:
+        stmt = sqlite_insert(CartItem)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["cart_id", "product_id"],
+                set_={"quantity": stmt.excluded.quantity},
+            ),
+            [{"cart_id": cart_id, "product_id": pid, "quantity": q} for pid, q in keep.items()],
+        )
+    _changed(owner)
+
+
+def remove_items(product_ids=None):
+    """Remove the given products from the current cart, or every line if None."""
+    owner = _owner()
+    if owner is None or product_ids is not None and not product_ids:
+        return
+    cart_id = select(ShoppingCart.id).where(_owner_filter(owner)).scalar_subquery()
+    delete = db.delete(CartItem).where(CartItem.cart_id == cart_id)
+    if product_ids is not None:
+        delete = delete.where(CartItem.product_id.in_(list(product_ids)))
+    db.session.execute(delete)
+    _changed(owner)
+
+
+def clear_cart():
+    """Empty the current cart (after a successful payment)."""
+    remove_items()
+
+
+def merge_guest_cart(user_id):
+    """
+    Fold the guest cart from this session into the user's cart right after
+    login; quantities of products in both are added together.
+    """
+    token = session.pop("cart_token", None)
+    if not token:
+        return
+    guest = db.session.execute(select(ShoppingCart.id).where(ShoppingCart.token == token)).scalar()
+    if guest is None:
+        return
+    cart_id = _ensure_cart(("user_id", user_id))
+    db.session.execute(text(
+        "INSERT INTO cart_item (cart_id, product_id, quantity) "
+        "SELECT :cart_id, product_id, quantity FROM cart_item WHERE cart_id = :guest "
+        "ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity"
+    ), {"cart_id": cart_id, "guest": guest})
+    db.session.execute(db.delete(CartItem).where(CartItem.cart_id == guest))
+    db.session.execute(db.delete(ShoppingCart).where(ShoppingCart.id == guest))
+    _counts().discard(("token", token))
+    _changed(("user_id", user_id))
+
+
+def get_cart() -> Cart:
+    """Hydrate the current cart, once per request."""
+    cached = g.get("_cart")
+    if cached is not None:
+        return cached
+
+    cart = Cart()
+    owner = _owner()
+    if owner is None:
+        g._cart = cart
+        return cart
+
+    epoch = _epoch(owner)
+    rows = db.session.execute(
+        select(ShoppingCart.id, ShoppingCart.item_count, CartItem.product_id, CartItem.quantity, Product)
+        .select_from(ShoppingCart)
+        .outerjoin(CartItem, CartItem.cart_id == ShoppingCart.id)
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .where(_owner_filter(owner))
+        .order_by(CartItem.id)
+    ).all()
+
+    stale = []
+    for row in rows:
+        if row.product_id is None:
+            continue
+        if row.Product is None:
+            stale.append(row.product_id)
+            continue
+        cart.lines.append(CartLine(product=row.Product, qty=row.quantity))
+        cart.total += row.Product.price * row.quantity
+
+    if stale:
+        remove_items(stale)
+    elif rows:
+        _counts().put(owner, epoch, rows[0].id, rows[0].item_count)
+
+    g._cart = cart
+    return cart
+
+
+def invalidate_cart():
+    """Drop the memoized cart after the stored cart changes mid-request."""
+    g.pop("_cart", None)
+
+
+def _adopt_session_cart():
+    # carts from before the server-side store lived in the cookie; move them over once
+    if "cart" not in session:
+        return
+    legacy = session.pop("cart")
+    if legacy:
+        try:
+            for pid, qty in legacy.items():
+                if int(qty) > 0:
+                    add_item(int(pid), int(qty))
+        except (TypeError, ValueError, AttributeError):
+            pass
+
+
+def init_cart_store():
+    """Create the triggers that maintain shopping_cart.item_count."""
+    for stmt in _TRIGGERS:
+        db.session.execute(text(stmt))
+    db.session.commit()
+
+
+def init_cart(app):
+    path = app.config.get("CART_EPOCH_PATH") or os.path.join(app.instance_path, "cart_epoch")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    app.extensions["cart_counts"] = {
+        "cache": _CountCache(
+            ttl=app.config.get("CART_COUNT_TTL", 10.0),
+            max_entries=app.config.get("CART_COUNT_CACHE_SIZE", 10000),
+        ),
+        "epoch": SharedCounter(path, slots=EPOCH_SLOTS),
+    }
+    app.before_request(_adopt_session_cart)
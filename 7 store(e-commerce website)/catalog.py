@@ -0,0 +1,100 @@
+"""
+Catalog change notifications.
+
+Every product write path (seller create/edit/delete, admin delete) calls
+product_changed() after committing, so views derived from the catalog
+are refreshed in one place.
+
+product_changed() also bumps the catalog version: a SharedCounter, kept
+in a small memory-mapped file shared by every worker (and by CLI commands
+on the same instance folder). Pages built from the whole catalog, like the
+home grid, use it as their ETag validator (see conditional.py). Reading it
+is a memory access, and writers serialize on an flock.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from flask import current_app
+from cache import get_cache
+
+HOME_KEY = "home"
+
+
+class SharedCounter:
+    """
+    64-bit counters in a memory-mapped file, shared by every process that
+    opens it. One counter by default; `slots` > 1 gives an array of
+    independent counters, addressed by index.
+    """
+
+    def __init__(self, path, slots=1):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _map(self):
+        # opened per process: an flock on a descriptor inherited across fork
+        # would not exclude the other workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    fh = open(self.path, "a+b")
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                    if os.fstat(fh.fileno()).st_size < 8 * self.slots:
+                        # start from the clock, so a deleted file never repeats old versions
+                        fh.truncate(0)
+                        fh.write(struct.pack(f"{self.slots}Q", *[time.time_ns()] * self.slots))
+                        fh.flush()
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+                    self._file = fh
+                    self._mmap = mmap.mmap(fh.fileno(), 8 * self.slots)
+                    self._pid = os.getpid()
+        return self._mmap
+
+    def get(self, slot=0):
+        # a torn read only costs a spurious ETag mismatch
+        return struct.unpack_from("Q", self._map(), 8 * slot)[0]
+
+    def bump(self, slot=0):
+        buf = self._map()
+        with self._lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                value = struct.unpack_from("Q", buf, 8 * slot)[0] + 1
+                struct.pack_into("Q", buf, 8 * slot, value)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return value
+
+
+def init_catalog(app):
+    path = app.config.get("CATALOG_VERSION_PATH") or os.path.join(app.instance_path, "catalog_version")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    app.extensions["catalog_version"] = SharedCounter(path)
+
+
+def catalog_version():
+    return current_app.extensions["catalog_version"].get()
+
+
+def product_cache_key(slug, changed):
+    """
+    The detail fragment's cache key. Keyed by the product's updated_at
+    (its ETag validator), so every write to the product, stock included,
+    gets a fresh fragment under the new ETag without deleting anything.
+    Old fragments age out with the cache TTL.
+    """
+    return f"product:{slug}:{changed.isoformat()}"
+
+
+def product_changed(*slugs):
+    """
+    Invalidate the home grid and bump the catalog version. The detail
+    pages of `slugs` need nothing: their fragment keys follow updated_at.
+    """
+    current_app.extensions["catalog_version"].bump()
+    get_cache().delete(HOME_KEY)
@@ -0,0 +1,311 @@
+"""
+Bulk catalog import and export for sellers (CSV or JSON Lines).
+
+Imports are streamed: rows are read one at a time from the upload (or a
+file for the CLI), validated, and written in batches. Each batch is one
+executemany upsert on product.slug and one commit, so a 50k-SKU catalog
+takes seconds instead of one form post and commit per product. A bad row
+is reported with its line number and skipped. It never aborts the import.
+
+Slugs: a row may carry its own slug, otherwise one is generated from the
+name. A slug the seller already owns updates that product, so re-importing
+a file is idempotent. A generated slug that collides with another seller's
+product (or an earlier row of the same file) gets a -2, -3, ... suffix. An
+explicit slug owned by someone else is an error for that row.
+
+Exports stream the seller's products in id order as CSV or JSONL.
+"""
+import csv
+import io
+import json
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime
+import click
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Product, User
+from catalog import product_changed
+
+FIELDS = ("slug", "name", "description", "price", "stock", "image_filename")
+FORMATS = ("csv", "jsonl")
+
+# keep the error report bounded for very broken files
+MAX_REPORTED_ERRORS = 1000
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # (line number, message)
+
+    @property
+    def processed(self):
+        return self.created + self.updated + self.failed
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def slugify(text):
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return _SLUG_RE.sub("-", ascii_text.lower()).strip("-")[:200]
+
+
+def detect_format(filename, default="csv"):
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    return default
+
+
+def iter_rows(stream, fmt):
+    """Yield (line number, dict or None, error) from a binary stream, one row at a time."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k.strip().lower(): v for k, v in row.items() if k}, None
+    else:
+        for line_no, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "expected a JSON object"
+                continue
+            yield line_no, {str(k).lower(): v for k, v in row.items()}, None
+
+
+def validate_row(row):
+    """Normalize one raw row into product values. Raises ValueError with a readable message."""
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    if len(name) > 255:
+        raise ValueError("name is longer than 255 characters")
+
+    try:
+        price = float(row.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"price {row.get('price')!r} is not a number")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("price must be zero or more")
+
+    stock = row.get("stock")
+    try:
+        stock = int(stock) if stock not in (None, "") else 0
+    except (TypeError, ValueError):
+        raise ValueError(f"stock {row.get('stock')!r} is not a whole number")
+    if stock < 0:
+        raise ValueError("stock must be zero or more")
+
+    slug = str(row.get("slug") or "").strip()
+    if slug and slugify(slug) != slug:
+        raise ValueError(f"slug {slug!r} may only contain a-z, 0-9 and '-'")
+
+    image = str(row.get("image_filename") or "").strip() or None
+    if image and ("/" in image or "\\" in image or image.startswith(".")):
+        raise ValueError("image_filename must be a bare file name from the uploads folder")
+
+    description = row.get("description")
+    return {
+        "slug": slug or None,
+        "name": name,
+        "description": str(description).strip() if description not in (None, "") else None,
+        "price": round(price, 2),
+        "stock": stock,
+        "image_filename": image,
+    }
+
+
+def _owners(slugs):
+    """{slug: seller_id} for the slugs that already exist."""
+    if not slugs:
+        return {}
+    return dict(db.session.execute(select(Product.slug, Product.seller_id).where(Product.slug.in_(list(slugs)))).all())
+
+
+def _assign_slugs(batch, seller_id, seen, result):
+    """Resolve the final slug of every (line, values, explicit) in the batch; drops rows that fail."""
+    owners = _owners({values["slug"] for _, values, _ in batch})
+    resolved = []
+    pending = []
+    for line, values, explicit in batch:
+        slug = values["slug"]
+        if slug in seen:
+            if explicit:
+                result.error(line, f"slug {slug!r} appears more than once in the file")
+                continue
+            pending.append((line, values, 2))
+        elif slug in owners and owners[slug] != seller_id:
+            if explicit:
+                result.error(line, f"slug {slug!r} belongs to another seller")
+                continue
+            pending.append((line, values, 2))
+        else:
+            seen.add(slug)
+            resolved.append((line, values, slug in owners))
+
+    # generated slugs that collided: try -2, -3, ... (one lookup per round)
+    while pending:
+        candidates = {f"{values['slug']}-{n}" for _, values, n in pending}
+        owners = _owners(candidates)
+        retry = []
+        for line, values, n in pending:
+            slug = f"{values['slug']}-{n}"
+            if slug in seen or (slug in owners and owners[slug] != seller_id):
+                retry.append((line, values, n + 1))
+                continue
+            seen.add(slug)
+            resolved.append((line, dict(values, slug=slug), slug in owners))
+        pending = retry
+    return resolved
+
+
+def _write_batch(batch, seller_id, seen, result, dry_run):
+    rows = _assign_slugs(batch, seller_id, seen, result)
+    if not rows:
+        return
+    now = datetime.utcnow()
+    params = [dict(values, seller_id=seller_id, created_at=now, updated_at=now) for _, values, _ in rows]
+    if not dry_run:
+        stmt = sqlite_insert(Product)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["slug"],
+                set_={
+                    "name": stmt.excluded.name,
+                    "description": stmt.excluded.description,
+                    "price": stmt.excluded.price,
+                    "stock": stmt.excluded.stock,
+                    "image_filename": db.func.coalesce(stmt.excluded.image_filename, Product.image_filename),
+                    # ON CONFLICT DO UPDATE does not apply the column's onupdate
+                    "updated_at": stmt.excluded.updated_at,
+                },
+                # never touch another seller's product, even if it appeared since the lookup
+                where=Product.seller_id.is_(stmt.excluded.seller_id),
+            ),
+            params,
+        )
+        db.session.commit()
+        product_changed(*(p["slug"] for p in params))
+    for _, _, existed in rows:
+        if existed:
+            result.updated += 1
+        else:
+            result.created += 1
+
+
+def import_catalog(stream, seller_id, fmt="csv", batch_size=1000, dry_run=False):
+    """Stream-import products for a seller. Returns an ImportResult."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    result = ImportResult()
+    seen = set()
+    batch = []
+    for line, raw, problem in iter_rows(stream, fmt):
+        if problem:
+            result.error(line, problem)
+            continue
+        try:
+            values = validate_row(raw)
+        except ValueError as e:
+            result.error(line, str(e))
+            continue
+        explicit = values["slug"] is not None
+        if not explicit:
+            values["slug"] = slugify(values["name"]) or "product"
+        batch.append((line, values, explicit))
+        if len(batch) >= batch_size:
+            _write_batch(batch, seller_id, seen, result, dry_run)
+            batch = []
+    if batch:
+        _write_batch(batch, seller_id, seen, result, dry_run)
+    return result
+
+
+def export_catalog(seller_id, fmt="csv", chunk_rows=500):
+    """Yield the seller's catalog as CSV or JSONL text chunks, reading it in keyset pages."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}")
+    columns = [getattr(Product, name) for name in FIELDS]
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(FIELDS)
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Product.id, *columns)
+            .where(Product.seller_id == seller_id, Product.id > last_id)
+            .order_by(Product.id)
+            .limit(chunk_rows)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            values = tuple(row)[1:]
+            if writer:
+                writer.writerow(["" if v is None else v for v in values])
+            else:
+                buf.write(json.dumps(dict(zip(FIELDS, values)), ensure_ascii=False) + "\n")
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _resolve_seller(value):
+    user = None
+    if value.isdigit():
+        user = db.session.get(User, int(value))
+    if user is None:
+        user = User.query.filter((User.username == value) | (User.email == value)).first()
+    if user is None:
+        raise click.BadParameter(f"no user {value!r}", param_hint="--seller")
+    return user
+
+
+def init_catalog_io(app):
+    @app.cli.command("import-catalog")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--seller", required=True, help="Seller id, username or email.")
+    @click.option("--format", "fmt", type=click.Choice(FORMATS), default=None, help="Default: from the file extension.")
+    @click.option("--batch-size", default=1000, show_default=True)
+    @click.option("--dry-run", is_flag=True, help="Validate and report without writing.")
+    def import_catalog_command(path, seller, fmt, batch_size, dry_run):
+        """Bulk import (upsert) a seller's products from CSV or JSONL."""
+        user = _resolve_seller(seller)
+        with open(path, "rb") as fh:
+            result = import_catalog(fh, user.id, fmt or detect_format(path), batch_size, dry_run)
+        for line, message in result.errors:
+            click.echo(f"line {line}: {message}", err=True)
+        click.echo(f"{'checked' if dry_run else 'imported'} {result.processed} row(s): "
+                   f"{result.created} new, {result.updated} updated, {result.failed} failed")
+
+    @app.cli.command("export-catalog")
+    @click.option("--seller", required=True, help="Seller id, username or email.")
+    @click.option("--format", "fmt", type=click.Choice(FORMATS), default="csv", show_default=True)
+    @click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-")
+    def export_catalog_command(seller, fmt, output):
+        """Write a seller's catalog as CSV or JSONL."""
+        user = _resolve_seller(seller)
+        for chunk in export_catalog(user.id, fmt):
+            output.write(chunk)
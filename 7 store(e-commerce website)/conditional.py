@@ -0,0 +1,105 @@
+"""
+Conditional GET for catalog pages.
+
+A view calls not_modified(validator, last_modified) before it queries or
+renders anything. The validator is something cheap that changes whenever
+the page body does: the product's updated_at, or the catalog version for
+the home grid. The ETag hashes it together with everything else on the
+page that can change:
+- the viewer (user id and roles);
+- the cart badge count;
+- the session's CSRF token and its validity period, because forms on the
+  page embed a signed token;
+- the deployed templates.
+
+If the browser's copy matches, the view returns the 304 straight away.
+Otherwise the validators are attached to the page it renders.
+
+Pages carry per-user content, so they are sent with
+"Cache-Control: private, no-cache": the browser keeps a copy and
+revalidates it on every visit. Requests with pending flash messages are
+always rendered, since the flashes would otherwise be lost.
+"""
+import hashlib
+import os
+import time
+from flask import current_app, g, request, session
+from flask_login import current_user
+from cart import cart_quantity
+
+
+def _template_digest(app):
+    digest = hashlib.sha256()
+    folder = os.path.join(app.root_path, app.template_folder)
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as fh:
+                digest.update(name.encode() + b"\0" + fh.read())
+    return digest.hexdigest()[:16]
+
+
+def _csrf_period():
+    limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    # a cached page's token must still be accepted when the form is posted
+    return int(time.time() // (limit // 2)) if limit else 0
+
+
+def page_etag(validator):
+    if current_user.is_authenticated:
+        viewer = f"{current_user.id}:{int(bool(current_user.is_seller))}{int(bool(current_user.is_admin))}"
+    else:
+        viewer = "-"
+    parts = (
+        current_app.extensions["template_digest"],
+        str(validator),
+        viewer,
+        str(cart_quantity()),
+        session.get("csrf_token", ""),
+        str(_csrf_period()),
+    )
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:32]
+
+
+def not_modified(validator, last_modified=None):
+    """
+    Return a 304 response if the client's copy of this page is current,
+    else None (the view renders as usual and the validators are added to
+    its response).
+    """
+    if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+        return None
+    etag = page_etag(validator)
+    last_modified = last_modified.replace(microsecond=0) if last_modified else None
+    g.page_validators = (validator, last_modified)
+
+    # If-Modified-Since alone is not enough: the date does not cover the
+    # viewer, the cart or the CSRF token, so only a matching ETag gets a 304
+    if not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    _add_validators(response, etag, last_modified)
+    return response
+
+
+def _add_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+
+
+def _attach_validators(response):
+    validators = g.pop("page_validators", None)
+    if validators and response.status_code == 200:
+        validator, last_modified = validators
+        # recomputed after rendering, which may have created the session's CSRF token
+        _add_validators(response, page_etag(validator), last_modified)
+    return response
+
+
+def init_conditional(app):
+    app.extensions["template_digest"] = _template_digest(app)
+    app.after_request(_attach_validators)
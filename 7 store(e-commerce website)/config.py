@@ -11,12 +11,116 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///store.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")  # defaults to the same SQLite file, read-only
+
+    # Engine profile ("production": WAL + tuned pragmas + read-only reader engine; "stock": SQLAlchemy defaults)
+    DB_PROFILE = os.getenv("DB_PROFILE", "production")
+    # pools are per worker process: size them to the worker's threads
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+    DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "8"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", str(64 * 1024)))
+
+    # Search
+    SEARCH_PER_PAGE = int(os.getenv("SEARCH_PER_PAGE", "24"))
+
+    # Search-as-you-type (/search/suggest): in-process prefix index over product names
+    # (ranked by units sold over the last POPULAR_DAYS) and popular searches, loaded from
+    # a snapshot (default instance/autocomplete.idx; `flask build-autocomplete` rebuilds it)
+    AUTOCOMPLETE_INDEX_PATH = os.getenv("AUTOCOMPLETE_INDEX_PATH", "")
+    AUTOCOMPLETE_PRODUCTS = int(os.getenv("AUTOCOMPLETE_PRODUCTS", "8"))
+    AUTOCOMPLETE_QUERIES = int(os.getenv("AUTOCOMPLETE_QUERIES", "3"))
+    AUTOCOMPLETE_POPULAR_DAYS = int(os.getenv("AUTOCOMPLETE_POPULAR_DAYS", "30"))
+    AUTOCOMPLETE_QUERY_MIN_HITS = int(os.getenv("AUTOCOMPLETE_QUERY_MIN_HITS", "3"))
+    AUTOCOMPLETE_QUERY_FLUSH = float(os.getenv("AUTOCOMPLETE_QUERY_FLUSH", "30"))  # seconds between search_query writes
+    AUTOCOMPLETE_REFRESH = float(os.getenv("AUTOCOMPLETE_REFRESH", "60"))  # seconds between snapshot/query reloads
+
+    # Order history
+    ORDERS_PER_PAGE = int(os.getenv("ORDERS_PER_PAGE", "20"))
+
+    # Catalog browsing: page size, facet cache lifetime and price facet bounds (INR)
+    BROWSE_PER_PAGE = int(os.getenv("BROWSE_PER_PAGE", "24"))
+    BROWSE_FACET_TTL = int(os.getenv("BROWSE_FACET_TTL", "60"))
+    # a typed price range counts the bands it cuts through from the price index up to
+    # this many products; beyond it, whole bands are counted (approximate seller/stock counts)
+    BROWSE_FACET_SCAN_LIMIT = int(os.getenv("BROWSE_FACET_SCAN_LIMIT", "20000"))
+    BROWSE_PRICE_BUCKETS = (0, 500, 1000, 2500, 5000, 10000)
+
+    # Fragment cache (shared by all workers; defaults to instance/fragment_cache.db)
+    FRAGMENT_CACHE_PATH = os.getenv("FRAGMENT_CACHE_PATH", "")
+    FRAGMENT_CACHE_TTL = int(os.getenv("FRAGMENT_CACHE_TTL", "300"))
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", "5000"))
+
+    # Shared catalog version counter (ETag validator for catalog pages); default instance/catalog_version
+    CATALOG_VERSION_PATH = os.getenv("CATALOG_VERSION_PATH", "")
+
+    # Logged-in user cache for the login manager's user_loader (TTL 0 disables);
+    # role changes bump a shared epoch (default instance/identity_epoch)
+    IDENTITY_CACHE_TTL = int(os.getenv("IDENTITY_CACHE_TTL", "60"))
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "2048"))
+    IDENTITY_EPOCH_PATH = os.getenv("IDENTITY_EPOCH_PATH", "")
+
+    # Metrics (per-worker mmap files, served at /admin/metrics; defaults to instance/metrics)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+    METRICS_DIR = os.getenv("METRICS_DIR", "")
+    SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables the slow-request log
+
+    # Cart badge counter cache (per worker; entries refresh after this many seconds);
+    # cart writes bump their owner's slot in a shared epoch array (default instance/cart_epoch)
+    CART_COUNT_TTL = float(os.getenv("CART_COUNT_TTL", "10"))
+    CART_COUNT_CACHE_SIZE = int(os.getenv("CART_COUNT_CACHE_SIZE", "10000"))
+    CART_EPOCH_PATH = os.getenv("CART_EPOCH_PATH", "")
+
+    # The Stripe session of an unpaid checkout closes after RESERVATION_TTL seconds
+    # (kept within Stripe's 30 min - 24 h). Its stock is released RESERVATION_GRACE
+    # seconds later, so a payment made just before the close still finds it held
+    RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "1800"))
+    RESERVATION_GRACE = int(os.getenv("RESERVATION_GRACE", "900"))
+
+    # `flask reap-orders`: pending orders older than this many seconds are settled
+    # against Stripe and expired; Stripe calls made in parallel per batch
+    ORDER_REAP_AGE = int(os.getenv("ORDER_REAP_AGE", "7200"))
+    REAPER_STRIPE_CONCURRENCY = int(os.getenv("REAPER_STRIPE_CONCURRENCY", "8"))
+
+    # Bulk catalog import (rows per executemany upsert + commit)
+    CATALOG_IMPORT_BATCH_SIZE = int(os.getenv("CATALOG_IMPORT_BATCH_SIZE", "1000"))
+
+    # Days of sales shown on the seller and admin dashboards
+    ANALYTICS_DAYS = int(os.getenv("ANALYTICS_DAYS", "30"))
+
+    # Password hashing: method/cost for new and upgraded hashes, and the per-worker
+    # process pool (0 workers = hash inline); excess logins get a 503 after the queue timeout.
+    # 600k iterations is OWASP's PBKDF2-SHA256 guidance (Werkzeug's default is 260k);
+    # older hashes are upgraded at login
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+    PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "16"))
+    PASSWORD_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_QUEUE_TIMEOUT", "1.0"))
+    PASSWORD_NICE = int(os.getenv("PASSWORD_NICE", "5"))
+
+    # Admin
+    ADMIN_PER_PAGE = int(os.getenv("ADMIN_PER_PAGE", "50"))
 
     # Stripe
     STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
     STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
     STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    # failed passes before a queued webhook event is parked (see webhooks.py)
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+    STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")  # e.g. a local fake Stripe for load tests
+    STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "3"))
+    STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", "10"))
+    STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+    STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", "10"))
+    STRIPE_BREAKER_THRESHOLD = int(os.getenv("STRIPE_BREAKER_THRESHOLD", "5"))
+    STRIPE_BREAKER_RESET = float(os.getenv("STRIPE_BREAKER_RESET", "30"))
 
     # Uploads
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "static/images")
     ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+    IMAGE_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_WIDTHS", "240,480,960").split(","))
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
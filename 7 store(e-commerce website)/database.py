@@ -0,0 +1,148 @@
+"""
+Database engine profile: connection tuning and read/write routing.
+
+With DB_PROFILE=production (the default) every SQLite connection is opened
+with WAL journaling, synchronous=NORMAL, a busy timeout and larger
+mmap/page caches. Write transactions start with BEGIN IMMEDIATE, so a
+writer waits for the lock up front (bounded by the busy timeout) instead of
+failing with "database is locked" when it tries to upgrade a read
+transaction.
+
+A second, read-only engine (PRAGMA query_only) serves reads made during a
+request, until that request's transaction first writes. GET pages
+therefore never queue behind checkout and webhook writes, and reads in a
+POST do not take the write lock. Writes, flushes and anything read after
+the first write in a transaction go to the writer, so a request always
+sees its own changes. Outside a request (CLI commands, workers) everything
+uses the writer. For other databases DATABASE_READ_URL can point the
+reader at a replica.
+
+Pool sizes are per process, i.e. per gunicorn worker. Size them to the
+worker's thread count. With gunicorn --preload the engines are created in
+the master before it forks. A forked child therefore discards the pooled
+connections it inherited, without closing them, and opens its own. DB_PROFILE=stock keeps SQLAlchemy's defaults (for
+comparison benchmarks).
+"""
+import os
+import weakref
+from flask import has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import TextClause
+
+READER = "reader"
+
+
+def _is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def _is_read(clause):
+    if isinstance(clause, Select):
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() in ("SELECT", "WITH")
+    return False
+
+
+class RoutingSession(Session):
+    """Sends reads to the read-only engine until the transaction writes."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not self.info.get("_wrote")
+                and _is_read(clause) and has_request_context()):
+            reader = self._db.engines.get(READER)
+            if reader is not None:
+                return reader
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and has_request_context():
+            self.info["_wrote"] = True  # read your own writes until the transaction ends
+        return engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("_wrote", None)
+
+
+def _pool_options(cfg, prefix):
+    return {
+        "pool_size": cfg[f"{prefix}_POOL_SIZE"],
+        "max_overflow": cfg[f"{prefix}_MAX_OVERFLOW"],
+        "pool_timeout": cfg["DB_POOL_TIMEOUT"],
+    }
+
+
+def _tune_sqlite(engine, cfg, read_only):
+    busy_ms = cfg["SQLITE_BUSY_TIMEOUT_MS"]
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={busy_ms}",
+        f"PRAGMA mmap_size={cfg['SQLITE_MMAP_SIZE']}",
+        f"PRAGMA cache_size=-{cfg['SQLITE_CACHE_KIB']}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, record):
+        # take transaction control from pysqlite so BEGIN can be IMMEDIATE (see below)
+        dbapi_conn.isolation_level = None
+        cursor = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        conn.exec_driver_sql("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+
+# every engine made by init_database, for the fork hook (one per process, not per app)
+_ENGINES = weakref.WeakSet()
+
+
+def _after_fork():
+    # close=False: the parent still owns those connections
+    for engine in list(_ENGINES):
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def init_database(app, db):
+    """Configure the engines for the profile, then db.init_app(app)."""
+    cfg = app.config
+    url = cfg["SQLALCHEMY_DATABASE_URI"]
+    production = cfg.get("DB_PROFILE", "production") == "production"
+    sqlite_file = _is_sqlite_file(url)
+    read_url = cfg.get("DATABASE_READ_URL") or (url if sqlite_file else None)
+
+    if production and (sqlite_file or not url.startswith("sqlite")):
+        options = dict(cfg.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        for key, value in _pool_options(cfg, "DB").items():
+            options.setdefault(key, value)
+        cfg["SQLALCHEMY_ENGINE_OPTIONS"] = options
+        if read_url:
+            binds = dict(cfg.get("SQLALCHEMY_BINDS") or {})
+            binds.setdefault(READER, {"url": read_url, **_pool_options(cfg, "DB_READ")})
+            cfg["SQLALCHEMY_BINDS"] = binds
+
+    db.init_app(app)
+    with app.app_context():
+        _ENGINES.update(db.engines.values())
+
+    if production and sqlite_file:
+        with app.app_context():
+            _tune_sqlite(db.engines[None], cfg, read_only=False)
+            if READER in db.engines and _is_sqlite_file(db.engines[READER].url):
+                _tune_sqlite(db.engines[READER], cfg, read_only=True)
+
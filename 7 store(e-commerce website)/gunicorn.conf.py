@@ -0,0 +1,108 @@
+"""
+Gunicorn settings: gunicorn -c gunicorn.conf.py "app:create_app()"
+
+WORKER_PROFILE picks how a worker process serves requests:
+  sync     one request at a time (the old default). A checkout waiting on
+           Stripe holds the whole worker.
+  gthread  GUNICORN_THREADS request threads per worker.
+  gevent   up to GUNICORN_WORKER_CONNECTIONS requests per worker, one
+           greenlet each. Sockets are cooperative, so requests waiting on
+           Stripe (or on a slow client) yield to the others. This is the
+           profile for payment-heavy traffic.
+
+Under gevent, calls into SQLite do not yield. A greenlet stuck in SQLite's
+busy wait would stall every request in its worker. The profile therefore
+gives each worker a single writer connection: writers wait their turn on
+the pool, which does yield. Reads go to the read-only engine's pool
+(DB_PROFILE=production). Any of these can still be overridden from the
+environment. CPU-bound work does not yield either: image derivatives are
+built in gevent's native thread pool instead (see images.py).
+
+The app is preloaded (GUNICORN_PRELOAD=0 turns this off). The master
+builds it once, along with the heavy modules the app only imports on first
+use (PRELOAD_MODULES). It then freezes the GC, so the forked workers share
+those pages copy-on-write instead of each importing everything again. A new
+or restarted worker is ready in milliseconds. Run `flask init-db` before
+starting gunicorn: the workers do not create the schema. The master also
+loads the search-as-you-type index (autocomplete.py), which the workers
+then share instead of each loading its own.
+"""
+import gc
+import importlib
+import multiprocessing
+import os
+import time
+
+WORKER_PROFILE = os.getenv("WORKER_PROFILE", "sync")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(min(2 * multiprocessing.cpu_count() + 1, 8))))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# imported lazily by the app; with preload_app they are loaded once in the master
+PRELOAD_MODULES = ("stripe", "PIL.Image")
+
+if WORKER_PROFILE == "sync":
+    worker_class = "sync"
+elif WORKER_PROFILE == "gthread":
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "8"))
+    # pools are per worker: one connection per request thread
+    os.environ.setdefault("DB_POOL_SIZE", str(threads))
+    os.environ.setdefault("DB_READ_POOL_SIZE", str(threads))
+    os.environ.setdefault("STRIPE_POOL_SIZE", str(threads))
+elif WORKER_PROFILE == "gevent":
+    # patch before the app (or anything that creates locks or sockets) is imported
+    from gevent import monkey
+    monkey.patch_all()
+
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "200"))
+    os.environ.setdefault("DB_POOL_SIZE", "1")
+    os.environ.setdefault("DB_MAX_OVERFLOW", "0")
+    os.environ.setdefault("DB_READ_POOL_SIZE", "16")
+    os.environ.setdefault("DB_POOL_TIMEOUT", "30")
+    os.environ.setdefault("STRIPE_POOL_SIZE", "64")
+else:
+    raise RuntimeError(f"Unknown WORKER_PROFILE {WORKER_PROFILE!r} (expected sync, gthread or gevent)")
+
+
+def when_ready(server):
+    if preload_app:
+        for name in PRELOAD_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                server.log.warning("could not preload %s", name)
+        from autocomplete import warm_index
+        started = time.perf_counter()
+        try:
+            warm_index(server.app.wsgi())
+        except Exception:
+            server.log.exception("could not preload the autocomplete index; workers load it on first use")
+        else:
+            server.log.info("autocomplete index loaded in %.0fms", (time.perf_counter() - started) * 1000)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # objects that exist now stay out of the collector, which would
+        # otherwise touch (and so copy) their pages in every worker
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    from payments import cooperative_io
+    if WORKER_PROFILE == "gevent" and not cooperative_io():
+        worker.log.warning("WORKER_PROFILE=gevent but sockets are not patched: Stripe calls will block the worker")
+    worker.log.info("worker %s ready in %.1fms (%s profile, preload %s)", worker.pid,
+                    (time.monotonic() - worker.forked_at) * 1000, WORKER_PROFILE, "on" if preload_app else "off")
@@ -0,0 +1,96 @@
+"""
+Cached identity for Flask-Login's user_loader.
+
+Every authenticated request loads the signed-in user, which used to be a
+primary-key query per request. The loader now keeps the user's columns in
+a small per-process LRU (IDENTITY_CACHE_SIZE entries, IDENTITY_CACHE_TTL
+seconds). On a hit it rebuilds the User and attaches it to the session with
+merge(load=False), so no query is sent. Relationships, and the password
+hash, which is not cached (so re-hashing it on login needs no
+invalidation), still lazy-load when something reads them.
+
+Code that changes a user's roles or profile calls forget_user(user_id)
+after committing. That drops the entry in this worker and bumps a shared
+epoch (a SharedCounter, see catalog.py). Other workers see the new epoch
+on their next lookup and reload from the database, so a role change takes
+effect on every worker's next request. The TTL bounds staleness for
+writes made outside the app.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+from catalog import SharedCounter
+from models import db, User
+
+CACHED_FIELDS = ("id", "username", "email", "is_admin", "is_seller", "created_at")
+
+
+class IdentityCache:
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user id -> (expires, epoch, fields)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, epoch):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, entry_epoch, fields = entry
+            if entry_epoch != epoch or expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return fields
+
+    def put(self, user_id, epoch, fields):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, epoch, fields)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+def init_identity(app):
+    path = app.config.get("IDENTITY_EPOCH_PATH") or os.path.join(app.instance_path, "identity_epoch")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    app.extensions["identity"] = {
+        "cache": IdentityCache(app.config.get("IDENTITY_CACHE_SIZE", 2048), app.config.get("IDENTITY_CACHE_TTL", 60)),
+        "epoch": SharedCounter(path),
+    }
+
+
+def load_user(user_id):
+    """The user_loader: the User for a session's user id, from the cache when possible."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    state = current_app.extensions["identity"]
+    if not state["cache"].ttl:
+        return db.session.get(User, user_id)
+    epoch = state["epoch"].get()
+    fields = state["cache"].get(user_id, epoch)
+    if fields is not None:
+        user = User(**fields)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        state["cache"].put(user_id, epoch, {name: getattr(user, name) for name in CACHED_FIELDS})
+    return user
+
+
+def forget_user(user_id):
+    """Call after committing a change to a user's roles or profile."""
+    state = current_app.extensions["identity"]
+    state["cache"].discard(user_id)
+    state["epoch"].bump()
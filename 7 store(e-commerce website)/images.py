@@ -0,0 +1,172 @@
+"""
+Resized and WebP derivatives of uploaded product images.
+
+After an upload is saved, schedule_derivatives() hands it to a small
+background thread pool that writes a JPEG thumbnail and a WebP variant per
+width into <upload folder>/derived/. The seller's request does not wait for
+it. Templates use image_srcset()/image_src() (via the product_image macro),
+which only list derivatives that already exist, so a page rendered before
+the worker finishes falls back to the original file.
+
+Under the gevent worker profile the standard thread pool is made of
+greenlets, and a resize would hold the whole worker. There the decoding,
+resizing and encoding run in a gevent native-thread pool (Pillow releases
+the GIL for them), and only the short database update afterwards runs in
+a greenlet.
+"""
+import os
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app, url_for
+from payments import cooperative_io
+
+DERIVED_DIR = "derived"
+DEFAULT_WIDTHS = (240, 480, 960)
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_known = set()  # derivative paths already seen on disk (they are never rewritten)
+
+
+def _get_executor(max_workers):
+    # pools do not survive a fork, so each gunicorn worker builds its own
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            if cooperative_io():
+                from gevent.threadpool import ThreadPool
+                _executor = ThreadPool(max_workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="img")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def derivative_name(filename, width, ext):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return f"{DERIVED_DIR}/{stem}-{width}.{ext}"
+
+
+def build_derivatives(upload_folder, filename, widths=DEFAULT_WIDTHS, quality=80):
+    """Write every missing derivative of `filename`. Safe to call repeatedly."""
+    from PIL import Image, ImageOps
+
+    source = os.path.join(upload_folder, filename)
+    os.makedirs(os.path.join(upload_folder, DERIVED_DIR), exist_ok=True)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        written = []
+        for width in sorted(widths):
+            # never upscale; the original already covers larger slots
+            if width >= img.width and width != min(widths):
+                continue
+            w = min(width, img.width)
+            h = max(1, round(img.height * w / img.width))
+            resized = img.resize((w, h), Image.LANCZOS) if w != img.width else img
+            for ext, fmt in FORMATS.items():
+                name = derivative_name(filename, width, ext)
+                target = os.path.join(upload_folder, name)
+                if os.path.exists(target):
+                    continue
+                # the same content can be uploaded twice at once; never share a temp file
+                tmp = f"{target}.{os.getpid()}-{threading.get_ident()}.tmp"
+                if fmt == "JPEG":
+                    resized.convert("RGB").save(tmp, fmt, quality=quality, optimize=True, progressive=True)
+                else:
+                    resized.save(tmp, fmt, quality=quality, method=4)
+                os.replace(tmp, target)
+                written.append(name)
+    return written
+
+
+def _build_safely(app, upload_folder, filename, widths, slugs, native_pool=None):
+    try:
+        args = (upload_folder, filename, widths)
+        written = build_derivatives(*args) if native_pool is None else native_pool.apply(build_derivatives, args)
+    except Exception:
+        app.logger.exception("Building image derivatives failed for %s", filename)
+        return
+    if written and slugs:
+        # pages cached while the worker ran only know the original; re-render them
+        # (and change their ETag, so browsers pick up the srcset too)
+        from catalog import product_changed
+        from models import db, Product
+        with app.app_context():
+            db.session.execute(db.update(Product).where(Product.slug.in_(slugs)).values(updated_at=datetime.utcnow()))
+            db.session.commit()
+            product_changed(*slugs)
+
+
+def schedule_derivatives(filename, *slugs):
+    """Queue derivative generation for a freshly saved upload used by the given products."""
+    app = current_app._get_current_object()
+    upload_folder = upload_folder_path(app)
+    widths = app.config.get("IMAGE_WIDTHS", DEFAULT_WIDTHS)
+    executor = _get_executor(app.config.get("IMAGE_WORKERS", 2))
+    if cooperative_io():
+        import gevent
+        # the greenlet only waits on the native thread, so other requests keep running
+        return gevent.spawn(_build_safely, app, upload_folder, filename, widths, slugs, executor)
+    return executor.submit(_build_safely, app, upload_folder, filename, widths, slugs)
+
+
+def upload_folder_path(app):
+    """Absolute upload directory (UPLOAD_FOLDER is relative to the app root)."""
+    folder = app.config.get("UPLOAD_FOLDER", "static/images")
+    return folder if os.path.isabs(folder) else os.path.join(app.root_path, folder)
+
+
+def _available(filename, ext):
+    upload_folder = upload_folder_path(current_app)
+    found = []
+    for width in current_app.config.get("IMAGE_WIDTHS", DEFAULT_WIDTHS):
+        name = derivative_name(filename, width, ext)
+        path = os.path.join(upload_folder, name)
+        if path in _known or os.path.exists(path):
+            _known.add(path)
+            found.append((width, name))
+    return found
+
+
+def image_srcset(filename, ext="webp"):
+    """`srcset` value listing the existing derivatives of an upload ('' if none yet)."""
+    if not filename:
+        return ""
+    return ", ".join(
+        f"{url_for('uploaded_file', filename=name)} {width}w" for width, name in _available(filename, ext)
+    )
+
+
+def image_src(filename, width=DEFAULT_WIDTHS[0]):
+    """Smallest JPEG derivative at least `width` wide, else the original upload."""
+    for w, name in _available(filename, "jpg"):
+        if w >= width:
+            return url_for("uploaded_file", filename=name)
+    return url_for("uploaded_file", filename=filename)
+
+
+def init_images(app):
+    app.add_template_global(image_srcset)
+    app.add_template_global(image_src)
+
+    @app.cli.command("build-image-derivatives")
+    @click.option("--widths", default=None, help="Comma separated widths (default: IMAGE_WIDTHS).")
+    def build_image_derivatives_command(widths):
+        """Generate missing derivatives for every product image."""
+        from models import Product
+
+        widths = tuple(int(w) for w in widths.split(",")) if widths else app.config.get("IMAGE_WIDTHS", DEFAULT_WIDTHS)
+        upload_folder = upload_folder_path(app)
+        names = {fn for (fn,) in Product.query.with_entities(Product.image_filename) if fn}
+        for fn in sorted(names):
+            if not os.path.exists(os.path.join(upload_folder, fn)):
+                click.echo(f"missing: {fn}")
+                continue
+            written = build_derivatives(upload_folder, fn, widths)
+            click.echo(f"{fn}: {len(written)} derivative(s) written")
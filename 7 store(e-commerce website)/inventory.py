@@ -0,0 +1,179 @@
+"""
+Stock reservations for checkout.
+
+Checkout takes stock for the whole cart with one conditional UPDATE:
+
+    UPDATE product SET stock = stock - <qty for id>
+    WHERE id IN (...) AND stock >= <qty for id> RETURNING id
+
+A product without enough stock is simply not updated. No lock is held
+across the request, and concurrent checkouts for a hot product cannot
+oversell: if any line comes back short, the caller rolls the whole order
+back. The stock taken is recorded as a held StockReservation. It expires
+RESERVATION_GRACE seconds after the Stripe session closes (checkout_ttl()),
+so a payment completed at the deadline, whose webhook arrives a little
+later, still converts held stock instead of re-taking released stock.
+
+Stock writes here do not call product_changed(). They bump the product's
+updated_at (its onupdate), and the cached product page fragment is keyed
+by it, so the "Out of stock" badge follows the stock.
+
+Payment (webhook worker or success redirect, via mark_orders_paid) turns
+held reservations into sales. `flask sweep-reservations` returns expired
+ones to stock.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import bindparam, case, insert, select, update
+from models import db, Product, StockReservation
+
+
+# Stripe accepts Checkout session expiries 30 minutes to 24 hours after the
+# call; the extra minute covers clock skew and the time to reach Stripe
+SESSION_MIN_TTL = 31 * 60
+SESSION_MAX_TTL = 24 * 3600
+
+
+class OutOfStock(Exception):
+    """Some products in the cart do not have enough stock left."""
+
+    def __init__(self, product_ids):
+        super().__init__(f"insufficient stock for product(s) {product_ids}")
+        self.product_ids = product_ids
+
+
+def checkout_ttl():
+    """Seconds a Stripe Checkout session stays payable: RESERVATION_TTL, within Stripe's limits."""
+    ttl = current_app.config.get("RESERVATION_TTL", 1800)
+    return min(max(ttl, SESSION_MIN_TTL), SESSION_MAX_TTL)
+
+
+def reserve_stock(order_id, quantities, ttl=None):
+    """
+    Take stock for {product_id: qty} and hold it for the order.
+    The hold lasts `ttl` seconds (default: the checkout session's lifetime
+    plus RESERVATION_GRACE). Returns the reservation expiry. Raises
+    OutOfStock, in which case the caller must roll back (stock already
+    taken for other lines included).
+    """
+    quantities = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return None
+    needed = case(quantities, value=Product.id)
+    taken = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(sorted(quantities)), Product.stock >= needed)
+        .values(stock=Product.stock - needed)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    missing = sorted(set(quantities) - set(taken))
+    if missing:
+        raise OutOfStock(missing)
+
+    if ttl is None:
+        ttl = checkout_ttl() + current_app.config.get("RESERVATION_GRACE", 900)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    db.session.execute(insert(StockReservation), [
+        {"order_id": order_id, "product_id": pid, "quantity": qty, "status": "held",
+         "expires_at": expires_at, "created_at": now}
+        for pid, qty in quantities.items()
+    ])
+    return expires_at
+
+
+def _adjust_stock(rows, sign):
+    """Add (sign=1) or remove (sign=-1) the quantities in (product_id, quantity) rows."""
+    per_product = defaultdict(int)
+    for product_id, quantity in rows:
+        per_product[product_id] += quantity
+    if not per_product:
+        return
+    table = Product.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam("pid")).values(stock=table.c.stock + bindparam("delta")),
+        [{"pid": pid, "delta": sign * qty} for pid, qty in per_product.items()],
+    )
+
+
+def _transition(condition, from_status, to_status):
+    return db.session.execute(
+        update(StockReservation)
+        .where(condition, StockReservation.status == from_status)
+        .values(status=to_status)
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+
+def release_reservations(order_ids):
+    """Give held stock for these orders back (e.g. the Stripe session could not be created)."""
+    if order_ids:
+        _adjust_stock(_transition(StockReservation.order_id.in_(list(order_ids)), "held", "released"), 1)
+
+
+def convert_reservations(order_ids):
+    """
+    Turn the reservations of newly paid orders into sales. If a payment
+    lands after its reservation was swept, the stock is taken again
+    (possibly below zero): the customer has paid, so the sale stands and
+    is logged for follow-up.
+    """
+    if not order_ids:
+        return
+    ids = list(order_ids)
+    _transition(StockReservation.order_id.in_(ids), "held", "sold")
+    late = _transition(StockReservation.order_id.in_(ids), "released", "sold")
+    if late:
+        _adjust_stock(late, -1)
+        current_app.logger.warning("Payment arrived after reservation expiry for %d line(s); stock re-taken", len(late))
+
+
+def sweep_expired(batch_size=500, now=None):
+    """Release one batch of expired reservations. Returns how many were released."""
+    now = now or datetime.utcnow()
+    expired = (select(StockReservation.id)
+               .where(StockReservation.status == "held", StockReservation.expires_at <= now)
+               .order_by(StockReservation.expires_at)
+               .limit(batch_size)
+               .scalar_subquery())
+    released = _transition(StockReservation.id.in_(expired), "held", "released")
+    _adjust_stock(released, 1)
+    db.session.commit()
+    return len(released)
+
+
+def run_sweeper(batch_size=500, poll_interval=30.0, once=False):
+    """Release expired reservations until none are left (once=True) or forever."""
+    total = 0
+    while True:
+        try:
+            n = sweep_expired(batch_size)
+        except Exception:
+            db.session.rollback()
+            if once:
+                raise
+            current_app.logger.exception("Reservation sweep failed; retrying")
+            n = 0
+        total += n
+        if n:
+            current_app.logger.info("Released %d expired stock reservation(s)", n)
+        elif once:
+            return total
+        else:
+            time.sleep(poll_interval)
+
+
+def init_inventory(app):
+    @app.cli.command("sweep-reservations")
+    @click.option("--batch-size", default=500, show_default=True)
+    @click.option("--interval", default=30.0, show_default=True, help="Seconds between sweeps.")
+    @click.option("--once", is_flag=True, help="Exit once no expired reservations are left.")
+    def sweep_reservations_command(batch_size, interval, once):
+        """Return stock held by expired, unpaid checkouts."""
+        total = run_sweeper(batch_size=batch_size, poll_interval=interval, once=once)
+        click.echo(f"released {total} reservation(s)")
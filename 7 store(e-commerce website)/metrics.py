@@ -0,0 +1,340 @@
+"""
+Per-request instrumentation, aggregated across gunicorn workers.
+
+For every request we record, per endpoint: wall time, the number and total
+time of SQL statements, template render time and time spent in Stripe
+calls. Values go into histograms kept in shared memory: each worker
+process owns one memory-mapped file under METRICS_DIR and only ever writes
+to its own file, so no cross-process locking is needed. /admin/metrics
+sums all files and renders them in the Prometheus text format.
+
+Counters are cumulative, so files left by workers that have exited still
+count. Clear METRICS_DIR on deploy if you want the totals to reset.
+
+With SLOW_REQUEST_MS set, requests slower than that are logged together
+with their slowest SQL statements.
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from flask import current_app, g, has_app_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    "store_request_duration_seconds": ("Wall time per request.", REQUEST_BUCKETS),
+    "store_request_sql_queries": ("SQL statements executed per request.", QUERY_BUCKETS),
+    "store_request_sql_duration_seconds": ("Time spent in SQL per request.", REQUEST_BUCKETS),
+    "store_request_template_duration_seconds": ("Time spent rendering templates per request.", REQUEST_BUCKETS),
+    "store_request_stripe_duration_seconds": ("Time spent in Stripe API calls per request.", REQUEST_BUCKETS),
+}
+COUNTERS = {
+    "store_requests_total": "Requests served, by endpoint and status code class.",
+    "store_slow_requests_total": "Requests slower than SLOW_REQUEST_MS.",
+    "store_reaper_orders_total": "Stale pending orders settled by the order reaper, by outcome.",
+    "store_reaper_seconds_total": "Time the order reaper spent on batches (orders_total / this = rows per second).",
+}
+
+# keep at most this many statements per request for the slow-request log
+_MAX_CAPTURED_STATEMENTS = 200
+_SLOW_LOG_STATEMENTS = 10
+
+
+class _MmapValues:
+    """
+    A growable file of (key, float) entries owned by a single process.
+
+    Layout: 8-byte header holding the used length, then entries of
+    <u32 key length><utf-8 key, padded to 8 bytes><f64 value>. Values are
+    written before the used length is advanced, so readers in other
+    processes only ever see complete entries.
+    """
+
+    _INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._INITIAL_SIZE:
+            self._file.truncate(self._INITIAL_SIZE)
+            size = self._INITIAL_SIZE
+        self._capacity = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._positions = {}
+        self._used = struct.unpack_from("Q", self._map, 0)[0] or 8
+        for key, _, pos in _iter_entries(self._map, self._used):
+            self._positions[key] = pos
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._capacity = capacity
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def _position(self, key):
+        pos = self._positions.get(key)
+        if pos is None:
+            encoded = key.encode("utf-8")
+            padded = len(encoded) + (-(4 + len(encoded)) % 8)
+            entry_end = self._used + 4 + padded + 8
+            if entry_end > self._capacity:
+                self._grow(entry_end)
+            struct.pack_into(f"I{padded}sd", self._map, self._used, len(encoded), encoded, 0.0)
+            pos = entry_end - 8
+            self._used = entry_end
+            struct.pack_into("Q", self._map, 0, self._used)
+            self._positions[key] = pos
+        return pos
+
+    def add(self, items):
+        """Add each (key, amount) in `items` to the stored values."""
+        with self._lock:
+            for key, amount in items:
+                pos = self._position(key)
+                value = struct.unpack_from("d", self._map, pos)[0]
+                struct.pack_into("d", self._map, pos, value + amount)
+
+
+def _iter_entries(buf, used):
+    pos = 8
+    while pos < used:
+        length = struct.unpack_from("I", buf, pos)[0]
+        key = bytes(buf[pos + 4:pos + 4 + length]).decode("utf-8")
+        pos += 4 + length + (-(4 + length) % 8)
+        yield key, struct.unpack_from("d", buf, pos)[0], pos
+        pos += 8
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())], separators=(",", ":"))
+
+
+def _bucket_for(value, buckets):
+    for le in buckets:
+        if value <= le:
+            return le
+    return "+Inf"
+
+
+# ---- writing ------------------------------------------------------------
+
+def _store():
+    state = current_app.extensions["metrics"]
+    with state["lock"]:
+        if state["store"] is None or state["pid"] != os.getpid():
+            path = os.path.join(state["dir"], f"metrics_{os.getpid()}.db")
+            state["store"] = _MmapValues(path)
+            state["pid"] = os.getpid()
+        return state["store"]
+
+
+def _observations(name, labels, value):
+    """Entries for one histogram sample (per-bucket counts, cumulated when rendered)."""
+    le = _bucket_for(value, HISTOGRAMS[name][1])
+    return [
+        (_key(name + "_bucket", dict(labels, le=str(le))), 1.0),
+        (_key(name + "_sum", labels), float(value)),
+        (_key(name + "_count", labels), 1.0),
+    ]
+
+
+def record_reaper_batch(counts, seconds):
+    """Called by the order reaper after each batch: {outcome: orders} and the batch's wall time."""
+    if not current_app.config.get("METRICS_ENABLED", True):
+        return
+    items = [(_key("store_reaper_orders_total", {"outcome": outcome}), float(n)) for outcome, n in counts.items() if n]
+    items.append((_key("store_reaper_seconds_total", {}), float(seconds)))
+    _store().add(items)
+
+
+def record_stripe_time(seconds):
+    """Called by the payment client; attributes Stripe time to the current request."""
+    if has_app_context():
+        stats = g.get("_metrics")
+        if stats is not None:
+            stats["stripe_time"] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_app_context() and g.get("_metrics") is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context():
+        return
+    stats = g.get("_metrics")
+    started = getattr(context, "_metrics_started", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats["sql_count"] += 1
+    stats["sql_time"] += elapsed
+    statements = stats["statements"]
+    if statements is not None and len(statements) < _MAX_CAPTURED_STATEMENTS:
+        statements.append((elapsed, statement))
+
+
+class _TimedTemplate(Template):
+    # blinker is not a dependency, so template signals are unavailable; time render() instead
+    def render(self, *args, **kwargs):
+        stats = g.get("_metrics") if has_app_context() else None
+        if stats is None:
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            stats["template_time"] += time.perf_counter() - start
+
+
+def _start_request():
+    slow_ms = current_app.config.get("SLOW_REQUEST_MS", 0)
+    g._metrics = {
+        "start": time.perf_counter(),
+        "sql_count": 0,
+        "sql_time": 0.0,
+        "template_time": 0.0,
+        "stripe_time": 0.0,
+        "statements": [] if slow_ms else None,
+    }
+
+
+def _finish_request(response):
+    stats = g.pop("_metrics", None)
+    if stats is None:
+        return response
+    wall = time.perf_counter() - stats["start"]
+    endpoint = request.endpoint or "unmatched"  # keep 404 noise out of the label set
+    labels = {"endpoint": endpoint}
+    items = [(_key("store_requests_total", dict(labels, status=f"{response.status_code // 100}xx")), 1.0)]
+    items += _observations("store_request_duration_seconds", labels, wall)
+    items += _observations("store_request_sql_queries", labels, stats["sql_count"])
+    items += _observations("store_request_sql_duration_seconds", labels, stats["sql_time"])
+    items += _observations("store_request_template_duration_seconds", labels, stats["template_time"])
+    items += _observations("store_request_stripe_duration_seconds", labels, stats["stripe_time"])
+
+    slow_ms = current_app.config.get("SLOW_REQUEST_MS", 0)
+    if slow_ms and wall * 1000 >= slow_ms:
+        items.append((_key("store_slow_requests_total", labels), 1.0))
+        _log_slow_request(endpoint, wall, stats)
+
+    try:
+        _store().add(items)
+    except OSError as e:  # metrics must never break a request
+        current_app.logger.warning("Could not record metrics: %s", e)
+    return response
+
+
+def _log_slow_request(endpoint, wall, stats):
+    slowest = sorted(stats["statements"], key=lambda s: s[0], reverse=True)[:_SLOW_LOG_STATEMENTS]
+    lines = [f"  {elapsed * 1000:8.1f}ms  {' '.join(statement.split())[:500]}" for elapsed, statement in slowest]
+    current_app.logger.warning(
+        "Slow request %s %s (%s): %.0fms total, %d SQL in %.0fms, templates %.0fms, Stripe %.0fms%s",
+        request.method, request.full_path.rstrip("?"), endpoint, wall * 1000,
+        stats["sql_count"], stats["sql_time"] * 1000, stats["template_time"] * 1000,
+        stats["stripe_time"] * 1000, ("\n" + "\n".join(lines)) if lines else "",
+    )
+
+
+# ---- reading ------------------------------------------------------------
+
+def collect(directory):
+    """Sum the values written by every worker process. Returns {(name, labels): value}."""
+    totals = {}
+    for path in glob.glob(os.path.join(directory, "metrics_*.db")):
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except OSError:
+            continue
+        if len(data) < 8:
+            continue
+        used = min(struct.unpack_from("Q", data, 0)[0], len(data))
+        for key, value, _ in _iter_entries(data, used):
+            name, labels = json.loads(key)
+            ident = (name, tuple(tuple(pair) for pair in labels))
+            totals[ident] = totals.get(ident, 0.0) + value
+    return totals
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def render_prometheus(directory):
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    totals = collect(directory)
+    out = []
+
+    for name, help_text in COUNTERS.items():
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(totals.items()):
+            if metric == name:
+                out.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} histogram")
+        series = {}
+        for (metric, labels), value in totals.items():
+            if metric == name + "_bucket":
+                le = dict(labels)["le"]
+                rest = tuple(pair for pair in labels if pair[0] != "le")
+                series.setdefault(rest, {})[le] = value
+            elif metric in (name + "_sum", name + "_count"):
+                series.setdefault(labels, {})[metric[len(name):]] = value
+        for labels in sorted(series):
+            values = series[labels]
+            cumulative = 0.0
+            for le in [str(b) for b in buckets] + ["+Inf"]:
+                cumulative += values.get(le, 0.0)
+                out.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative:g}")
+            out.append(f"{name}_sum{_format_labels(labels)} {values.get('_sum', 0.0):.6f}")
+            out.append(f"{name}_count{_format_labels(labels)} {values.get('_count', 0.0):g}")
+    return "\n".join(out) + "\n"
+
+
+def metrics_dir(app=None):
+    app = app or current_app
+    return app.extensions["metrics"]["dir"]
+
+
+_listeners_installed = False
+
+
+def init_metrics(app):
+    directory = app.config.get("METRICS_DIR") or os.path.join(app.instance_path, "metrics")
+    os.makedirs(directory, exist_ok=True)
+    app.extensions["metrics"] = {"dir": directory, "store": None, "pid": None, "lock": threading.Lock()}
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    global _listeners_installed
+    if not _listeners_installed:
+        # on the Engine class, so every engine (and every app) is covered; outside a request they are no-ops
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _listeners_installed = True
+
+    app.jinja_env.template_class = _TimedTemplate
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
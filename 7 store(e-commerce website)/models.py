@@ -1,9 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
+from collections import namedtuple
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from database import RoutingSession
+from passwords import hash_password, verify_password
 
-db = SQLAlchemy()
+# reads during a request may go to a read-only engine (see database.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(UserMixin, db.Model):
     __tablename__ = "user"
@@ -19,10 +22,11 @@ class User(UserMixin, db.Model):
     products = db.relationship("Product", back_populates="seller", lazy="dynamic")
 
     def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+        # same method, cost and worker pool as the auth views (see passwords.py)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)[0]
 
     def __repr__(self):
         return f"<User {self.username} id={self.id}>"
@@ -42,8 +46,19 @@ class SellerProfile(db.Model):
 
 class Product(db.Model):
     __tablename__ = "product"
+    __table_args__ = (
+        # /browse: sort key first (after seller_id when filtering by seller), then
+        # id for the keyset, then every filtered column, so page and facet queries
+        # are answered from the index alone (see browse.py)
+        db.Index("ix_product_browse_created", "created_at", "id", "price", "stock", "seller_id"),
+        db.Index("ix_product_browse_price", "price", "id", "stock", "seller_id"),
+        db.Index("ix_product_seller_created", "seller_id", "created_at", "id", "price", "stock"),
+        db.Index("ix_product_seller_price", "seller_id", "price", "id", "stock"),
+        # rows changed since a point in time (autocomplete.py catches up from here)
+        db.Index("ix_product_updated_at", "updated_at"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    seller_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True, index=True)
+    seller_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
     name = db.Column(db.String(255), nullable=False, index=True)
     slug = db.Column(db.String(255), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -51,6 +66,8 @@ class Product(db.Model):
     stock = db.Column(db.Integer, default=0)
     image_filename = db.Column(db.String(512), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # any change to the row (stock included); the product page's ETag validator
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     seller = db.relationship("User", back_populates="products")
 
@@ -61,18 +78,37 @@ class Product(db.Model):
 
 class Order(db.Model):
     __tablename__ = "order"
+    __table_args__ = (
+        # order history is read newest-first per user and paged on (created_at, id)
+        db.Index("ix_order_user_created", "user_id", "created_at", "id"),
+        # the reaper range-scans stale pending orders (see reaper.py)
+        db.Index("ix_order_status_created", "status", "created_at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=True, index=True)
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), default="pending", index=True)
     stripe_session_id = db.Column(db.String(255), nullable=True, index=True)
+    payment_intent = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # snapshot of the lines taken at checkout and never changed (see orders.order_summary);
+    # the order pages render from it instead of loading order_item rows
+    summary = db.Column(db.JSON(none_as_null=True), nullable=True)
 
     items = db.relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
+    @property
+    def lines(self):
+        """The order's OrderLines, from the summary (or the item rows until it is backfilled)."""
+        if self.summary is not None:
+            return [OrderLine(*item) for item in self.summary["items"]]
+        return [OrderLine(it.product_id, it.product_name, it.quantity, it.unit_price) for it in self.items]
+
     def __repr__(self):
         return f"<Order id={self.id} total={self.total_amount} status={self.status}>"
 
+OrderLine = namedtuple("OrderLine", "product_id product_name quantity unit_price")
+
 class OrderItem(db.Model):
     __tablename__ = "order_item"
     id = db.Column(db.Integer, primary_key=True)
@@ -81,12 +117,137 @@ class OrderItem(db.Model):
     product_name = db.Column(db.String(255), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
+    # seller credited with the sale, fixed at checkout (0: the store's own products); see analytics.py
+    seller_id = db.Column(db.Integer, nullable=True)
 
     order = db.relationship("Order", back_populates="items")
 
     def __repr__(self):
         return f"<OrderItem order_id={self.order_id} product_id={self.product_id} qty={self.quantity}>"
     
+class StripeEvent(db.Model):
+    """Verified Stripe webhook events, queued for the webhook worker."""
+    __tablename__ = "stripe_event"
+    __table_args__ = (
+        # the worker drains unprocessed events in arrival order
+        db.Index("ix_stripe_event_pending", "processed_at", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(255), unique=True, nullable=False)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f"<StripeEvent {self.event_id} type={self.type}>"
+
+class StockReservation(db.Model):
+    """Stock held for a pending order until it is paid (sold) or expires (released)."""
+    __tablename__ = "stock_reservation"
+    __table_args__ = (
+        # the sweeper scans held reservations by expiry
+        db.Index("ix_stock_reservation_status_expires", "status", "expires_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="held")  # held / sold / released
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<StockReservation order_id={self.order_id} product_id={self.product_id} qty={self.quantity} {self.status}>"
+
+class ProductSalesDaily(db.Model):
+    """Units, revenue and orders per product per order day (paid + shipped), see analytics.py."""
+    __tablename__ = "product_sales_daily"
+    __table_args__ = (
+        # a seller's best sellers over a window of days
+        db.Index("ix_product_sales_daily_seller_day", "seller_id", "day"),
+        # store-wide best sellers over a window of days
+        db.Index("ix_product_sales_daily_day", "day"),
+    )
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    seller_id = db.Column(db.Integer, nullable=False, default=0)  # 0: product without a seller
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ProductSalesDaily {self.day} product_id={self.product_id} units={self.units}>"
+
+class SearchQuery(db.Model):
+    """How often a search (normalized: lowercase words, single spaces) found products; see autocomplete.py."""
+    __tablename__ = "search_query"
+    __table_args__ = (
+        # the most frequent queries first
+        db.Index("ix_search_query_hits", "hits"),
+    )
+    phrase = db.Column(db.String(100), primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    last_searched = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<SearchQuery {self.phrase!r} hits={self.hits}>"
+
+class SellerSalesDaily(db.Model):
+    """Units, revenue and orders per seller per order day (paid + shipped), see analytics.py."""
+    __tablename__ = "seller_sales_daily"
+    __table_args__ = (
+        # store-wide totals over a window of days
+        db.Index("ix_seller_sales_daily_day", "day"),
+    )
+    seller_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0: products without a seller
+    day = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SellerSalesDaily {self.day} seller_id={self.seller_id} revenue={self.revenue}>"
+
+class ProductFacet(db.Model):
+    """Product counts per seller, price band and availability, kept by triggers on product (see browse.py)."""
+    __tablename__ = "product_facet"
+    seller_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0: products without a seller
+    band = db.Column(db.Integer, primary_key=True, autoincrement=False)  # index into browse.price_bands()
+    in_stock = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 1 if stock > 0
+    products = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ProductFacet seller_id={self.seller_id} band={self.band} in_stock={self.in_stock} products={self.products}>"
+
+class ShoppingCart(db.Model):
+    """Server-side cart, owned by a user or (before login) an anonymous session token."""
+    __tablename__ = "shopping_cart"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True, unique=True)
+    token = db.Column(db.String(64), nullable=True, unique=True)
+    # total quantity across lines, kept current by triggers on cart_item (see cart.py)
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ShoppingCart id={self.id} user_id={self.user_id} items={self.item_count}>"
+
+class CartItem(db.Model):
+    __tablename__ = "cart_item"
+    __table_args__ = (
+        db.UniqueConstraint("cart_id", "product_id", name="uq_cart_item_product"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey("shopping_cart.id"), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<CartItem cart_id={self.cart_id} product_id={self.product_id} qty={self.quantity}>"
+
 class Address(db.Model):
     __tablename__ = "addresses"
     id = db.Column(db.Integer, primary_key=True)
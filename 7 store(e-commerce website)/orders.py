@@ -0,0 +1,86 @@
+"""
+Order status transitions shared by the Stripe webhook worker, the
+post-checkout redirect and the admin tools, and the order summary
+snapshot the order pages render from.
+"""
+import click
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import selectinload
+from models import db, Order
+from inventory import convert_reservations
+from analytics import record_sales
+
+
+def mark_orders_paid(payments):
+    """
+    Move pending orders to 'paid' in bulk, turn their stock reservations
+    into sales and add them to the sales rollups.
+
+    `payments` maps order id -> Stripe payment_intent id (or None). Orders
+    that are already paid (or otherwise past 'pending') are left alone, so
+    replays are harmless. Returns the ids that actually transitioned; the
+    caller commits.
+    """
+    if not payments:
+        return []
+    transitioned = db.session.execute(
+        update(Order)
+        .where(Order.id.in_(list(payments)), Order.status == "pending")
+        .values(status="paid")
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    intents = [{"oid": oid, "intent": payments[oid]} for oid in transitioned if payments.get(oid)]
+    if intents:
+        db.session.execute(
+            update(Order.__table__)
+            .where(Order.__table__.c.id == bindparam("oid"))
+            .values(payment_intent=bindparam("intent")),
+            intents,
+        )
+    convert_reservations(transitioned)
+    record_sales(transitioned)
+    return transitioned
+
+
+def order_summary(lines):
+    """
+    The Order.summary snapshot for (product_id, product_name, quantity,
+    unit_price) lines: {"items": [[...], ...], "units": n, "total": x}.
+    Items are positional lists (OrderLine order) to keep the column small.
+    """
+    items = [[pid, name, int(qty), float(price)] for pid, name, qty, price in lines]
+    return {
+        "items": items,
+        "units": sum(item[2] for item in items),
+        "total": round(sum(item[2] * item[3] for item in items), 2),
+    }
+
+
+def backfill_summaries(batch_size=500):
+    """Write the summary of every order that lacks one (placed before it existed). Returns the count."""
+    done = 0
+    last_id = 0
+    while True:
+        orders = (Order.query.options(selectinload(Order.items))
+                  .filter(Order.summary.is_(None), Order.id > last_id)
+                  .order_by(Order.id).limit(batch_size).all())
+        if not orders:
+            return done
+        rows = [{"oid": o.id, "summary": order_summary(o.lines)} for o in orders]
+        last_id = orders[-1].id
+        db.session.execute(
+            update(Order.__table__).where(Order.__table__.c.id == bindparam("oid")).values(summary=bindparam("summary")),
+            rows,
+        )
+        db.session.commit()
+        done += len(rows)
+
+
+def init_orders(app):
+    @app.cli.command("backfill-order-summaries")
+    @click.option("--batch-size", default=500, show_default=True)
+    def backfill_order_summaries_command(batch_size):
+        """Snapshot the lines of orders placed before Order.summary existed."""
+        click.echo(f"wrote {backfill_summaries(batch_size)} order summary(ies)")
@@ -0,0 +1,32 @@
+"""
+Opaque cursors for keyset ("seek") pagination.
+
+A cursor is the sort key of the last row on a page, JSON encoded and made
+URL safe. The next page continues strictly after that key, so the database
+can seek straight to it through an index instead of skipping OFFSET rows.
+"""
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(*values):
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, *types):
+    """
+    Decode a cursor and coerce each value with the matching type
+    (e.g. decode_cursor(tok, datetime.fromisoformat, int)).
+    Returns None for anything malformed so a bad link just shows page one.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return tuple(t(v) for t, v in zip(types, values))
+    except Exception:
+        return None
@@ -0,0 +1,152 @@
+"""
+Password hashing off the request threads.
+
+PBKDF2 is deliberately slow. Run inline, a burst of logins keeps every
+worker thread busy hashing and browsing stalls behind it. Instead, hashes
+are computed in a small process pool per worker (PASSWORD_WORKERS
+processes, niced by PASSWORD_NICE so page rendering wins the CPU).
+
+Backpressure: at most PASSWORD_MAX_PENDING hashes may be running or queued
+per worker. A request that cannot get a slot within PASSWORD_QUEUE_TIMEOUT
+seconds gets HasherBusy, which the auth views turn into a 503 with
+Retry-After. A login storm therefore sheds the extra logins quickly and
+the rest of the site keeps serving.
+
+New hashes use PASSWORD_HASH_METHOD (default DEFAULT_METHOD, OWASP's
+current PBKDF2-SHA256 cost). A successful login whose stored hash uses an
+older method or cost than PASSWORD_HASH_METHOD is re-hashed in the same pool task, and the caller
+stores the new hash.
+
+If a pool process dies (OOM killer, a crash), the whole pool breaks. The
+pool is then replaced and the hash retried once.
+
+PASSWORD_WORKERS=0 hashes inline (tests, scripts, single-user setups).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# OWASP's Password Storage Cheat Sheet asks for 600,000 PBKDF2-HMAC-SHA256
+# iterations; Werkzeug 2.2 still defaults to 260,000. Existing hashes are
+# raised to this cost on their next successful login.
+DEFAULT_METHOD = "pbkdf2:sha256:600000"
+
+
+class HasherBusy(Exception):
+    """Too many password hashes are already running or queued."""
+
+
+def hash_method(pwhash):
+    """The method part of a Werkzeug hash, e.g. 'pbkdf2:sha256:260000'."""
+    return pwhash.split("$", 1)[0] if pwhash else ""
+
+
+def normalize_method(method):
+    """`method` as hash_method() reports it on the hashes it makes: 'pbkdf2:sha256' gains Werkzeug's default cost."""
+    parts = method.split(":")
+    if parts[0] == "pbkdf2" and len(parts) == 2:
+        return f"{method}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+# the functions below run in the pool processes
+
+def _lower_priority(nice):
+    if nice:
+        os.nice(nice)
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password, method):
+    """(matches, new hash if the stored one should be upgraded, else None)."""
+    if not pwhash or not check_password_hash(pwhash, password):
+        return False, None
+    if hash_method(pwhash) != method:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, workers=2, max_pending=16, queue_timeout=1.0, nice=5):
+        # forkserver: forking a threaded worker process directly is not safe
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._new_pool = lambda: ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                     initializer=_lower_priority, initargs=(nice,))
+        self._pool = self._new_pool()
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.queue_timeout = queue_timeout
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy("password hashing is saturated")
+        try:
+            pool = self._pool
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._replace(pool)
+                return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _replace(self, broken):
+        # every request that was using the broken pool lands here; only the first replaces it
+        with self._pool_lock:
+            if self._pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def init_passwords(app):
+    # normalised once, so verify_password() compares like with like
+    method = app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+    app.config["PASSWORD_HASH_METHOD"] = normalize_method(method)
+    app.extensions["passwords"] = {"hasher": None, "pid": None, "lock": threading.Lock()}
+
+
+def _hasher():
+    """The worker process's PasswordHasher (built lazily, so each forked worker owns its pool)."""
+    app = current_app._get_current_object()
+    state = app.extensions["passwords"]
+    with state["lock"]:
+        if state["hasher"] is None or state["pid"] != os.getpid():
+            cfg = app.config
+            state["hasher"] = PasswordHasher(
+                workers=cfg.get("PASSWORD_WORKERS", 2),
+                max_pending=cfg.get("PASSWORD_MAX_PENDING", 16),
+                queue_timeout=cfg.get("PASSWORD_QUEUE_TIMEOUT", 1.0),
+                nice=cfg.get("PASSWORD_NICE", 5),
+            )
+            state["pid"] = os.getpid()
+        return state["hasher"]
+
+
+def _run(fn, *args):
+    if not current_app.config.get("PASSWORD_WORKERS", 2):
+        return fn(*args)
+    return _hasher().run(fn, *args)
+
+
+def hash_password(password):
+    """A new hash with PASSWORD_HASH_METHOD. Raises HasherBusy."""
+    return _run(_hash, password, current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD))
+
+
+def verify_password(pwhash, password):
+    """
+    (matches, upgraded hash or None). Store the upgraded hash when one is
+    returned. Raises HasherBusy.
+    """
+    return _run(_verify, pwhash, password, current_app.config.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD))
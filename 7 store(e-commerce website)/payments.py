@@ -0,0 +1,192 @@
+"""
+Payment client: the only place the app talks to Stripe.
+
+Stripe calls go through one pooled keep-alive HTTP session per worker
+process with explicit connect/read timeouts. Network errors and 5xx/429
+answers are retried with Stripe's jittered exponential backoff (POSTs
+carry idempotency keys, so a retry never double-creates a session). A
+circuit breaker stops calling Stripe for a cool-down period after repeated
+failures, so a Stripe outage fails checkouts fast instead of tying up
+workers for the full timeout each time.
+
+Configuration is applied once, at client construction, and kept on the
+client: its own APIRequestor carries the key, API base, HTTP session and
+retry count. The stripe module globals (api_key, api_base,
+default_http_client, max_network_retries) are never touched, so other code
+using the library in the same process keeps its own settings. (The pinned
+stripe-python 5.x has no StripeClient; the requestor is what its resource
+classes use underneath.)
+
+The client makes plain blocking socket calls. Under the gevent worker
+profile (see gunicorn.conf.py) those sockets are cooperative: a request
+waiting on Stripe yields its worker to other requests, and a single worker
+can have as many checkouts in flight as STRIPE_POOL_SIZE connections.
+"""
+import os
+import threading
+import time
+from flask import current_app
+from metrics import record_stripe_time
+
+
+class PaymentError(Exception):
+    """Stripe could not be reached or answered with an error."""
+
+
+class CircuitOpenError(PaymentError):
+    """Stripe calls are suspended after repeated failures."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+    After `failure_threshold` consecutive failures, calls are rejected for
+    `reset_timeout` seconds, then a single trial call decides whether to close.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == "open" or (state == "half-open" and self._trial_in_flight):
+                raise CircuitOpenError("Payment provider temporarily unavailable")
+            if state == "half-open":
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a call that neither succeeded nor failed (e.g. it raised a non-Stripe error)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def _http_client(stripe, timeout, session, max_retries):
+    """A stripe RequestsClient with its own retry count instead of stripe.max_network_retries."""
+
+    class RequestsClient(stripe.http_client.RequestsClient):
+        def _max_network_retries(self):
+            return max_retries
+
+    return RequestsClient(timeout=timeout, session=session)
+
+
+class PaymentClient:
+    def __init__(self, api_key, api_base=None, connect_timeout=3.0, read_timeout=10.0,
+                 max_retries=2, pool_size=10, breaker=None):
+        import requests
+        import stripe
+        from requests.adapters import HTTPAdapter
+
+        self._stripe = stripe
+        self.api_key = api_key
+        self.breaker = breaker or CircuitBreaker()
+
+        http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        http.mount("https://", adapter)
+        http.mount("http://", adapter)
+
+        self._requestor = stripe.api_requestor.APIRequestor(
+            key=api_key,
+            api_base=api_base.rstrip("/") if api_base else None,
+            client=_http_client(stripe, (connect_timeout, read_timeout), http, max_retries),
+        )
+
+    def _call(self, method, path, params=None):
+        stripe = self._stripe
+        self.breaker.before_call()
+        start = time.perf_counter()
+        try:
+            response, api_key = self._requestor.request(method, path, params)
+        except (stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError) as e:
+            # transport failures and Stripe-side errors count against the breaker
+            self.breaker.record_failure()
+            raise PaymentError(str(e)) from e
+        except stripe.error.StripeError as e:
+            # a 4xx about our request: Stripe itself is healthy
+            self.breaker.record_success()
+            raise PaymentError(str(e)) from e
+        except BaseException:
+            # anything else (a bug, a gevent Timeout) must not leave a half-open breaker stuck
+            self.breaker.release_trial()
+            raise
+        finally:
+            record_stripe_time(time.perf_counter() - start)
+        self.breaker.record_success()
+        return stripe.util.convert_to_stripe_object(response, api_key)
+
+    def create_checkout_session(self, **params):
+        return self._call("post", "/v1/checkout/sessions", params)
+
+    def retrieve_checkout_session(self, session_id, **params):
+        return self._call("get", f"/v1/checkout/sessions/{self._stripe.util.sanitize_id(session_id)}", params)
+
+    def expire_checkout_session(self, session_id):
+        return self._call("post", f"/v1/checkout/sessions/{self._stripe.util.sanitize_id(session_id)}/expire")
+
+
+def cooperative_io():
+    """True when gevent has patched sockets in this process, so Stripe calls yield."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+def init_payments(app):
+    app.extensions["payments"] = {"client": None, "pid": None, "lock": threading.Lock()}
+
+
+def get_payment_client():
+    """The process-wide PaymentClient (built lazily, so each forked worker owns its pool)."""
+    app = current_app._get_current_object()
+    state = app.extensions["payments"]
+    with state["lock"]:
+        if state["client"] is None or state["pid"] != os.getpid():
+            cfg = app.config
+            state["client"] = PaymentClient(
+                api_key=cfg.get("STRIPE_SECRET_KEY"),
+                api_base=cfg.get("STRIPE_API_BASE") or None,
+                connect_timeout=cfg.get("STRIPE_CONNECT_TIMEOUT", 3.0),
+                read_timeout=cfg.get("STRIPE_READ_TIMEOUT", 10.0),
+                max_retries=cfg.get("STRIPE_MAX_RETRIES", 2),
+                pool_size=cfg.get("STRIPE_POOL_SIZE", 10),
+                breaker=CircuitBreaker(
+                    failure_threshold=cfg.get("STRIPE_BREAKER_THRESHOLD", 5),
+                    reset_timeout=cfg.get("STRIPE_BREAKER_RESET", 30.0),
+                ),
+            )
+            state["pid"] = os.getpid()
+        return state["client"]
@@ -0,0 +1,172 @@
+"""
+Reaper for abandoned checkouts.
+
+create_checkout_session inserts a pending order before sending the shopper
+to Stripe. If they never pay, the order stays pending forever.
+`flask reap-orders` finds pending orders older than ORDER_REAP_AGE seconds
+and settles each one against its Stripe Checkout session:
+
+- session still open   -> expire it on Stripe (so it can no longer be paid),
+                          then expire the order
+- session expired,     -> expire the order
+  unknown, or no session
+- session paid         -> mark the order paid (a missed webhook)
+- anything else        -> leave it pending for the next pass
+
+Expiring an order releases its held stock.
+
+Work is done in batches of --batch-size orders, in three phases:
+1. The batch is found with a range scan of ix_order_status_created on the
+   read-only engine when there is one, so the scan takes no write lock.
+2. Stripe is called with no transaction open, up to
+   REAPER_STRIPE_CONCURRENCY calls at a time.
+3. The outcomes are written in one short transaction. The UPDATE re-checks
+   status='pending', so an order paid in the meantime is left alone.
+
+Each batch logs its rows per second and adds to the
+store_reaper_orders_total / store_reaper_seconds_total counters on
+/admin/metrics.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import select, tuple_, update
+from database import READER
+from metrics import record_reaper_batch
+from models import db, Order
+from inventory import release_reservations
+from orders import mark_orders_paid
+from payments import CircuitOpenError, PaymentError, get_payment_client
+
+OUTCOMES = ("expired", "paid", "skipped")
+
+
+def _stale_orders(cutoff, after, batch_size):
+    """(id, created_at, stripe_session_id) of the next batch of stale pending orders."""
+    engine = db.engines.get(READER, db.engine)
+    query = (select(Order.id, Order.created_at, Order.stripe_session_id)
+             .where(Order.status == "pending", Order.created_at < cutoff)
+             .order_by(Order.created_at, Order.id)
+             .limit(batch_size))
+    if after:
+        query = query.where(tuple_(Order.created_at, Order.id) > after)
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def _settle(client, session_id):
+    """('expired' | 'paid' | 'skipped', payment intent) for one order's Checkout session."""
+    if not session_id:
+        return "expired", None  # the Stripe session was never created
+    try:
+        session = client.retrieve_checkout_session(session_id)
+        if session.get("payment_status") in ("paid", "no_payment_required"):
+            intent = session.get("payment_intent")
+            return "paid", intent.get("id") if isinstance(intent, dict) else intent
+        if session.get("status") == "open":
+            session = client.expire_checkout_session(session_id)
+        return ("expired", None) if session.get("status") == "expired" else ("skipped", None)
+    except CircuitOpenError:
+        raise
+    except PaymentError as e:
+        if getattr(e.__cause__, "http_status", None) == 404:
+            return "expired", None  # Stripe no longer knows the session
+        current_app.logger.warning("Could not settle Checkout session %s: %s", session_id, e)
+        return "skipped", None
+
+
+def reap_batch(cutoff, after=None, batch_size=200):
+    """
+    Settle one batch of stale pending orders. Returns ({outcome: count},
+    keyset position to continue after, or None when no stale orders remain).
+    """
+    rows = _stale_orders(cutoff, after, batch_size)
+    counts = dict.fromkeys(OUTCOMES, 0)
+    if not rows:
+        return counts, None
+
+    client = get_payment_client()
+    app = current_app._get_current_object()
+
+    def settle(session_id):
+        with app.app_context():
+            return _settle(client, session_id)
+
+    workers = max(1, current_app.config.get("REAPER_STRIPE_CONCURRENCY", 8))
+    with ThreadPoolExecutor(max_workers=min(workers, len(rows))) as pool:
+        results = list(pool.map(settle, [row.stripe_session_id for row in rows]))
+
+    expire = [row.id for row, (outcome, _) in zip(rows, results) if outcome == "expired"]
+    paid = {row.id: intent for row, (outcome, intent) in zip(rows, results) if outcome == "paid"}
+    if paid:
+        counts["paid"] = len(mark_orders_paid(paid))
+    if expire:
+        expired = db.session.execute(
+            update(Order)
+            .where(Order.id.in_(expire), Order.status == "pending")
+            .values(status="expired")
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        release_reservations(expired)
+        counts["expired"] = len(expired)
+    db.session.commit()
+    counts["skipped"] = len(rows) - counts["paid"] - counts["expired"]
+    return counts, (rows[-1].created_at, rows[-1].id)
+
+
+def run_reaper(batch_size=200, poll_interval=300.0, once=False, max_age=None):
+    """Reap stale pending orders until none are left (once=True) or forever. Returns the totals."""
+    totals = dict.fromkeys(OUTCOMES, 0)
+    max_age = max_age if max_age is not None else current_app.config.get("ORDER_REAP_AGE", 7200)
+    after = None
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    while True:
+        started = time.perf_counter()
+        try:
+            counts, after = reap_batch(cutoff, after, batch_size)
+        except CircuitOpenError:
+            # Stripe is unavailable: nothing can be verified, so wait and start over
+            db.session.rollback()
+            if once:
+                raise
+            current_app.logger.warning("Order reaper paused: payment provider unavailable")
+            counts, after = dict.fromkeys(OUTCOMES, 0), None
+        except Exception:
+            db.session.rollback()
+            if once:
+                raise
+            current_app.logger.exception("Order reaper batch failed; retrying")
+            counts, after = dict.fromkeys(OUTCOMES, 0), None
+        elapsed = time.perf_counter() - started
+        processed = sum(counts.values())
+        if processed:
+            record_reaper_batch(counts, elapsed)
+            current_app.logger.info("Reaped %d stale order(s) in %.2fs (%.0f rows/s): %s", processed, elapsed,
+                                    processed / elapsed if elapsed else 0.0,
+                                    ", ".join(f"{n} {k}" for k, n in counts.items() if n))
+            for key in OUTCOMES:
+                totals[key] += counts[key]
+        if after is None:
+            if once:
+                return totals
+            time.sleep(poll_interval)
+            cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+
+
+def init_reaper(app):
+    @app.cli.command("reap-orders")
+    @click.option("--batch-size", default=200, show_default=True)
+    @click.option("--interval", default=300.0, show_default=True, help="Seconds between passes.")
+    @click.option("--once", is_flag=True, help="Exit after one pass over the stale orders.")
+    @click.option("--max-age", type=int, default=None, help="Seconds; default ORDER_REAP_AGE.")
+    def reap_orders_command(batch_size, interval, once, max_age):
+        """Expire (or mark paid) pending orders whose checkout was abandoned."""
+        started = time.perf_counter()
+        totals = run_reaper(batch_size=batch_size, poll_interval=interval, once=once, max_age=max_age)
+        elapsed = time.perf_counter() - started
+        processed = sum(totals.values())
+        click.echo(f"reaped {processed} order(s) in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} rows/s): "
+                   + ", ".join(f"{totals[k]} {k}" for k in OUTCOMES))
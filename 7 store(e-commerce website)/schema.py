@@ -0,0 +1,78 @@
+"""
+Database schema setup: ORM tables plus the SQLite-specific objects
+(the FTS index and its triggers, the cart counter triggers) that db.create_all() does not know about.
+
+It runs once per deploy, before the workers start: `flask init-db`. The
+Docker image does this before gunicorn. The dev server (python app.py)
+runs it on startup. Workers never check the schema.
+
+db.create_all() only creates missing tables, so columns and indexes added
+to a model later are created here for databases that already exist. New
+columns must be nullable (or carry a server default) for this to work.
+"""
+import click
+from models import db
+
+# indexes replaced by wider ones; dropped from existing databases
+SUPERSEDED_INDEXES = (
+    "ix_product_seller_id",  # by ix_product_seller_created
+)
+
+
+def init_schema():
+    from search import init_search_index
+    from cart import init_cart_store
+    from browse import init_browse_facets
+
+    db.create_all()
+    _add_missing_columns()
+    _create_missing_indexes()
+    init_search_index()
+    init_cart_store()
+    init_browse_facets()
+
+
+def _add_missing_columns():
+    # inspect first: the inspector opens its own connections, which must not
+    # wait on the write transaction below
+    inspector = db.inspect(db.engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        missing.extend((table, column) for column in table.columns if column.name not in existing)
+    if not missing:
+        return
+    with db.engine.begin() as conn:
+        for table, column in missing:
+            ddl = column.type.compile(dialect=db.engine.dialect)
+            default = column.server_default.arg if column.server_default is not None else None
+            conn.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {ddl}'
+                + (f" DEFAULT {default}" if default is not None else "")
+            )
+
+
+def _create_missing_indexes():
+    with db.engine.begin() as conn:
+        for name in SUPERSEDED_INDEXES:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def init_schema_commands(app):
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create missing tables, columns, indexes and triggers, and backfill order snapshots."""
+        from orders import backfill_summaries
+        from analytics import backfill_item_sellers
+
+        init_schema()
+        click.echo("database schema is up to date")
+        done = backfill_summaries()
+        if done:
+            click.echo(f"wrote {done} order summary(ies)")
+        done = backfill_item_sellers()
+        if done:
+            click.echo(f"recorded the seller on {done} order item(s)")
@@ -0,0 +1,132 @@
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+`product_fts` is an external-content FTS5 table over product.name and
+product.description. Triggers on the product table keep it in sync, so every
+write path (seller CRUD, admin delete, scripts) updates the index without
+having to remember to call anything.
+"""
+import re
+from sqlalchemy import text
+from models import db, Product
+from pagination import encode_cursor, decode_cursor
+
+# bm25 column weights: a hit in the name counts far more than one in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO product_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+def init_search_index():
+    """Create the FTS table and sync triggers; build the index if it is new."""
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='product_fts'")
+    ).first()
+    for stmt in _SCHEMA:
+        db.session.execute(text(stmt))
+    if not exists:
+        rebuild_search_index()
+    db.session.commit()
+
+
+def rebuild_search_index():
+    """Re-read every product into the index (after bulk loads or a restore)."""
+    db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+
+def tokenize(text):
+    """Lowercase words of `text`, split the way build_match_query splits a query."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 MATCH expression.
+    Every word must match and the last one is treated as a prefix,
+    so "wire head" finds "Wireless Headphones".
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    terms = [f'"{t}"' for t in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return " ".join(terms)
+
+
+_SEARCH_SQL = text(f"""
+    SELECT rowid, score FROM (
+        SELECT rowid, bm25(product_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS score
+        FROM product_fts WHERE product_fts MATCH :match
+    )
+    WHERE :after_score IS NULL OR score > :after_score OR (score = :after_score AND rowid > :after_id)
+    ORDER BY score, rowid
+    LIMIT :limit
+""")
+
+
+def search_products(query, cursor=None, per_page=24):
+    """
+    Return (products, next_cursor) for one page of ranked results.
+    Pages are keyed on (score, id) rather than OFFSET, so a page never
+    re-reads the products of earlier pages. SQLite still scores and sorts
+    every match on every page, so a page's cost grows with the number of
+    matches, not with its depth.
+    """
+    match = build_match_query(query)
+    if not match:
+        return [], None
+
+    after_score, after_id = None, None
+    if cursor:
+        decoded = decode_cursor(cursor, float, int)
+        if decoded:
+            after_score, after_id = decoded
+
+    rows = db.session.execute(_SEARCH_SQL, {
+        "match": match,
+        "after_score": after_score,
+        "after_id": after_id,
+        "limit": per_page + 1,
+    }).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].score, rows[-1].rowid)
+
+    ids = [r.rowid for r in rows]
+    by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+    products = [by_id[i] for i in ids if i in by_id]
+    return products, next_cursor
@@ -5,13 +5,14 @@ Run: python seed_data.py
 """
 from app import create_app
 from models import db, User, SellerProfile, Product
+from schema import init_schema
 import os
 
 app = create_app()
 app.app_context().push()
 
 def seed():
-    db.create_all()
+    init_schema()
 
     # Admin user
     if not User.query.filter_by(username="admin").first():
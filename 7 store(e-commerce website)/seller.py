@@ -1,8 +1,11 @@
-import os, uuid
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import db, Product
-from werkzeug.utils import secure_filename
+from catalog import product_changed
+from images import schedule_derivatives
+from storage import save_upload
+from catalog_io import import_catalog, export_catalog, detect_format, FORMATS
+from analytics import seller_summary
 
 seller_bp = Blueprint("seller", __name__, template_folder="templates", url_prefix="/seller")
 
@@ -17,16 +20,16 @@ def allowed_file(filename):
 def dashboard():
     if not current_user.is_seller and not current_user.is_admin:
         flash("Seller access required.", "warning")
-        return redirect(url_for("index"))
+        return redirect(url_for("shop.home"))
     products = Product.query.filter_by(seller_id=current_user.id).all()
-    return render_template("seller_dashboard.html", products=products)
+    return render_template("seller_dashboard.html", products=products, sales=seller_summary(current_user.id))
 
 @seller_bp.route("/product/new", methods=["GET","POST"])
 @login_required
 def product_new():
     if not current_user.is_seller and not current_user.is_admin:
         flash("Seller access required.", "warning")
-        return redirect(url_for("index"))
+        return redirect(url_for("shop.home"))
     if request.method == "POST":
         name = request.form.get("name")
         slug = request.form.get("slug") or (name.lower().replace(" ", "-"))
@@ -36,15 +39,13 @@ def product_new():
         image = request.files.get("image")
         image_filename = None
         if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            unique = f"{uuid.uuid4().hex}_{filename}"
-            upload_folder = current_app.config.get("UPLOAD_FOLDER", "static/images")
-            os.makedirs(upload_folder, exist_ok=True)
-            image.save(os.path.join(upload_folder, unique))
-            image_filename = unique
+            image_filename = save_upload(image)
         p = Product(seller_id=current_user.id, name=name, slug=slug, description=description, price=price, stock=stock, image_filename=image_filename)
         db.session.add(p)
         db.session.commit()
+        product_changed(p.slug)
+        if image_filename:
+            schedule_derivatives(image_filename, p.slug)
         flash("Product created.", "success")
         return redirect(url_for("seller.dashboard"))
     return render_template("seller_product_form.html", product=None)
@@ -57,20 +58,20 @@ def product_edit(pid):
         flash("Not authorized.", "danger")
         return redirect(url_for("seller.dashboard"))
     if request.method == "POST":
+        old_slug = p.slug
         p.name = request.form.get("name")
         p.slug = request.form.get("slug") or p.slug
         p.description = request.form.get("description")
         p.price = float(request.form.get("price") or p.price)
         p.stock = int(request.form.get("stock") or p.stock)
         image = request.files.get("image")
+        new_image = None
         if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            unique = f"{uuid.uuid4().hex}_{filename}"
-            upload_folder = current_app.config.get("UPLOAD_FOLDER", "static/images")
-            os.makedirs(upload_folder, exist_ok=True)
-            image.save(os.path.join(upload_folder, unique))
-            p.image_filename = unique
+            p.image_filename = new_image = save_upload(image)
         db.session.commit()
+        product_changed(old_slug, p.slug)
+        if new_image:
+            schedule_derivatives(new_image, p.slug)
         flash("Product updated.", "success")
         return redirect(url_for("seller.dashboard"))
     return render_template("seller_product_form.html", product=p)
@@ -84,5 +85,46 @@ def product_delete(pid):
         return redirect(url_for("seller.dashboard"))
     db.session.delete(p)
     db.session.commit()
+    product_changed(p.slug)
     flash("Product deleted.", "info")
     return redirect(url_for("seller.dashboard"))
+
+@seller_bp.route("/import", methods=["GET", "POST"])
+@login_required
+def catalog_import():
+    if not current_user.is_seller and not current_user.is_admin:
+        flash("Seller access required.", "warning")
+        return redirect(url_for("shop.home"))
+    result = None
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV or JSONL file to import.", "warning")
+            return redirect(url_for("seller.catalog_import"))
+        fmt = request.form.get("format") or detect_format(upload.filename)
+        if fmt not in FORMATS:
+            flash("Unsupported file format.", "warning")
+            return redirect(url_for("seller.catalog_import"))
+        # the upload is read as a stream (werkzeug spools large files to disk)
+        result = import_catalog(upload.stream, current_user.id, fmt,
+                                batch_size=current_app.config.get("CATALOG_IMPORT_BATCH_SIZE", 1000),
+                                dry_run=bool(request.form.get("dry_run")))
+        flash(f"{result.created} new, {result.updated} updated, {result.failed} failed.",
+              "success" if not result.failed else "warning")
+    return render_template("seller_import.html", result=result)
+
+@seller_bp.route("/export")
+@login_required
+def catalog_export():
+    if not current_user.is_seller and not current_user.is_admin:
+        flash("Seller access required.", "warning")
+        return redirect(url_for("shop.home"))
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        fmt = "csv"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(export_catalog(current_user.id, fmt)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=catalog-{current_user.id}.{fmt}"},
+    )
@@ -1,24 +1,60 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
 from models import Product, Order, OrderItem, db, Address
 from flask_login import login_required, current_user
-from sqlalchemy import or_
-import stripe
+import time
 from datetime import datetime
+from sqlalchemy import insert, tuple_, update
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
+from search import search_products
+from autocomplete import record_search, suggest
+from browse import BrowseFilters, SORTS, browse_products, facets_html
+from cart import get_cart, add_item, set_quantities, clear_cart
+from pagination import encode_cursor, decode_cursor
+from cache import cached_fragment, csrf_placeholder
+from catalog import HOME_KEY, catalog_version, product_cache_key
+from conditional import not_modified
+from orders import mark_orders_paid, order_summary
+from payments import get_payment_client, PaymentError
+from inventory import checkout_ttl, reserve_stock, release_reservations, OutOfStock
 
 shop_bp = Blueprint("shop", __name__)
 
 
 @shop_bp.route("/")
 def home():
-    products = Product.query.order_by(Product.created_at.desc()).limit(24).all()
-    return render_template("index.html", products=products)
+    cached = not_modified(f"home:{catalog_version()}")
+    if cached:
+        return cached
+
+    def build():
+        products = Product.query.order_by(Product.created_at.desc()).limit(24).all()
+        return render_template("_product_grid.html", products=products, csrf_token=csrf_placeholder), {}
+
+    products_html, _ = cached_fragment(HOME_KEY, build)
+    return render_template("index.html", products_html=products_html)
 
 
 @shop_bp.route("/product/<slug>")
 def product_detail(slug):
-    product = Product.query.filter_by(slug=slug).first_or_404()
-    return render_template("product.html", product=product)
+    changed = db.session.execute(
+        db.select(db.func.coalesce(Product.updated_at, Product.created_at)).where(Product.slug == slug)
+    ).scalar()
+    if changed:
+        cached = not_modified(f"product:{slug}:{changed.isoformat()}", last_modified=changed)
+        if cached:
+            return cached
+
+    def build():
+        product = Product.query.filter_by(slug=slug).first_or_404()
+        html = render_template("_product_detail.html", product=product, csrf_token=csrf_placeholder)
+        return html, {"title": product.name}
+
+    if changed is None:
+        product_html, meta = build()  # no such product (404), or no timestamps to key a fragment by
+    else:
+        product_html, meta = cached_fragment(product_cache_key(slug, changed), build)
+    return render_template("product.html", product_html=product_html, title=meta["title"])
 
 
 # Add to cart — require login first
@@ -38,29 +74,19 @@ def add_to_cart(product_id):
     if qty < 1:
         qty = 1
 
-    cart = session.get("cart", {}) or {}
-    cart[str(product_id)] = cart.get(str(product_id), 0) + qty
-    session["cart"] = cart
+    add_item(product_id, qty)
     flash("Added to cart!", "success")
     return redirect(request.referrer or url_for("shop.cart_view"))
 
 
 @shop_bp.route("/cart")
 def cart_view():
-    cart = session.get("cart", {}) or {}
-    items = []
-    total = 0.0
-    for pid, qty in cart.items():
-        product = Product.query.get(int(pid))
-        if product:
-            items.append({"product": product, "qty": int(qty)})
-            total += product.price * int(qty)
-    return render_template("cart.html", items=items, total=total)
+    cart = get_cart()
+    return render_template("cart.html", items=cart.lines, total=cart.total)
 
 
 @shop_bp.route("/cart/update", methods=["POST"])
 def update_cart():
-    cart = session.get("cart", {}) or {}
     new_cart = {}
     qty_fields_present = False
     for key, val in request.form.items():
@@ -72,10 +98,10 @@ def update_cart():
             q = int(val)
         except Exception:
             continue
-        if q > 0:
-            new_cart[str(pid)] = q
+        if q > 0 and pid.isdigit():
+            new_cart[int(pid)] = q
     if qty_fields_present:
-        session["cart"] = new_cart
+        set_quantities(new_cart)
     # otherwise keep existing
     flash("Cart updated.", "success")
     return redirect(url_for("shop.cart_view"))
@@ -84,14 +110,7 @@ def update_cart():
 @shop_bp.route("/checkout")
 @login_required
 def checkout():
-    cart = session.get("cart", {}) or {}
-    items = []
-    total = 0.0
-    for pid, qty in cart.items():
-        product = Product.query.get(int(pid))
-        if product:
-            items.append({"product": product, "qty": int(qty)})
-            total += product.price * int(qty)
+    cart = get_cart()
 
     # If address was saved to session, we can fetch it for display
     address = None
@@ -99,13 +118,7 @@ def checkout():
     if address_id:
         address = Address.query.get(address_id)
 
-    return render_template("checkout.html", items=items, total=total, address=address)
-
-
-# Ensure stripe is configured each request
-def _stripe_client():
-    stripe.api_key = current_app.config.get("STRIPE_SECRET_KEY")
-    return stripe
+    return render_template("checkout.html", items=cart.lines, total=cart.total, address=address)
 
 
 @shop_bp.route("/create-checkout-session", methods=["POST"])
@@ -115,7 +128,7 @@ def create_checkout_session():
     Creates a Stripe Checkout session and creates an Order in the DB (status='pending').
     The user is then redirected to stripe checkout.
     """
-    cart = session.get("cart", {}) or {}
+    cart = get_cart()
     if not cart:
         flash("Your cart is empty.", "warning")
         return redirect(url_for("shop.cart_view"))
@@ -125,14 +138,15 @@ def create_checkout_session():
     order = Order(user_id=current_user.id, status="pending", total_amount=0.0, created_at=datetime.utcnow())
     db.session.add(order)
     db.session.flush()  # so order.id exists
+    # kept so building the Stripe call after the commit below needs no reload
+    # (which would hold a database connection for the whole Stripe round trip)
+    order_id = order.id
 
-    total = 0.0
     try:
-        for pid, qty in cart.items():
-            product = Product.query.get(int(pid))
-            if not product:
-                continue
-
+        lines = []
+        sellers = {}
+        for line in cart.lines:
+            product, qty = line.product, int(line.qty)
             unit_price_paisa = int(round(product.price * 100))  # rupees -> paise
             stripe_items.append({
                 "price_data": {
@@ -140,64 +154,30 @@ def create_checkout_session():
                     "product_data": {"name": product.name, "description": product.description or ""},
                     "unit_amount": unit_price_paisa,
                 },
-                "quantity": int(qty),
+                "quantity": qty,
             })
-
-            # ------------------------------
-            # Robust ORDER ITEM CREATION
-            # ------------------------------
-            oi = OrderItem()  # create empty instance, set attributes manually
-            cols = {c.name for c in getattr(OrderItem, "__table__").columns}
-
-            # assign order foreign key
-            if "order_id" in cols:
-                setattr(oi, "order_id", order.id)
-            elif "order" in cols:
-                setattr(oi, "order", order.id)
-
-            # assign product foreign key
-            if "product_id" in cols:
-                setattr(oi, "product_id", product.id)
-            elif "prod_id" in cols:
-                setattr(oi, "prod_id", product.id)
-
-            # ensure product_name (or equivalent) is set for NOT NULL schemas
-            if "product_name" in cols:
-                setattr(oi, "product_name", product.name)
-            elif "name" in cols:
-                setattr(oi, "name", product.name)
-            elif "title" in cols:
-                setattr(oi, "title", product.name)
-
-            # assign quantity using common column names
-            qty_int = int(qty)
-            for qname in ("quantity", "qty", "count", "amount", "qty_ordered", "quantity_ordered"):
-                if qname in cols:
-                    setattr(oi, qname, qty_int)
-                    break
-            else:
-                # fallback: set 'quantity' if present, otherwise set 'qty' attribute for inspection
-                if "quantity" in cols:
-                    setattr(oi, "quantity", qty_int)
-                else:
-                    setattr(oi, "qty", qty_int)
-
-            # assign unit/price using common column names
-            for pname in ("unit_price", "price", "unit_amount", "amount", "item_price"):
-                if pname in cols:
-                    setattr(oi, pname, float(product.price))
-                    break
-            else:
-                # fallback attribute
-                setattr(oi, "unit_price", float(product.price))
-
-            db.session.add(oi)
-            total += product.price * qty_int
-
-        # set order total
-        order.total_amount = total
+            lines.append((product.id, product.name, qty, float(product.price)))
+            sellers[product.id] = product.seller_id or 0
+        # one executemany: ORM-added items would each be flushed with their own INSERT ... RETURNING
+        db.session.execute(insert(OrderItem), [
+            {"order_id": order_id, "product_id": pid, "product_name": name, "quantity": qty,
+             "unit_price": price, "seller_id": sellers[pid]}
+            for pid, name, qty, price in lines
+        ])
+
+        # the snapshot every order page renders from
+        order.summary = order_summary(lines)
+        order.total_amount = order.summary["total"]
+
+        # take the stock (one conditional UPDATE); fails without overselling if any line is short
+        reserve_stock(order_id, {line.product.id: line.qty for line in cart.lines})
         db.session.commit()
 
+    except OutOfStock as e:
+        db.session.rollback()
+        names = ", ".join(line.product.name for line in cart.lines if line.product.id in e.product_ids)
+        flash(f"Not enough stock left for: {names}. Please update your cart.", "warning")
+        return redirect(url_for("shop.cart_view"))
     except IntegrityError as e:
         db.session.rollback()
         current_app.logger.error("DB IntegrityError creating order/items: %s", e)
@@ -210,22 +190,31 @@ def create_checkout_session():
         return redirect(url_for("shop.cart_view"))
 
     # Create Stripe Checkout session
-    stripe_client = _stripe_client()
     domain = current_app.config.get("DOMAIN_URL", request.host_url.rstrip("/"))
+    # counted from now, as Stripe does; the stock stays held RESERVATION_GRACE longer
+    expires_at = int(time.time()) + checkout_ttl()
     try:
-        session_obj = stripe_client.checkout.Session.create(
+        session_obj = get_payment_client().create_checkout_session(
             payment_method_types=["card"],
             line_items=stripe_items,
             mode="payment",
-            success_url=f"{domain}/stripe/success?session_id={{CHECKOUT_SESSION_ID}}&order_id={order.id}",
+            success_url=f"{domain}/stripe/success?session_id={{CHECKOUT_SESSION_ID}}&order_id={order_id}",
             cancel_url=f"{domain}/checkout",
-            metadata={"order_id": str(order.id)},
+            metadata={"order_id": str(order_id)},
+            expires_at=expires_at,
         )
-    except Exception as e:
+    except PaymentError as e:
         current_app.logger.error("Stripe session error: %s", e)
+        # this order can never be paid: give its stock back straight away
+        release_reservations([order_id])
+        order.status = "cancelled"
+        db.session.commit()
         flash("Payment initialization failed.", "danger")
         return redirect(url_for("shop.checkout"))
 
+    db.session.execute(update(Order).where(Order.id == order_id).values(stripe_session_id=session_obj.id))
+    db.session.commit()
+
     # Redirect user to Stripe Checkout
     return redirect(session_obj.url, code=303)
 
@@ -233,22 +222,61 @@ def create_checkout_session():
 @shop_bp.route("/orders")
 @login_required
 def my_orders():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template("orders.html", orders=orders)
+    per_page = current_app.config.get("ORDERS_PER_PAGE", 20)
+    q = (Order.query
+         .filter(Order.user_id == current_user.id)
+         .order_by(Order.created_at.desc(), Order.id.desc()))
+
+    # keyset pagination on (created_at, id), served by ix_order_user_created
+    before = request.args.get("before")
+    key = decode_cursor(before, datetime.fromisoformat, int) if before else None
+    if key:
+        q = q.filter(tuple_(Order.created_at, Order.id) < key)
+
+    orders = q.limit(per_page + 1).all()
+    next_cursor = None
+    if len(orders) > per_page:
+        orders = orders[:per_page]
+        next_cursor = encode_cursor(orders[-1].created_at, orders[-1].id)
+    # orders placed before summaries existed render from their items: load those in one query
+    unsummarised = {o.id: [] for o in orders if o.summary is None}
+    if unsummarised:
+        for item in OrderItem.query.filter(OrderItem.order_id.in_(unsummarised)).order_by(OrderItem.id):
+            unsummarised[item.order_id].append(item)
+        for o in orders:
+            if o.id in unsummarised:
+                set_committed_value(o, "items", unsummarised[o.id])
+    return render_template("orders.html", orders=orders, next_cursor=next_cursor, paged=bool(key))
 
 
 @shop_bp.route("/search")
 def search():
     query = request.args.get("q", "").strip()
     if not query:
-        return render_template("search_results.html", products=[], query=query)
-    products = Product.query.filter(
-        or_(
-            Product.name.ilike(f"%{query}%"),
-            Product.description.ilike(f"%{query}%")
-        )
-    ).all()
-    return render_template("search_results.html", products=products, query=query)
+        return render_template("search_results.html", products=[], query=query, next_cursor=None)
+    per_page = current_app.config.get("SEARCH_PER_PAGE", 24)
+    products, next_cursor = search_products(query, cursor=request.args.get("after"), per_page=per_page)
+    if products and not request.args.get("after"):
+        record_search(query)  # popular queries feed the search box suggestions
+    return render_template("search_results.html", products=products, query=query, next_cursor=next_cursor)
+
+
+@shop_bp.route("/search/suggest")
+def search_suggest():
+    response = jsonify(suggest(request.args.get("q", "")[:200]))
+    # the same for every visitor; a short lifetime keeps new products showing up
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response
+
+
+@shop_bp.route("/browse")
+def browse():
+    filters = BrowseFilters.from_args(request.args)
+    per_page = current_app.config.get("BROWSE_PER_PAGE", 24)
+    products, next_cursor = browse_products(filters, cursor=request.args.get("after"), per_page=per_page)
+    return render_template("browse.html", products=products, next_cursor=next_cursor, filters=filters,
+                           facets_html=facets_html(filters), sorts=SORTS)
 
 
 # Shipping address page
@@ -283,7 +311,7 @@ def stripe_success():
     """
     Handle redirect from Stripe Checkout after payment.
     Verify the session with Stripe, update the Order if needed,
-    clear the session cart, and prepare a safe items list for the template.
+    clear the cart, and show the order (from its summary snapshot).
     """
     session_id = request.args.get("session_id")
     order_id = request.args.get("order_id")
@@ -292,10 +320,9 @@ def stripe_success():
         flash("Missing payment information.", "warning")
         return redirect(url_for("shop.home"))
 
-    stripe_client = _stripe_client()
     try:
-        stripe_session = stripe_client.checkout.Session.retrieve(session_id, expand=["payment_intent"])
-    except Exception as e:
+        stripe_session = get_payment_client().retrieve_checkout_session(session_id, expand=["payment_intent"])
+    except PaymentError as e:
         current_app.logger.exception("Failed to retrieve stripe session: %s", e)
         flash("Could not confirm payment with Stripe. If you were charged, check Orders later.", "warning")
         return redirect(url_for("shop.my_orders"))
@@ -309,62 +336,21 @@ def stripe_success():
         flash("Order not found.", "warning")
         return redirect(url_for("shop.home"))
 
-    # If Stripe says the payment is paid, update order status
+    # If Stripe says the payment is paid, update order status (no-op if the webhook got there first)
     if isinstance(payment_status, str) and payment_status.lower() == "paid":
         if order.status != "paid":
-            order.status = "paid"
-            try:
-                order.payment_intent = payment_intent
-            except Exception:
-                pass
+            if isinstance(payment_intent, dict):
+                payment_intent = payment_intent.get("id")
+            mark_orders_paid({order.id: payment_intent})
             db.session.commit()
 
-        # Clear session cart (user returned and payment completed)
-        session.pop("cart", None)
+        # Clear the cart (user returned and payment completed)
+        clear_cart()
     else:
         # Not 'paid' yet — rely on webhook to update order later, but continue to show a page
         flash("Payment is processing. If it was successful it will appear in your Orders soon.", "info")
 
-    # Build a safe items list for the template (normalize different column names)
-    items_info = []
-    for it in getattr(order, "items", []) or []:
-        # quantity field (try common names)
-        qty = None
-        for qname in ("quantity", "qty", "count", "amount", "qty_ordered", "quantity_ordered"):
-            qty = getattr(it, qname, None)
-            if qty is not None:
-                break
-        if qty is None:
-            qty = 1
-
-        # unit price field
-        unit_price = None
-        for pname in ("unit_price", "price", "unit_amount", "amount", "item_price"):
-            unit_price = getattr(it, pname, None)
-            if unit_price is not None:
-                break
-        if unit_price is None:
-            unit_price = 0.0
-
-        # product name
-        product_name = getattr(it, "product_name", None)
-        if not product_name:
-            # try to obtain from relationship
-            try:
-                product_obj = getattr(it, "product", None)
-                product_name = getattr(product_obj, "name", None) if product_obj else None
-            except Exception:
-                product_name = None
-        if not product_name:
-            product_name = "Item"
-
-        items_info.append({
-            "quantity": int(qty),
-            "unit_price": float(unit_price),
-            "product_name": product_name
-        })
-
-    return render_template("payment_success.html", order=order, items_info=items_info)
+    return render_template("payment_success.html", order=order)
 
 @shop_bp.route("/order/<int:oid>")
 @login_required
@@ -377,40 +363,5 @@ def order_detail(oid):
         flash("Access denied.", "warning")
         return redirect(url_for("shop.my_orders"))
 
-    # normalize items for display (safe attribute names)
-    items_info = []
-    for it in getattr(o, "items", []) or []:
-        # quantity
-        qty = None
-        for qname in ("quantity", "qty", "count", "amount", "qty_ordered"):
-            qty = getattr(it, qname, None)
-            if qty is not None:
-                break
-        if qty is None:
-            qty = 1
-
-        # unit price
-        unit_price = None
-        for pname in ("unit_price", "price", "unit_amount", "amount", "item_price"):
-            unit_price = getattr(it, pname, None)
-            if unit_price is not None:
-                break
-        if unit_price is None:
-            unit_price = 0.0
-
-        # product name
-        product_name = getattr(it, "product_name", None)
-        if not product_name:
-            product_obj = getattr(it, "product", None)
-            product_name = getattr(product_obj, "name", None) if product_obj else None
-        if not product_name:
-            product_name = "Item"
-
-        items_info.append({
-            "quantity": int(qty),
-            "unit_price": float(unit_price),
-            "product_name": product_name
-        })
-
-    return render_template("order_detail.html", order=o, items_info=items_info)
+    return render_template("order_detail.html", order=o)
 
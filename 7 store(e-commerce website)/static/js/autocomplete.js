@@ -0,0 +1,106 @@
+/* Header search box suggestions, from /search/suggest (see autocomplete.py). */
+(function () {
+  "use strict";
+
+  var input = document.querySelector("input[data-suggest-url]");
+  var menu = document.getElementById("search-suggestions");
+  if (!input || !menu) return;
+
+  var url = input.getAttribute("data-suggest-url");
+  var cache = new Map();   // typed text -> response, for backspacing and retyping
+  var pending = null;      // AbortController of the request in flight
+  var timer = null;
+  var active = -1;
+  var price = new Intl.NumberFormat("en-IN", { style: "currency", currency: "INR" });
+
+  function items() {
+    return menu.querySelectorAll(".dropdown-item");
+  }
+
+  function close() {
+    menu.classList.remove("show");
+    input.setAttribute("aria-expanded", "false");
+    active = -1;
+  }
+
+  function item(href, label, detail) {
+    var a = document.createElement("a");
+    a.className = "dropdown-item";
+    a.href = href;
+    a.setAttribute("role", "option");
+    var text = document.createElement("span");
+    text.textContent = label;
+    a.appendChild(text);
+    if (detail) {
+      var small = document.createElement("span");
+      small.className = "suggestion-price";
+      small.textContent = detail;
+      a.appendChild(small);
+    }
+    return a;
+  }
+
+  function render(data) {
+    menu.textContent = "";
+    var searchUrl = input.form.getAttribute("action");
+    data.queries.forEach(function (q) {
+      menu.appendChild(item(searchUrl + "?q=" + encodeURIComponent(q), q));
+    });
+    if (data.queries.length && data.products.length) {
+      var divider = document.createElement("div");
+      divider.className = "dropdown-divider";
+      menu.appendChild(divider);
+    }
+    data.products.forEach(function (p) {
+      menu.appendChild(item(p.url, p.name, price.format(p.price)));
+    });
+    active = -1;
+    var open = menu.children.length > 0;
+    menu.classList.toggle("show", open);
+    input.setAttribute("aria-expanded", open ? "true" : "false");
+  }
+
+  function fetchSuggestions() {
+    var q = input.value.trim();
+    if (!q) return close();
+    if (cache.has(q)) return render(cache.get(q));
+    if (pending) pending.abort();
+    pending = new AbortController();
+    fetch(url + "?q=" + encodeURIComponent(q), { signal: pending.signal, headers: { Accept: "application/json" } })
+      .then(function (r) { return r.ok ? r.json() : null; })
+      .then(function (data) {
+        if (!data) return;
+        cache.set(q, data);
+        if (input.value.trim() === q) render(data);
+      })
+      .catch(function () { /* aborted by a newer keystroke, or offline */ });
+  }
+
+  input.addEventListener("input", function () {
+    clearTimeout(timer);
+    timer = setTimeout(fetchSuggestions, 80);
+  });
+
+  input.addEventListener("keydown", function (e) {
+    var list = items();
+    if (!menu.classList.contains("show") || !list.length) return;
+    if (e.key === "ArrowDown" || e.key === "ArrowUp") {
+      e.preventDefault();
+      if (active >= 0) list[active].classList.remove("active");
+      var step = e.key === "ArrowDown" ? 1 : -1;
+      active = active < 0 ? (step > 0 ? 0 : list.length - 1) : (active + step + list.length) % list.length;
+      list[active].classList.add("active");
+      list[active].scrollIntoView({ block: "nearest" });
+    } else if (e.key === "Enter" && active >= 0) {
+      e.preventDefault();
+      window.location.href = list[active].href;
+    } else if (e.key === "Escape") {
+      close();
+    }
+  });
+
+  input.addEventListener("blur", function () {
+    // after a click on a suggestion has been handled
+    setTimeout(close, 150);
+  });
+})();
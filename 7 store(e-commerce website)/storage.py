@@ -0,0 +1,129 @@
+"""
+Content-addressed storage for uploaded product images.
+
+An upload is streamed to disk in chunks while it is hashed, then stored as
+<sha256>.<ext>. Identical bytes therefore land on the same file however
+many times (or under whatever names) they are uploaded, and a stored file
+never changes. That lets /uploads serve them with a strong ETag and
+"Cache-Control: immutable".
+"""
+import hashlib
+import os
+import re
+import tempfile
+import click
+from flask import current_app, send_from_directory
+from images import upload_folder_path, DERIVED_DIR
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# <sha256>.<ext>, or one of its derivatives: derived/<sha256>-<width>.<ext>
+_ADDRESSED_RE = re.compile(
+    rf"^(?:{DERIVED_DIR}/)?(?P<digest>[0-9a-f]{{64}})(?P<variant>-\d+)?\.(?P<ext>[a-z0-9]+)$"
+)
+# older uploads were saved as <uuid4 hex>_<original name>
+_LEGACY_RE = re.compile(r"^[0-9a-f]{32}_")
+_EXT_ALIASES = {"jpeg": "jpg"}
+
+
+def _extension(filename):
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
+    return _EXT_ALIASES.get(ext, ext)
+
+
+def store_stream(stream, ext, folder):
+    """Write `stream` under its content hash in `folder`; return the stored name."""
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        name = f"{digest.hexdigest()}.{ext}"
+        target = os.path.join(folder, name)
+        if os.path.exists(target):
+            os.unlink(tmp)  # already stored: keep the existing copy
+        else:
+            os.chmod(tmp, 0o644)  # mkstemp creates 0600; uploads are public
+            os.replace(tmp, target)
+        return name
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def save_upload(file_storage):
+    """Store a Werkzeug FileStorage and return its content-addressed filename."""
+    return store_stream(file_storage.stream, _extension(file_storage.filename),
+                        upload_folder_path(current_app))
+
+
+def is_content_addressed(filename):
+    return _ADDRESSED_RE.match(filename) is not None
+
+
+def send_upload(filename):
+    """
+    Serve an upload. Content-addressed files get a strong ETag derived from
+    their name and a year of immutable caching; legacy names are served with
+    ordinary conditional handling. Both support If-None-Match and Range.
+    """
+    folder = upload_folder_path(current_app)
+    m = _ADDRESSED_RE.match(filename)
+    if not m:
+        return send_from_directory(folder, filename, conditional=True)
+    etag = m.group("digest") + (m.group("variant") or "") + "." + m.group("ext")
+    response = send_from_directory(folder, filename, conditional=True, etag=etag,
+                                   max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_storage(app):
+    @app.cli.command("dedupe-uploads")
+    @click.option("--prune", is_flag=True, help="Also delete legacy uploads no product references.")
+    def dedupe_uploads_command(prune):
+        """Move legacy uploads to content-addressed names and merge duplicates."""
+        from models import db, Product
+        from cache import get_cache
+        from catalog import product_changed
+
+        folder = upload_folder_path(app)
+        renamed = {}
+        for (old,) in Product.query.with_entities(Product.image_filename).distinct():
+            if not old or is_content_addressed(old):
+                continue
+            path = os.path.join(folder, old)
+            if not os.path.exists(path):
+                click.echo(f"missing: {old}")
+                continue
+            with open(path, "rb") as fh:
+                renamed[old] = store_stream(fh, _extension(old), folder)
+
+        for old, new in renamed.items():
+            Product.query.filter_by(image_filename=old).update({"image_filename": new})
+        db.session.commit()
+        if renamed:
+            product_changed()  # catalog ETags (home grid) must stop answering 304 for the old names
+            get_cache().clear()
+
+        removed = 0
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path) or not _LEGACY_RE.match(name):
+                continue  # content-addressed files and site assets (placeholders) stay
+            if name in renamed or prune:
+                os.unlink(path)
+                removed += 1
+        click.echo(f"{len(renamed)} product image(s) now content-addressed, "
+                   f"{len(set(renamed.values()))} distinct file(s), {removed} legacy file(s) removed")
+        if renamed:
+            click.echo("run 'flask build-image-derivatives' to regenerate thumbnails")
@@ -0,0 +1,156 @@
+"""
+Durable, asynchronous Stripe webhook processing.
+
+The /stripe/webhook view only verifies the signature and appends the event
+to the stripe_event table (a local queue), then answers 200. Stripe's
+retries of the same event are dropped there by the unique event_id.
+
+`flask process-webhooks` drains the queue in batches: every batch is
+applied with bulk status updates and a single commit, so a burst of
+events costs a handful of transactions instead of one per event.
+
+If applying a batch fails, its events are applied again one by one, each
+in its own savepoint, so the healthy events still go through. A failing
+event keeps its attempt count and error and is retried on later passes;
+after WEBHOOK_MAX_ATTEMPTS it is parked (marked processed with its
+last_error kept for inspection) so it cannot hold up the queue. Database
+errors (a locked or unavailable database) are not charged to the events:
+the whole batch is retried.
+"""
+import json
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from models import db, StripeEvent
+from orders import mark_orders_paid
+
+PAID_EVENTS = {"checkout.session.completed", "checkout.session.async_payment_succeeded"}
+
+
+def enqueue_event(event_id, event_type, payload):
+    """Queue a verified event. Returns False if it was already queued."""
+    result = db.session.execute(
+        sqlite_insert(StripeEvent)
+        .values(event_id=event_id, type=event_type, payload=payload,
+                received_at=datetime.utcnow(), attempts=0)
+        .on_conflict_do_nothing(index_elements=["event_id"])
+    )
+    db.session.commit()
+    return result.rowcount > 0
+
+
+def _paid_order(event):
+    """(order_id, payment_intent) for a paid checkout session event, else None."""
+    if event.get("type") not in PAID_EVENTS:
+        return None
+    session_obj = event.get("data", {}).get("object", {})
+    if session_obj.get("payment_status") not in (None, "paid", "no_payment_required"):
+        return None  # completed but still processing; async_payment_succeeded follows
+    order_id = (session_obj.get("metadata") or {}).get("order_id")
+    if not order_id:
+        return None
+    intent = session_obj.get("payment_intent")
+    if isinstance(intent, dict):
+        intent = intent.get("id")
+    return int(order_id), intent
+
+
+def drain_once(batch_size=500):
+    """Apply one batch of queued events. Returns the number of events consumed."""
+    events = (StripeEvent.query
+              .filter(StripeEvent.processed_at.is_(None))
+              .order_by(StripeEvent.id)
+              .limit(batch_size)
+              .all())
+    if not events:
+        db.session.rollback()  # end the read so an idle worker holds no transaction
+        return 0
+
+    now = datetime.utcnow()
+    payments = {}
+    pending = []
+    for ev in events:
+        ev.attempts = (ev.attempts or 0) + 1
+        try:
+            paid = _paid_order(json.loads(ev.payload))
+        except (ValueError, TypeError, AttributeError) as e:
+            # a malformed event must not block the queue; keep it for inspection
+            ev.last_error = f"{type(e).__name__}: {e}"
+            ev.processed_at = now
+            continue
+        if paid:
+            order_id, intent = paid
+            payments[order_id] = intent or payments.get(order_id)
+        pending.append((ev, paid))
+
+    try:
+        with db.session.begin_nested():
+            transitioned = mark_orders_paid(payments)
+    except OperationalError:
+        raise
+    except Exception:
+        current_app.logger.exception("Webhook batch failed; applying its events one by one")
+        transitioned = _apply_each(pending, now)
+    else:
+        for ev, _ in pending:
+            ev.processed_at = now
+    db.session.commit()
+    if transitioned:
+        current_app.logger.info("Webhook batch marked %d order(s) paid", len(transitioned))
+    return len(events)
+
+
+def _apply_each(pending, now):
+    """Apply (event, payment) pairs in one savepoint each; record failures on the event."""
+    max_attempts = current_app.config.get("WEBHOOK_MAX_ATTEMPTS", 5)
+    transitioned = []
+    for ev, paid in pending:
+        try:
+            with db.session.begin_nested():
+                if paid:
+                    transitioned += mark_orders_paid(dict([paid]))
+        except OperationalError:
+            raise
+        except Exception as e:
+            ev.last_error = f"{type(e).__name__}: {e}"
+            if ev.attempts >= max_attempts:
+                ev.processed_at = now  # parked: kept for inspection, no longer retried
+                current_app.logger.error("Parked webhook event %s after %d attempts: %s",
+                                         ev.event_id, ev.attempts, ev.last_error)
+            continue
+        ev.processed_at = now
+    return transitioned
+
+
+def run_worker(batch_size=500, poll_interval=1.0, once=False):
+    """Drain the queue until it is empty (once=True) or forever."""
+    total = 0
+    while True:
+        try:
+            n = drain_once(batch_size)
+        except Exception:
+            db.session.rollback()
+            if once:
+                raise
+            current_app.logger.exception("Webhook batch failed; retrying")
+            n = 0
+            time.sleep(poll_interval)
+        total += n
+        if n == 0:
+            if once:
+                return total
+            time.sleep(poll_interval)
+
+
+def init_webhooks(app):
+    @app.cli.command("process-webhooks")
+    @click.option("--batch-size", default=500, show_default=True)
+    @click.option("--interval", default=1.0, show_default=True, help="Seconds to wait when the queue is empty.")
+    @click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+    def process_webhooks_command(batch_size, interval, once):
+        """Run the Stripe webhook queue worker."""
+        total = run_worker(batch_size=batch_size, poll_interval=interval, once=once)
+        click.echo(f"processed {total} event(s)")